@@ -0,0 +1,186 @@
+"""
+Compact API payloads.
+
+Theme responses list the ids of their documents -- positions in the corpus
+snapshot the analysis ran on -- plus a short preview, instead of embedding
+every document text (a document matching several themes used to be sent once
+per theme). Texts are fetched page by page from /api/theme/<name>?page= or by
+id from /api/documents?ids=. ?format=full keeps the old embedded format.
+
+JSON is written without indentation (?pretty=1 indents it), and bodies larger
+than MIN_COMPRESS_BYTES are compressed with brotli (when the optional brotli
+package is installed) or gzip, as negotiated through Accept-Encoding.
+"""
+
+import gzip
+import importlib.util
+import json
+
+from profiling import stage
+from search_index import document_text
+
+# brotli is optional and imported on first use
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+
+# Smaller bodies are sent uncompressed (the framing costs more than it saves)
+MIN_COMPRESS_BYTES = 1024
+
+PREVIEW_DOCUMENTS = 3
+PREVIEW_CHARS = 200
+
+MAX_IDS = 200
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 200
+
+DEFAULT_CLUSTERS = 8
+MAX_CLUSTERS = 50
+
+
+def encode_json(data, pretty=False):
+    """UTF-8 JSON body, compact unless pretty"""
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings the client accepts (q=0 excluded), lowercased"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """Best supported content coding for an Accept-Encoding header, or None"""
+    accepted = accepted_encodings(accept_encoding)
+    if BROTLI_AVAILABLE and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    """Encode a body with a coding from choose_encoding()"""
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def encode_body(data, accept_encoding=None, pretty=False):
+    """
+    Serialize and, when worthwhile, compress a JSON response.
+
+    Returns:
+        (body, content coding or None)
+    """
+    with stage('serialize'):
+        body = encode_json(data, pretty)
+        encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+        return compress(body, encoding), encoding
+
+
+def is_document_list(documents):
+    """Uploaded documents must be a JSON list of strings"""
+    return isinstance(documents, list) and all(isinstance(document, str) for document in documents)
+
+
+def wants_full(params):
+    """?format=full asks for embedded document texts"""
+    return params.get('format', 'compact') == 'full'
+
+
+def compact_theme(theme):
+    """Theme without its document texts (theme dict with 'documents' and 'document_ids')"""
+    compact = {key: value for key, value in theme.items() if key != 'documents'}
+    compact['preview'] = [
+        text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS] + '...'
+        for text in theme.get('documents', ())[:PREVIEW_DOCUMENTS]
+    ]
+    return compact
+
+
+def theme_list(themes, full=False):
+    """Themes as sent by the API: compact unless full"""
+    if full:
+        # Documents of a stored corpus are views (see corpus_store.py)
+        return [theme if isinstance(theme.get('documents', []), list)
+                else dict(theme, documents=list(theme['documents'])) for theme in themes]
+    return [compact_theme(theme) for theme in themes]
+
+
+def document_entry(doc_id, document):
+    """JSON-ready document; chunks also report their source location"""
+    entry = {'id': doc_id, 'text': document_text(document)}
+    if not isinstance(document, str):
+        entry['file_id'] = document.file_id
+        entry.update(document.location())
+    return entry
+
+
+def parse_ids(value, n_documents):
+    """
+    Document ids of an ?ids=1,2,3 parameter.
+
+    Raises:
+        ValueError: for malformed, out of range or too many ids
+    """
+    ids = [int(part) for part in value.split(',') if part.strip()]
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} ids per request")
+    for doc_id in ids:
+        if not 0 <= doc_id < n_documents:
+            raise ValueError(f"Unknown document id {doc_id}")
+    return ids
+
+
+def parse_page(params):
+    """
+    (page, per_page) of ?page=&per_page= parameters, 1-based.
+
+    Raises:
+        ValueError: for non-numeric values
+    """
+    page = max(1, int(params.get('page') or 1))
+    per_page = max(1, min(int(params.get('per_page') or DEFAULT_PER_PAGE), MAX_PER_PAGE))
+    return page, per_page
+
+
+def parse_n_clusters(value):
+    """
+    Number of themes requested (DEFAULT_CLUSTERS when absent), capped at MAX_CLUSTERS.
+
+    Raises:
+        ValueError: for non-numeric values and for zero or fewer themes
+    """
+    if value is None or value == '':
+        return DEFAULT_CLUSTERS
+    n_clusters = int(value)
+    if n_clusters < 1:
+        raise ValueError("n_clusters must be at least 1")
+    return min(n_clusters, MAX_CLUSTERS)
+
+
+def document_page(ids, documents, page, per_page):
+    """
+    One page of documents.
+
+    Args:
+        ids: Corpus ids of the listed documents, in order
+        documents: The corpus (indexed by id)
+    """
+    start = (page - 1) * per_page
+    return {
+        'page': page,
+        'per_page': per_page,
+        'total': len(ids),
+        'pages': (len(ids) + per_page - 1) // per_page,
+        'items': [document_entry(doc_id, documents[doc_id]) for doc_id in ids[start:start + per_page]]
+    }
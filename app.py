@@ -1,40 +1,75 @@
-from flask import Flask, render_template, jsonify, request
+import sys
+
+# Created before the other imports so --profile-startup can time them
+from profiling import StartupProfiler
+startup_profiler = StartupProfiler(enabled='--profile-startup' in sys.argv[1:])
+
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+import argparse
+import itertools
 import os
 import json
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import re
-from collections import Counter
+import threading
+import time
 import logging
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+# numpy and scikit-learn are imported on first use (see cluster_documents and
+# theme_model_manager) so the server binds its port without waiting for them
+from api_format import (
+    accepted_encodings, choose_encoding, document_page, encode_body, is_document_list, parse_ids,
+    parse_n_clusters, parse_page, theme_list, wants_full
+)
+from chunking import add_source_documents, chunk_document
+from dedup import Deduplicator, add_duplicate_counts, collapse_duplicates
+from document_repository import corpus_fingerprint
+from http_cache import TemplateCache, corpus_etag, is_cacheable_api_path, not_modified
+from jobs import JOB_OPTIONS, JobQueue, QueueFull, wants_async
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, IN_FLIGHT, REGISTRY, cache_metrics, corpus_metrics,
+    job_metrics, observe_request
+)
+from profiling import StageTimings, stage, start_request_profile, stop_request_profile
+from query_themes import QUERY_OPTIONS, QueryThemes
+from result_cache import ResultCache
+from search_index import InvertedIndex, search_hit
+from stopwords_pt import PORTUGUESE_STOPWORDS
+from streaming_upload import (
+    NDJSON_CONTENT_TYPE, SSE_CONTENT_TYPE, UPLOAD_LIMITS, ThemeTally, UploadError, format_event,
+    is_streaming_upload, iter_batches, iter_documents, iter_lines, read_blocks, wants_event_stream
+)
+from text_preprocessing import PreprocessingPipeline, TextPreprocessor
+from theme_tree import TREE_OPTIONS, ThemeTreeBuilder
 
 app = Flask(__name__)
 CORS(app)
+# Plain JSON uploads larger than this are answered with 413
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_LIMITS['max_bytes']
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Corpora with at least this many documents use the batched large-corpus engine
+LARGE_CORPUS_THRESHOLD = int(os.getenv('LARGE_CORPUS_THRESHOLD', '5000'))
+
+LARGE_CORPUS_OPTIONS = {
+    'max_features': int(os.getenv('LARGE_CORPUS_MAX_FEATURES', '20000')),
+    'n_components': int(os.getenv('LARGE_CORPUS_SVD_COMPONENTS', '100')) or None,
+    'batch_size': int(os.getenv('LARGE_CORPUS_BATCH_SIZE', '4096'))
+}
+
+# Granularity of uploaded documents analysed with "chunk": true (see chunking.py)
+CHUNK_OPTIONS = {
+    'level': os.getenv('CHUNK_LEVEL', 'paragraph'),
+    'max_chars': int(os.getenv('CHUNK_MAX_CHARS', '4000'))
+}
+
 class RegulationThemeAnalyzer:
     def __init__(self):
-        # Portuguese stopwords
-        self.portuguese_stopwords = set(stopwords.words('portuguese'))
+        # Portuguese stopwords (NLTK's list, bundled so no download is needed)
+        self.portuguese_stopwords = set(PORTUGUESE_STOPWORDS)
         # Add specific electrical sector stopwords
         self.portuguese_stopwords.update([
             'artigo', 'parágrafo', 'inciso', 'alínea', 'lei', 'decreto', 'resolução',
@@ -42,84 +77,199 @@ class RegulationThemeAnalyzer:
             'poder', 'público', 'nacional', 'federal', 'brasileiro', 'energia'
         ])
         
+        # Shared tokenizer (see text_preprocessing.py): lowercase, remove special
+        # characters and numbers, tokenize, remove stopwords and short words.
+        # Token lists are cached per document content.
+        self.pipeline = PreprocessingPipeline(TextPreprocessor(self.portuguese_stopwords))
+        
+        # Near-duplicate detection run before clustering (0 disables it)
+        threshold = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+        self.deduplicator = Deduplicator(threshold=threshold) if threshold > 0 else None
+        
     def preprocess_text(self, text):
         """Preprocess text for analysis"""
         if not text or not isinstance(text, str):
             return ""
         
-        # Convert to lowercase
-        text = text.lower()
+        return ' '.join(self.pipeline.tokenize(text))
+    
+    def deduplicate(self, documents, chunks=None):
+        """
+        Collapse near-identical documents (republished or amended versions)
+        
+        Returns:
+            (documents, chunks, duplicates, positions): canonical documents and
+            chunks, how many duplicates each absorbed (None when deduplication
+            is off) and their positions in the given documents
+        """
+        if self.deduplicator is None:
+            return documents, chunks, None, list(range(len(documents)))
+        with stage('preprocess'):
+            tokens = self.pipeline.tokenize_many(documents)
+        unique, unique_chunks, result = collapse_duplicates(self.deduplicator, documents, tokens, chunks)
+        if result.collapsed:
+            logger.info(f"Collapsed {result.collapsed} near-duplicate documents")
+        return unique, unique_chunks, result.duplicates, result.canonical
+    
+    def extract_themes(self, documents, n_clusters=8, large_corpus=None, timings=None, chunks=None,
+                       duplicates=None, ids=None):
+        """
+        Extract themes from documents using clustering
         
-        # Remove special characters and numbers
-        text = re.sub(r'[^a-záàâãéêíóôõúçñ\s]', '', text)
+        Args:
+            documents: Document texts
+            n_clusters: Number of themes to extract
+            large_corpus: Use the batched LargeCorpusClusterer (float32 sparse
+                TF-IDF, optional SVD, MiniBatchKMeans). By default it is used
+                from LARGE_CORPUS_THRESHOLD documents on.
+            timings: Optional StageTimings filled with the duration of each stage
+            chunks: Chunks the texts came from (chunking.Chunk, aligned with
+                documents); each theme then also lists its source documents
+            duplicates: Near-duplicates collapsed into each document (see
+                dedup.py); each theme then reports 'duplicates_collapsed'
+            ids: Corpus id of each document, listed in 'document_ids'
+                (default: its position in documents)
+        """
+        themes, _ = self.cluster_documents(documents, n_clusters, large_corpus, timings, chunks,
+                                           duplicates, ids)
+        return themes
+    
+    def fit_theme_model(self, documents, n_clusters=8, large_corpus=None):
+        """
+        Cluster documents and freeze the result into a reusable ThemeModel
         
-        # Tokenize
-        tokens = word_tokenize(text, language='portuguese')
+        Returns:
+            ThemeModel, or None if the documents could not be clustered
+        """
+        from theme_model import ThemeModel
         
-        # Remove stopwords and short words
-        filtered_tokens = [
-            token for token in tokens 
-            if token not in self.portuguese_stopwords and len(token) > 2
-        ]
+        themes, fitted = self.cluster_documents(documents, n_clusters, large_corpus)
+        if fitted is None:
+            return None
         
-        return ' '.join(filtered_tokens)
+        return ThemeModel.from_fit(
+            fitted['processed_docs'],
+            terms=fitted['terms'],
+            idf=fitted['idf'],
+            centroids=fitted['centroids'],
+            themes=[{'theme': t['theme'], 'keywords': list(t['keywords'])} for t in fitted['themes']],
+            ngram_range=fitted['ngram_range']
+        )
     
-    def extract_themes(self, documents, n_clusters=8):
-        """Extract themes from documents using clustering"""
+    def cluster_documents(self, documents, n_clusters=8, large_corpus=None, timings=None, chunks=None,
+                          duplicates=None, ids=None):
+        """
+        Cluster documents into themes
+        
+        Returns:
+            (themes, fitted): themes sorted by size, and the fitted vocabulary,
+            IDF weights, term-space centroids and per-cluster themes (None when
+            clustering fell back to a single general theme)
+        """
         if not documents:
-            return []
+            return [], None
+        if ids is None:
+            ids = range(len(documents))
+        general_theme = {"theme": "Regulamentação Geral", "keywords": ["energia", "elétrica"],
+                         "documents": documents, "document_ids": list(ids), "size": len(documents)}
         
-        # Preprocess documents
-        processed_docs = [self.preprocess_text(doc) for doc in documents]
-        processed_docs = [doc for doc in processed_docs if doc.strip()]
+        if timings is None:
+            timings = StageTimings()
+        
+        # Preprocess documents, remembering which original document each one is
+        with timings.stage('preprocess'):
+            processed = [(i, ' '.join(tokens))
+                         for i, tokens in enumerate(self.pipeline.iter_tokens(documents)) if tokens]
+        doc_indices = [i for i, _ in processed]
+        processed_docs = [doc for _, doc in processed]
         
         if len(processed_docs) < 2:
-            return [{"theme": "Regulamentação Geral", "keywords": ["energia", "elétrica"], "documents": documents}]
-        
-        # TF-IDF Vectorization
-        vectorizer = TfidfVectorizer(
-            max_features=1000,
-            ngram_range=(1, 3),
-            min_df=2,
-            max_df=0.8
-        )
+            return [general_theme], None
+        
+        if large_corpus is None:
+            large_corpus = len(processed_docs) >= LARGE_CORPUS_THRESHOLD
         
         try:
-            tfidf_matrix = vectorizer.fit_transform(processed_docs)
-            
-            # Clustering
-            n_clusters = min(n_clusters, len(processed_docs))
-            kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-            cluster_labels = kmeans.fit_predict(tfidf_matrix)
-            
-            # Extract themes
-            feature_names = vectorizer.get_feature_names_out()
-            themes = []
-            
-            for cluster_id in range(n_clusters):
-                # Get documents in this cluster
-                cluster_docs = [documents[i] for i, label in enumerate(cluster_labels) if label == cluster_id]
+            if large_corpus:
+                from clustering import LargeCorpusClusterer
                 
-                # Get top keywords for this cluster
-                cluster_center = kmeans.cluster_centers_[cluster_id]
-                top_indices = cluster_center.argsort()[-10:][::-1]
-                keywords = [feature_names[i] for i in top_indices]
+                clusterer = LargeCorpusClusterer(n_clusters=n_clusters, **LARGE_CORPUS_OPTIONS)
+                clusterer.timings = timings
+                cluster_labels = clusterer.fit_predict(processed_docs)
+                n_clusters = clusterer.kmeans.n_clusters
+                cluster_keywords = clusterer.cluster_keywords
+                vectorizer = clusterer.vectorizer
+                centroids = clusterer.term_space_centroids()
+            else:
+                from sklearn.cluster import KMeans
+                from sklearn.feature_extraction.text import TfidfVectorizer
                 
-                # Generate theme name based on keywords
-                theme_name = self.generate_theme_name(keywords)
+                # TF-IDF Vectorization
+                vectorizer = TfidfVectorizer(
+                    max_features=1000,
+                    ngram_range=(1, 3),
+                    min_df=2,
+                    max_df=0.8
+                )
+                with timings.stage('vectorize'):
+                    tfidf_matrix = vectorizer.fit_transform(processed_docs)
                 
-                themes.append({
-                    "theme": theme_name,
-                    "keywords": keywords,
-                    "documents": cluster_docs,
-                    "size": len(cluster_docs)
-                })
+                # Clustering
+                n_clusters = min(n_clusters, len(processed_docs))
+                kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+                with timings.stage('cluster'):
+                    cluster_labels = kmeans.fit_predict(tfidf_matrix)
+                
+                feature_names = vectorizer.get_feature_names_out()
+                centroids = kmeans.cluster_centers_
+                
+                def cluster_keywords(cluster_id):
+                    # Get top keywords for this cluster
+                    cluster_center = kmeans.cluster_centers_[cluster_id]
+                    top_indices = cluster_center.argsort()[-10:][::-1]
+                    return [feature_names[i] for i in top_indices]
+            
+            # Extract themes
+            with timings.stage('themes'):
+                cluster_members = [[] for _ in range(n_clusters)]
+                for doc_index, label in zip(doc_indices, cluster_labels):
+                    cluster_members[label].append(doc_index)
+                cluster_docs = [[documents[i] for i in members] for members in cluster_members]
+                
+                themes = []
+                for cluster_id in range(n_clusters):
+                    keywords = cluster_keywords(cluster_id)
+                    
+                    # Generate theme name based on keywords
+                    theme_name = self.generate_theme_name(keywords)
+                    
+                    themes.append({
+                        "theme": theme_name,
+                        "keywords": keywords,
+                        "documents": cluster_docs[cluster_id],
+                        "document_ids": [ids[i] for i in cluster_members[cluster_id]],
+                        "size": len(cluster_docs[cluster_id])
+                    })
+                    if chunks is not None:
+                        add_source_documents(themes[-1], chunks, cluster_members[cluster_id])
+                    if duplicates is not None:
+                        add_duplicate_counts(themes[-1], duplicates, cluster_members[cluster_id])
             
-            return sorted(themes, key=lambda x: x['size'], reverse=True)
+            timings.log(f"extract_themes ({len(processed_docs)} documents, "
+                        f"{'large corpus' if large_corpus else 'standard'} mode)")
+            fitted = {
+                'processed_docs': processed_docs,
+                'terms': vectorizer.get_feature_names_out().tolist(),
+                'idf': vectorizer.idf_,
+                'centroids': centroids,
+                'ngram_range': vectorizer.ngram_range,
+                'themes': themes
+            }
+            return sorted(themes, key=lambda x: x['size'], reverse=True), fitted
             
         except Exception as e:
             logger.error(f"Error in theme extraction: {e}")
-            return [{"theme": "Regulamentação Geral", "keywords": ["energia", "elétrica"], "documents": documents}]
+            return [general_theme], None
     
     def generate_theme_name(self, keywords):
         """Generate a meaningful theme name from keywords"""
@@ -173,67 +323,689 @@ SAMPLE_REGULATIONS = [
     "Instrução sobre aspectos ambientais da geração de energia elétrica"
 ]
 
+SAMPLE_VERSION = corpus_fingerprint(SAMPLE_REGULATIONS)
+
+# Theme results memoized by corpus fingerprint and analysis parameters
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '128')),
+    max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024)
+)
+
+def get_theme_analysis(documents, version=None, n_clusters=8, chunks=None):
+    """
+    Themes for a corpus, memoized by corpus version and parameters.
+    
+    Returns:
+        Dict with the sorted 'themes' list and a 'by_name' lookup table
+    """
+    if version is None:
+        version = corpus_fingerprint(documents)
+    
+    return result_cache.get_or_compute(
+        (version, 'kmeans', n_clusters, chunks is not None),
+        lambda: analyze_documents(documents, chunks, n_clusters=n_clusters)
+    )
+
+def analyze_documents(documents, chunks=None, ids=None, n_clusters=8):
+    """
+    Deduplicate, then cluster documents (ids: corpus id of each document,
+    default its position)
+    """
+    timings = StageTimings()
+    with timings.stage('dedup'):
+        unique, unique_chunks, duplicates, positions = analyzer.deduplicate(list(documents), chunks)
+    if ids is not None:
+        positions = [ids[p] for p in positions]
+    themes = analyzer.extract_themes(unique, n_clusters=n_clusters, timings=timings,
+                                     chunks=unique_chunks, duplicates=duplicates, ids=positions)
+    # reversed() so the first theme wins when two share a name
+    return {
+        'themes': themes,
+        'by_name': {t['theme']: t for t in reversed(themes)},
+        'unique_documents': len(unique),
+        'timings': timings.as_dict()
+    }
+
+# Fit-once theme model used to assign uploaded documents to the existing
+# themes; created on first use because theme_model imports scikit-learn
+_theme_models = None
+_theme_models_lock = threading.Lock()
+
+def theme_model_manager():
+    """The process-wide ThemeModelManager"""
+    global _theme_models
+    with _theme_models_lock:
+        if _theme_models is None:
+            from theme_model import ThemeModelManager
+            
+            _theme_models = ThemeModelManager(
+                directory=os.getenv('THEME_MODEL_DIR', '.cache/theme_model') or None,
+                fit_model=analyzer.fit_theme_model,
+                preprocess=analyzer.preprocess_text,
+                drift_threshold=float(os.getenv('THEME_MODEL_DRIFT_THRESHOLD', '0.3')),
+                max_refit_documents=int(os.getenv('THEME_MODEL_MAX_REFIT_DOCUMENTS', '5000'))
+            )
+        return _theme_models
+
+# Nearest-neighbour index over the theme model's document vectors, loaded
+# (memory-mapped) or built on first use
+_similarity_index = None
+_similarity_index_lock = threading.Lock()
+
+def similarity_index(documents, version):
+    """The VectorIndex of a corpus version, or None if no theme model could be fitted"""
+    global _similarity_index
+    with _similarity_index_lock:
+        if _similarity_index is not None and _similarity_index.corpus_version == version:
+            return _similarity_index
+        
+        from vector_index import VectorIndex, document_vectors
+        
+        directory = os.getenv('SIMILARITY_INDEX_DIR', '.cache/similarity_index') or None
+        index = VectorIndex.load(directory) if directory else None
+        if index is None or index.corpus_version != version:
+            model = theme_model_manager().ensure_model(documents, version)
+            if model is None:
+                return None
+            processed = [analyzer.preprocess_text(doc) for doc in documents]
+            vectors = document_vectors(
+                model, processed, dimensions=int(os.getenv('SIMILARITY_DIMENSIONS', '128'))
+            )
+            index = VectorIndex.build(
+                vectors,
+                ivf_threshold=int(os.getenv('SIMILARITY_IVF_THRESHOLD', '200000')),
+                corpus_version=version
+            )
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+                index.save(directory)
+                index = VectorIndex.load(directory)
+        _similarity_index = index
+        return index
+
+# BM25 index over the corpus, built from the analyzer's token stream
+search_index = InvertedIndex(analyzer.pipeline.iter_tokens, analyzer.pipeline.tokenize)
+
+# Sub-themes of every theme, built once per corpus version
+theme_tree = ThemeTreeBuilder(analyzer.pipeline.tokenize_many, **TREE_OPTIONS)
+
+# /api/themes?q=: themes of the best matches of a query, cached per query
+query_themes = QueryThemes(search_index, analyze_documents, result_cache, analyzer.pipeline.tokenize,
+                           method='kmeans', **QUERY_OPTIONS)
+
+def get_theme_tree(documents, version):
+    """Theme tree of a corpus version (updated from the previous version's tree)"""
+    return theme_tree.sync(documents, get_theme_analysis(documents, version)['themes'], version)
+
+# Large uploads and full-corpus clustering runs are analysed as jobs, in
+# worker processes (see jobs.py)
+job_queue = JobQueue(processes=True, **JOB_OPTIONS)
+
+def analyze_upload(documents, n_clusters=8, chunk=False, full=False):
+    """
+    Themes of uploaded documents, or of the article/paragraph chunks of full
+    regulation texts: the /api/upload response. Also run as a job, in a
+    worker process.
+    """
+    chunks = None
+    if chunk:
+        chunks = [chunk for i, doc in enumerate(documents)
+                  for chunk in chunk_document(f"upload-{i}", doc, **CHUNK_OPTIONS)]
+        analysis = get_theme_analysis([c.text for c in chunks], n_clusters=n_clusters, chunks=chunks)
+    else:
+        analysis = get_theme_analysis(documents, n_clusters=n_clusters)
+    response = {
+        'success': True,
+        'themes': theme_list(analysis['themes'], full),
+        'total_documents': len(documents),
+        'unique_documents': analysis['unique_documents'],
+        'timings': analysis['timings']
+    }
+    if chunks is not None:
+        response['total_chunks'] = len(chunks)
+    return response
+
+def analyze_corpus(n_clusters=8, full=False):
+    """The /api/themes response for any number of clusters (run as a job)"""
+    analysis = get_theme_analysis(SAMPLE_REGULATIONS, SAMPLE_VERSION, n_clusters=n_clusters)
+    return {
+        'success': True,
+        'themes': theme_list(analysis['themes'], full),
+        'total_documents': len(SAMPLE_REGULATIONS),
+        'unique_documents': analysis['unique_documents'],
+        'corpus_version': SAMPLE_VERSION,
+        'timings': analysis['timings']
+    }
+
+def submit_job(key, function, *args):
+    """202 with the new (or merged identical) job, or 503 when the queue is full"""
+    try:
+        job, merged = job_queue.submit(key, function, *args)
+    except QueueFull as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    response = json_response({'success': True, 'merged': merged, 'job': job}, status=202)
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+def submit_upload_job(documents, n_clusters, chunk, full):
+    return submit_job(('upload', corpus_fingerprint(documents), n_clusters, chunk, full),
+                      analyze_upload, documents, n_clusters, chunk, full)
+
+# Set once warm_up() has loaded the ML stack and computed the sample analysis
+warm_event = threading.Event()
+
+def warm_up():
+    """Load the ML stack and precompute the default analysis in the background"""
+    try:
+        search_index.sync(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        get_theme_tree(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        theme_model_manager().ensure_model(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        similarity_index(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        logger.info("Warm-up complete")
+    except Exception as e:
+        logger.error(f"Error warming up: {e}")
+    finally:
+        warm_event.set()
+        startup_profiler.mark('warm up')
+        startup_profiler.report()
+
+def app_metrics():
+    """Collector of the served corpus and the caches for /metrics"""
+    families = corpus_metrics(SAMPLE_REGULATIONS, SAMPLE_VERSION, 'sample_data')
+    families += cache_metrics('result_cache', result_cache.stats())
+    families += cache_metrics('token_cache', analyzer.pipeline.stats())
+    families.append(('search_index_documents', 'gauge', 'Documents in the search index',
+                     [({}, search_index.stats()['documents'])]))
+    families += job_metrics(job_queue.stats())
+    return families
+
+REGISTRY.add_collector(app_metrics)
+
+# HTML templates held in memory, reloaded when the files change
+templates = TemplateCache(os.path.join(app.root_path, app.template_folder))
+
+@app.before_request
+def start_measurement():
+    """Time the request and, with ?profile=1, profile its stages"""
+    g.started = time.perf_counter()
+    g.profile = start_request_profile() if request.args.get('profile') in ('1', 'true') else None
+    IN_FLIGHT.inc()
+
+@app.before_request
+def revalidate_api_request():
+    """Answer conditional GETs of unchanged API responses with 304"""
+    g.etag = None
+    # Profiled responses carry their own timings and are never revalidated
+    if request.method == 'GET' and is_cacheable_api_path(request.path) and g.profile is None:
+        # Same corpus version and URL, same response
+        target = request.full_path if request.query_string else request.path
+        g.etag = corpus_etag(SAMPLE_VERSION, target)
+        if not_modified(request.headers, g.etag):
+            return not_modified_response(g.etag)
+
+@app.after_request
+def add_etag(response):
+    if getattr(g, 'etag', None) and response.status_code == 200:
+        response.headers['ETag'] = g.etag
+        response.headers['Cache-Control'] = 'no-cache'
+    if getattr(g, 'profile', None) is not None:
+        response.headers['Server-Timing'] = g.profile.server_timing()
+    g.status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request(error=None):
+    """Request count and latency by route (streamed responses: once the stream ends)"""
+    if 'started' not in g:
+        return
+    IN_FLIGHT.dec()
+    stop_request_profile()
+    route = request.url_rule.rule if request.url_rule is not None else 'other'
+    observe_request(request.method, route, g.get('status', 500), time.perf_counter() - g.started)
+
+def not_modified_response(etag, last_modified=None):
+    response = Response(status=304)
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def template_response(name):
+    """A cached HTML template, gzip-compressed when accepted, or 304 when current"""
+    template = templates.get(name)
+    if not_modified(request.headers, template.etag, template.mtime):
+        return not_modified_response(template.etag, template.last_modified)
+    compressed = 'gzip' in accepted_encodings(request.headers.get('Accept-Encoding'))
+    response = Response(template.gzip_body if compressed else template.body, mimetype='text/html')
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['ETag'] = template.etag
+    response.headers['Last-Modified'] = template.last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    return template_response('index.html')
+
+@app.route('/health')
+def health():
+    """Liveness check; answers before the models are warm"""
+    return jsonify({
+        'status': 'ok',
+        'warm': warm_event.is_set(),
+        'corpus_version': SAMPLE_VERSION,
+        'total_documents': len(SAMPLE_REGULATIONS)
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Request, stage, cache, corpus and memory metrics in the Prometheus text format"""
+    response = Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def json_response(data, status=200):
+    """JSON response, compact unless ?pretty=1 and compressed when accepted"""
+    if g.profile is not None and isinstance(data, dict):
+        data = dict(data, profile=g.profile.as_dict())
+    body, encoding = encode_body(data, request.headers.get('Accept-Encoding'), wants_pretty())
+    return body_response(body, encoding, status)
+
+def cached_json_response(key, build):
+    """
+    JSON response serialized and compressed once per cache key.
+    
+    Args:
+        key: Result cache key starting with the corpus version
+        build: Callable returning the response data
+    """
+    if g.profile is not None:
+        # Serialized afresh, so the profile shows what a cache miss costs
+        return json_response(build())
+    accept_encoding = request.headers.get('Accept-Encoding')
+    pretty = wants_pretty()
+    body, encoding = result_cache.get_or_compute(
+        key + (pretty, choose_encoding(accept_encoding)),
+        lambda: encode_body(build(), accept_encoding, pretty)
+    )
+    return body_response(body, encoding)
+
+def body_response(body, encoding, status=200):
+    response = Response(body, status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def wants_pretty():
+    return request.args.get('pretty') in ('1', 'true')
 
 @app.route('/api/themes')
 def get_themes():
-    """Get theme analysis"""
+    """Get theme analysis (document ids, or texts with ?format=full); ?q= narrows it to a query"""
+    query = request.args.get('q', '').strip()
+    if query:
+        return get_query_themes(query)
     try:
         # For demo, use sample data. In production, this would load from vector DB or files
-        themes = analyzer.extract_themes(SAMPLE_REGULATIONS)
-        return jsonify({
+        analysis = get_theme_analysis(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        full = wants_full(request.args)
+        return cached_json_response((SAMPLE_VERSION, 'body', 'themes', full), lambda: {
             'success': True,
-            'themes': themes,
-            'total_documents': len(SAMPLE_REGULATIONS)
+            'themes': theme_list(analysis['themes'], full),
+            'total_documents': len(SAMPLE_REGULATIONS),
+            'unique_documents': analysis['unique_documents'],
+            'corpus_version': SAMPLE_VERSION,
+            'timings': analysis['timings']
         })
     except Exception as e:
         logger.error(f"Error getting themes: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def get_query_themes(query):
+    """Themes of the sample documents best matching a query (see query_themes.py)"""
+    full = wants_full(request.args)
+    try:
+        search_index.sync(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        analysis = query_themes.analysis(query)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting themes for query {query!r}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return cached_json_response(
+        (analysis['corpus_version'], 'body', 'themes', full, 'query', analysis['query']), lambda: {
+            'success': True,
+            'query': analysis['query'],
+            'themes': theme_list(analysis['themes'], full),
+            'total_documents': len(SAMPLE_REGULATIONS),
+            'matched_documents': analysis['matched_documents'],
+            'analysed_documents': analysis['analysed_documents'],
+            'unique_documents': analysis['unique_documents'],
+            'corpus_version': analysis['corpus_version'],
+            'timings': analysis['timings']
+        }
+    )
+
+@app.route('/api/search')
+def search():
+    """BM25-ranked search over the corpus, optionally within one theme"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'Missing query parameter q'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', '10')), 100))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+    theme_name = request.args.get('theme')
+    
+    try:
+        started = time.perf_counter()
+        search_index.sync(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+        within = None
+        if theme_name:
+            analysis = get_theme_analysis(SAMPLE_REGULATIONS, SAMPLE_VERSION)
+            theme = analysis['by_name'].get(theme_name)
+            if not theme:
+                return jsonify({'success': False, 'error': 'Theme not found'}), 404
+            # Theme members as index doc ids, computed once per theme and index version
+            within = result_cache.get_or_compute(
+                (SAMPLE_VERSION, 'search_scope', theme_name, search_index.version),
+                lambda: search_index.doc_ids(theme['documents'])
+            )
+        
+        results, total = search_index.search(query, limit=limit, within=within)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'theme': theme_name,
+            'total': total,
+            'results': [search_hit(score, document) for score, document in results],
+            'took_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+    except Exception as e:
+        logger.error(f"Error searching: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Industrial location engine, created on first use
+_location_scorer = None
+
+@app.route('/api/industrial-location/score', methods=['POST'])
+def score_industrial_location():
+    """Score batches of industrial location scenarios (see industrial_location.py)"""
+    global _location_scorer
+    from industrial_location import LocationScorer, ScenarioError
+    
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    if _location_scorer is None:
+        _location_scorer = LocationScorer()
+    
+    try:
+        started = time.perf_counter()
+        response = _location_scorer.score(request_data)
+        response['success'] = True
+        response['took_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return json_response(response)
+    except ScenarioError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error scoring industrial location scenarios: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/documents')
+def get_documents():
+    """Documents by id (?ids=1,2,3) or page by page (?page=&per_page=)"""
+    documents = SAMPLE_REGULATIONS
+    try:
+        page, per_page = parse_page(request.args)
+        if request.args.get('ids'):
+            ids = parse_ids(request.args['ids'], len(documents))
+            page, per_page = 1, max(1, len(ids))
+        else:
+            ids = range(len(documents))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    response = {'success': True, 'corpus_version': SAMPLE_VERSION}
+    response.update(document_page(ids, documents, page, per_page))
+    return json_response(response)
+
+@app.route('/api/document/<int:doc_id>/similar')
+def get_similar_documents(doc_id):
+    """Documents closest to one document of the corpus (cosine over TF-IDF/SVD vectors)"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', '10')), 100))
+        n_probe = max(1, int(request.args.get('n_probe', '16')))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid limit or n_probe'}), 400
+    
+    documents = SAMPLE_REGULATIONS
+    if doc_id >= len(documents):
+        return jsonify({'success': False, 'error': 'Document not found'}), 404
+    
+    try:
+        index = similarity_index(documents, SAMPLE_VERSION)
+        if index is None:
+            return jsonify({'success': False, 'error': 'Similarity index not available'}), 503
+        
+        started = time.perf_counter()
+        neighbours = index.similar(doc_id, k=limit, n_probe=n_probe)
+        return jsonify({
+            'success': True,
+            'document': {'id': doc_id, 'text': documents[doc_id]},
+            'similar': [
+                {'id': other_id, 'score': round(score, 4), 'text': documents[other_id]}
+                for other_id, score in neighbours
+            ],
+            'index': index.status(),
+            'took_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+    except Exception as e:
+        logger.error(f"Error finding similar documents: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/theme/<theme_name>')
 def get_theme_details(theme_name):
-    """Get detailed information about a specific theme"""
+    """Get detailed information about a specific theme, with one page of its documents"""
     try:
-        themes = analyzer.extract_themes(SAMPLE_REGULATIONS)
-        theme = next((t for t in themes if t['theme'] == theme_name), None)
+        page, per_page = parse_page(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid page or per_page'}), 400
+    try:
+        # Top-level themes and sub-themes at any depth are looked up by name
+        node = get_theme_tree(SAMPLE_REGULATIONS, SAMPLE_VERSION).node(theme_name)
         
-        if not theme:
+        if not node:
             return jsonify({'success': False, 'error': 'Theme not found'}), 404
         
-        # For each document in the theme, extract sub-themes
-        sub_themes = analyzer.extract_themes(theme['documents'], n_clusters=min(4, len(theme['documents'])))
-        
-        return jsonify({
+        theme = node.theme
+        full = wants_full(request.args)
+        return json_response({
             'success': True,
-            'theme': theme,
-            'sub_themes': sub_themes
+            'theme': theme_list([theme], full)[0],
+            'path': node.path(),
+            'sub_themes': theme_list(node.sub_themes, full),
+            'documents': document_page(theme['document_ids'], SAMPLE_REGULATIONS, page, per_page),
+            'corpus_version': SAMPLE_VERSION
         })
     except Exception as e:
         logger.error(f"Error getting theme details: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def stream_upload_events(documents, event_stream):
+    """
+    Assign streamed (document id, text) pairs to the fitted themes batch by
+    batch, yielding each batch's result as soon as it is ready.
+    
+    Errors before the first event are raised; later ones end the stream with
+    an error event.
+    """
+    started = time.perf_counter()
+    tally = ThemeTally()
+    theme_models = theme_model_manager()
+    try:
+        if theme_models.ensure_model(SAMPLE_REGULATIONS, SAMPLE_VERSION) is None:
+            raise UploadError("Theme model unavailable", status=503)
+        for batch in iter_batches(documents, UPLOAD_LIMITS['batch_size']):
+            model, labels = theme_models.assign_labels([text for _, text in batch])
+            themes = [(model.themes[label]['theme'], model.themes[label]['keywords'])
+                      for label in labels]
+            yield format_event(tally.add_batch([(doc_id, [theme]) for (doc_id, _), theme
+                                                in zip(batch, themes)]), event_stream)
+        if not tally.documents:
+            raise UploadError("No documents provided")
+        yield format_event(tally.summary(took_ms=round((time.perf_counter() - started) * 1000, 3)),
+                           event_stream)
+    except Exception as e:
+        if not tally.batches:
+            raise
+        logger.error(f"Error in streamed upload: {e}")
+        yield format_event({'success': False, 'error': str(e),
+                            'status': getattr(e, 'status', 500), 'processed': tally.documents},
+                           event_stream)
+
+def upload_stream():
+    """NDJSON upload answered with progressive NDJSON or server-sent events"""
+    event_stream = wants_event_stream(request.headers.get('Accept'))
+    # The WSGI input is already de-chunked and ends with the body
+    blocks = read_blocks(request.stream, max_bytes=UPLOAD_LIMITS['max_bytes'])
+    documents = iter_documents(iter_lines(blocks, UPLOAD_LIMITS['max_document_bytes']))
+    events = stream_upload_events(documents, event_stream)
+    try:
+        # Compute the first batch now so early errors still get a status code
+        first = next(events)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    return Response(
+        stream_with_context(itertools.chain([first], events)),
+        mimetype=SSE_CONTENT_TYPE if event_stream else NDJSON_CONTENT_TYPE,
+        headers={'Cache-Control': 'no-cache'}
+    )
+
 @app.route('/api/upload', methods=['POST'])
 def upload_documents():
     """Upload and analyze custom documents"""
+    if is_streaming_upload(request.content_type):
+        try:
+            return upload_stream()
+        except RequestEntityTooLarge:
+            return jsonify({'success': False, 'error': f"Upload larger than {UPLOAD_LIMITS['max_bytes']} bytes"}), 413
+        except Exception as e:
+            logger.error(f"Error uploading documents: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
     try:
-        data = request.json
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
         documents = data.get('documents', [])
         
         if not documents:
             return jsonify({'success': False, 'error': 'No documents provided'}), 400
+        if not is_document_list(documents):
+            return jsonify({'success': False, 'error': 'documents must be a list of strings'}), 400
         
-        themes = analyzer.extract_themes(documents)
-        return jsonify({
-            'success': True,
-            'themes': themes,
-            'total_documents': len(documents)
-        })
+        if data.get('assign'):
+            # Place the documents into the existing themes without refitting
+            theme_models = theme_model_manager()
+            if theme_models.ensure_model(SAMPLE_REGULATIONS, SAMPLE_VERSION) is not None:
+                return jsonify({
+                    'success': True,
+                    'themes': theme_list(theme_models.assign(documents), wants_full(data)),
+                    'total_documents': len(documents),
+                    'model': theme_models.status()
+                })
+        
+        try:
+            n_clusters = parse_n_clusters(data.get('n_clusters'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid n_clusters'}), 400
+        
+        chunk = bool(data.get('chunk'))
+        if wants_async(request.args, request.headers.get('Prefer')):
+            return submit_upload_job(documents, n_clusters, chunk, wants_full(data))
+        return jsonify(analyze_upload(documents, n_clusters, chunk, wants_full(data)))
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': f"Upload larger than {UPLOAD_LIMITS['max_bytes']} bytes"}), 413
     except Exception as e:
         logger.error(f"Error uploading documents: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Analyse uploaded documents, or without documents the corpus, as a job"""
+    try:
+        data = request.get_json(force=True) if request.get_data() else {}
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        n_clusters = parse_n_clusters(data.get('n_clusters'))
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': f"Upload larger than {UPLOAD_LIMITS['max_bytes']} bytes"}), 413
+    except Exception as e:
+        return jsonify({'success': False, 'error': f"Invalid job: {e}"}), 400
+    
+    documents = data.get('documents')
+    full = wants_full(data)
+    if not documents:
+        return submit_job(('corpus', SAMPLE_VERSION, n_clusters, full), analyze_corpus, n_clusters, full)
+    if not is_document_list(documents):
+        return jsonify({'success': False, 'error': 'documents must be a list of strings'}), 400
+    return submit_upload_job(documents, n_clusters, bool(data.get('chunk')), full)
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Progress of a job, and its result once done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+    return json_response({'success': True, 'job': job})
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Theme Navigator Flask server")
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'),
+                        help="Address to bind (default: all interfaces)")
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')),
+                        help="Port to listen on (default: 5000)")
+    parser.add_argument('--debug', action='store_true',
+                        help="Run the Flask development server with the debugger and reloader")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Print import and startup phase timings once warm-up is done")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Bind the port first, then warm the models in the background"""
+    args = parse_args(argv)
+    startup_profiler.mark('imports')
+    
+    if args.debug:
+        app.run(debug=True, host=args.host, port=args.port)
+        return
+    
+    from werkzeug.serving import make_server
+    
+    server = make_server(args.host, args.port, app, threaded=True)
+    startup_profiler.mark('bind port')
+    logger.info(f"Serving on http://{args.host}:{args.port}")
+    
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        job_queue.shutdown()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    main()
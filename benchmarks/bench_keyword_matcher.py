@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark extract_themes_simple: the original per-keyword substring scan
+versus the compiled ThemeKeywordMatcher.
+
+Usage:
+    python3 benchmarks/bench_keyword_matcher.py [--sizes 10000 100000] [--seed 42]
+
+Both implementations run on the same synthetic ANEEL-style corpus and their
+outputs are compared before any timing is reported.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_server import RegulationThemeAnalyzer, SAMPLE_REGULATIONS
+
+
+FILLER_WORDS = [
+    'agência', 'nacional', 'elétrica', 'aneel', 'considerando', 'dispõe', 'sobre',
+    'procedimentos', 'estabelece', 'critérios', 'regras', 'aplicação', 'prazo',
+    'concessionária', 'permissionária', 'unidade', 'consumidora', 'sistema',
+    'medição', 'contrato', 'revisão', 'ciclo', 'anual', 'vigência', 'publicação',
+    'bandeira', 'tarifária', 'submódulo', 'prodist', 'procedimento', 'compensação'
+]
+
+
+def build_corpus(size, seed=42):
+    """Synthetic documents mixing sample sentences, theme keywords and filler"""
+    rng = random.Random(seed)
+    analyzer = RegulationThemeAnalyzer()
+    keywords = [kw for _, kws in analyzer.theme_keywords.values() for kw in kws]
+    sample_words = ' '.join(SAMPLE_REGULATIONS).split()
+
+    documents = []
+    for i in range(size):
+        words = rng.sample(sample_words, 8) + rng.sample(FILLER_WORDS, 6)
+        words += rng.sample(keywords, rng.randint(0, 3))
+        # A few unique tokens per document so the vocabulary keeps growing
+        words.append(f"processo{rng.randint(0, size)}")
+        rng.shuffle(words)
+        documents.append(f"Resolução Normativa nº {i} - " + ' '.join(words))
+    return documents
+
+
+def extract_themes_legacy(analyzer, documents, n_clusters=8):
+    """The original implementation, kept here as the reference"""
+    theme_counts = {theme: 0 for theme in analyzer.theme_keywords}
+    theme_docs = {theme: [] for theme in analyzer.theme_keywords}
+    unclassified_docs = []
+
+    for doc in documents:
+        words = analyzer.preprocess_text(doc)
+        doc_themes = []
+        for theme_key, (theme_name, keywords) in analyzer.theme_keywords.items():
+            for keyword in keywords:
+                if keyword in ' '.join(words):
+                    theme_counts[theme_key] += 1
+                    theme_docs[theme_key].append(doc)
+                    doc_themes.append(theme_key)
+                    break
+        if not doc_themes:
+            unclassified_docs.append(doc)
+
+    themes = []
+    for theme_key, count in theme_counts.items():
+        if count > 0:
+            theme_name, keywords = analyzer.theme_keywords[theme_key]
+            themes.append({'theme': theme_name, 'keywords': keywords,
+                           'documents': theme_docs[theme_key], 'size': count})
+    if unclassified_docs:
+        themes.append({'theme': 'Regulamentação Geral',
+                       'keywords': ['energia', 'elétrica', 'regulamentação'],
+                       'documents': unclassified_docs, 'size': len(unclassified_docs)})
+    themes.sort(key=lambda x: x['size'], reverse=True)
+    return themes[:n_clusters]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    print(f"{'documents':>10} {'legacy docs/s':>15} {'matcher docs/s':>15} {'speedup':>8}")
+    for size in args.sizes:
+        documents = build_corpus(size, seed=args.seed)
+
+        # Fresh analyzers so the matcher starts with an empty token map
+        legacy, legacy_time = timed(extract_themes_legacy, RegulationThemeAnalyzer(), documents)
+        compiled, compiled_time = timed(RegulationThemeAnalyzer().extract_themes_simple, documents)
+
+        if legacy != compiled:
+            print(f"Output mismatch at {size} documents")
+            return 1
+
+        print(f"{size:>10} {size / legacy_time:>15,.0f} {size / compiled_time:>15,.0f} "
+              f"{legacy_time / compiled_time:>7.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark the BM25 inverted index: build time, incremental sync and query latency.
+
+Usage:
+    python3 benchmarks/bench_search.py [--size 100000] [--repeat 50] [--seed 42]
+
+Queries run against the same synthetic ANEEL-style corpus as the keyword
+matcher benchmark; latencies are reported as median and 95th percentile.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_keyword_matcher import build_corpus
+from search_index import InvertedIndex
+from simple_server import RegulationThemeAnalyzer
+
+QUERIES = [
+    'bandeira tarifária',
+    'tarifa',
+    'consumidor distribuição qualidade',
+    'geração solar fotovoltaica compensação',
+    'fiscalização penalidade distribuidora',
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    analyzer = RegulationThemeAnalyzer()
+    documents = build_corpus(args.size, seed=args.seed)
+    index = InvertedIndex(analyzer.pipeline.iter_tokens, analyzer.pipeline.tokenize)
+
+    started = time.perf_counter()
+    index.sync(documents, version='v1')
+    print(f"build: {args.size} documents in {time.perf_counter() - started:.2f}s "
+          f"({index.stats()['postings_bytes'] / 1e6:.1f} MB of postings)")
+
+    # Replace 1% of the corpus, as a refresh of a slowly changing store would
+    changed = max(1, args.size // 100)
+    updated = documents[changed:] + build_corpus(changed, seed=args.seed + 1)
+    started = time.perf_counter()
+    added, removed = index.sync(updated, version='v2')
+    print(f"sync: +{added} -{removed} documents in {time.perf_counter() - started:.3f}s")
+
+    print(f"{'query':<42} {'matches':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    index.search(QUERIES[0])  # first query imports NumPy
+    for query in QUERIES:
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            _, total = index.search(query, limit=10)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"{query:<42} {total:>8} {statistics.median(latencies):>8.2f} "
+              f"{percentile(latencies, 0.95):>8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the similar-documents index: recall@k and latency of IVF search
+against exact search, for several n_probe values.
+
+Usage:
+    python3 benchmarks/bench_similarity.py [--size 50000] [--queries 200] [--k 10]
+
+Vectors are TF-IDF rows of the synthetic ANEEL-style corpus reduced with
+TruncatedSVD, as app.py builds them. Recall is the fraction of the exact top-k
+neighbours that the IVF search returns.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_keyword_matcher import build_corpus
+from vector_index import VectorIndex
+
+
+def query_latencies(index, doc_ids, k, n_probe):
+    results = []
+    latencies = []
+    for doc_id in doc_ids:
+        started = time.perf_counter()
+        results.append(index.similar(doc_id, k=k, n_probe=n_probe))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dimensions', type=int, default=128)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    documents = build_corpus(args.size, seed=args.seed)
+    matrix = TfidfVectorizer(max_features=20000, dtype=np.float32).fit_transform(documents)
+    vectors = normalize(TruncatedSVD(args.dimensions, random_state=args.seed).fit_transform(matrix))
+    vectors = vectors.astype(np.float32)
+
+    exact = VectorIndex.build(vectors, ivf_threshold=args.size + 1)
+    started = time.perf_counter()
+    ivf = VectorIndex.build(vectors, ivf_threshold=0)
+    print(f"{args.size} vectors x {args.dimensions} dims; IVF build "
+          f"{time.perf_counter() - started:.2f}s, {len(ivf.centroids)} lists")
+
+    rng = np.random.default_rng(args.seed)
+    doc_ids = rng.choice(args.size, size=min(args.queries, args.size), replace=False)
+    truth, latencies = query_latencies(exact, doc_ids, args.k, n_probe=0)
+
+    print(f"{'index':<14} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':<14} {1.0:>10.3f} {statistics.median(latencies):>8.3f} "
+          f"{np.percentile(latencies, 95):>8.3f}")
+    for n_probe in (1, 4, 8, 16, 32, 64):
+        found, latencies = query_latencies(ivf, doc_ids, args.k, n_probe)
+        recall = np.mean([
+            len({i for i, _ in f} & {i for i, _ in t}) / max(1, len(t))
+            for f, t in zip(found, truth)
+        ])
+        print(f"{'ivf n_probe=' + str(n_probe):<14} {recall:>10.3f} "
+              f"{statistics.median(latencies):>8.3f} {np.percentile(latencies, 95):>8.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the theme analysis hot paths, checked against a baseline.
+
+Usage:
+    python3 benchmarks/run_benchmarks.py [--sizes 1000 10000] [--seed 42]
+        [--output benchmarks/results.json] [--baseline benchmarks/baseline.json]
+        [--tolerance 0.3] [--update-baseline] [--skip-server] [--skip-clustering]
+
+On synthetic ANEEL-style corpora of the given sizes in chunks (see
+synthetic_corpus.py), it measures:
+
+  - preprocess_text throughput, with an empty and with a warm token cache
+  - extract_themes_simple (simple_server.py) and extract_themes (app.py, when
+    Flask and scikit-learn are installed)
+  - JSON serialization of the /api/themes payload: compact, full and gzip
+  - the corpus store (corpus_store.py): Python heap of the corpus and its
+    tokens held as objects and as a mapped store, build and open time
+  - /api/themes and /api/upload latency and throughput against a
+    simple_server.py started locally on the same corpus (through a temporary
+    document cache)
+
+Every metric is written to --output as JSON and compared with the baseline:
+a metric more than --tolerance worse than its baseline value is reported as
+a regression and the script exits with status 1. --update-baseline stores
+the current results as the new baseline instead.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from api_format import encode_body, encode_json, theme_list
+from corpus_store import CorpusStore
+from document_cache import DocumentCache
+from document_repository import DocumentSnapshot, corpus_fingerprint
+from simple_server import RegulationThemeAnalyzer, chunk_file
+from synthetic_corpus import CorpusGenerator
+
+# Seed offset of the documents uploaded during the server benchmark, so they
+# differ from the served corpus
+UPLOAD_SEED_OFFSET = 1000
+
+
+class Results:
+    """Named metrics with their unit and which direction is better"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {'value': round(value, 6), 'unit': unit, 'better': better}
+        print(f"  {name:<48} {value:>14,.3f} {unit}")
+
+    def rate(self, name, count, seconds, unit='docs/s'):
+        self.add(name, count / seconds if seconds > 0 else 0.0, unit, 'higher')
+
+    def latencies(self, name, latencies_ms):
+        self.add(f"{name}.p50_ms", statistics.median(latencies_ms), 'ms', 'lower')
+        self.add(f"{name}.p95_ms", percentile(latencies_ms, 0.95), 'ms', 'lower')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def best_time(func, repeat):
+    """Fastest of repeat runs of func(), and the result of the last run"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def environment():
+    """Where the results were measured, so baselines from other machines stand out"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit or None
+    }
+
+
+# In-process benchmarks
+
+def bench_preprocess(results, size, texts, repeat):
+    def cold():
+        analyzer = RegulationThemeAnalyzer()
+        for text in texts:
+            analyzer.preprocess_text(text)
+        return analyzer
+
+    seconds, analyzer = best_time(cold, repeat)
+    results.rate(f"preprocess_text.{size}.cold", len(texts), seconds)
+
+    def warm():
+        for text in texts:
+            analyzer.preprocess_text(text)
+
+    seconds, _ = best_time(warm, repeat)
+    results.rate(f"preprocess_text.{size}.warm", len(texts), seconds)
+
+
+def bench_extract_simple(results, size, texts, repeat):
+    seconds, themes = best_time(lambda: RegulationThemeAnalyzer().extract_themes_simple(texts),
+                                repeat)
+    results.rate(f"extract_themes_simple.{size}", len(texts), seconds)
+    return themes
+
+
+def bench_extract_clustering(results, size, texts):
+    """extract_themes of app.py; skipped when Flask or scikit-learn are missing"""
+    try:
+        import app
+        import sklearn  # noqa: F401
+    except ImportError as e:
+        print(f"  extract_themes skipped: {e}")
+        return
+    analyzer = app.RegulationThemeAnalyzer()
+    seconds, _ = best_time(lambda: analyzer.extract_themes(texts), 1)
+    results.rate(f"extract_themes.{size}", len(texts), seconds)
+
+
+def bench_serialization(results, size, themes, texts, repeat):
+    def payload(full):
+        return {
+            'success': True,
+            'themes': theme_list(themes, full),
+            'total_documents': len(texts),
+            'unique_documents': len(texts),
+            'corpus_version': 'benchmark'
+        }
+
+    for label, full in (('compact', False), ('full', True)):
+        data = payload(full)
+        seconds, body = best_time(lambda: encode_json(data), repeat)
+        results.add(f"serialize.{size}.{label}_ms", seconds * 1000, 'ms', 'lower')
+        results.add(f"serialize.{size}.{label}_bytes", len(body), 'bytes', 'lower')
+
+    data = payload(False)
+    seconds, (body, _) = best_time(lambda: encode_body(data, 'gzip'), repeat)
+    results.add(f"serialize.{size}.compact_gzip_ms", seconds * 1000, 'ms', 'lower')
+    results.add(f"serialize.{size}.compact_gzip_bytes", len(body), 'bytes', 'lower')
+
+
+def bench_corpus_store(results, size, files, repeat):
+    """Heap of a chunked corpus and its tokens as Python objects vs a mapped corpus store"""
+    pipeline = RegulationThemeAnalyzer().pipeline
+    tracemalloc.start()
+    snapshot = DocumentSnapshot([chunk for file_id, text in files for chunk in chunk_file(file_id, text)],
+                                'benchmark')
+    tokens = [pipeline.preprocessor.tokens(text) for text in snapshot.documents]
+    plain_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results.add(f"corpus_store.{size}.objects_heap_bytes", plain_bytes, 'bytes', 'lower')
+
+    with tempfile.TemporaryDirectory(prefix='corpus-store-') as directory:
+        path = os.path.join(directory, 'corpus.store')
+        started = time.perf_counter()
+        store = CorpusStore.build(snapshot.chunks, lambda batch: pipeline.iter_tokens(batch, cache=False),
+                                  corpus_fingerprint(snapshot.documents), pipeline.preprocessor.signature())
+        store.save(path)
+        results.rate(f"corpus_store.{size}.build", len(snapshot), time.perf_counter() - started)
+        results.add(f"corpus_store.{size}.file_bytes", os.path.getsize(path), 'bytes', 'lower')
+        del store, tokens
+
+        seconds, _ = best_time(lambda: DocumentSnapshot(CorpusStore.open(path), 'benchmark'), repeat)
+        results.add(f"corpus_store.{size}.open_ms", seconds * 1000, 'ms', 'lower')
+        tracemalloc.start()
+        stored = DocumentSnapshot(CorpusStore.open(path), 'benchmark')
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.add(f"corpus_store.{size}.store_heap_bytes", store_bytes, 'bytes', 'lower')
+        # Mapped pages count as resident once read (and are shared between processes)
+        resident = store_bytes + os.path.getsize(path)
+        results.add(f"corpus_store.{size}.memory_reduction", plain_bytes / resident, 'x', 'higher')
+        del stored
+
+
+# Server benchmarks
+
+class CorpusFetcher:
+    """Serves synthetic files through the fetcher interface DocumentCache.sync() uses"""
+
+    def __init__(self, files):
+        self.files = files
+
+    def iter_files(self):
+        for file_id, text in self.files:
+            yield SimpleNamespace(id=file_id, created_at=0, usage_bytes=len(text))
+
+    def iter_contents(self, file_objs):
+        texts = dict(self.files)
+        for file_obj in file_objs:
+            yield file_obj.id, texts[file_obj.id], None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServer:
+    """simple_server.py in a subprocess, serving a corpus from a temporary document cache"""
+
+    def __init__(self, files, directory, startup_timeout):
+        self.port = free_port()
+        cache_path = os.path.join(directory, 'documents.db')
+        cache = DocumentCache(cache_path)
+        cache.sync(CorpusFetcher(files))
+        cache.close()
+
+        env = dict(os.environ, DOCUMENT_CACHE_PATH=cache_path,
+                   CORPUS_STORE_PATH=os.path.join(directory, 'corpus.store'), OPENAI_API_KEY='',
+                   VECTOR_STORE_ID='', DOCUMENT_REFRESH_INTERVAL='0', ADMIN_TOKEN='')
+        self.log = open(os.path.join(directory, 'server.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, 'simple_server.py', '--host', '127.0.0.1', '--port', str(self.port)],
+            cwd=ROOT_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        try:
+            self.wait_until_ready(startup_timeout)
+        except Exception:
+            self.stop()
+            raise
+
+    def wait_until_ready(self, timeout):
+        """Wait for the port, then for the startup refresh of the cache to finish"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with status {self.process.returncode}")
+            try:
+                status, body = self.request('GET', '/api/admin/status')
+                repository = json.loads(body)['repository']
+                if repository['refresh_count'] or repository['last_refresh_error']:
+                    if not repository['refreshing']:
+                        return
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("server did not become ready in time")
+
+    def connection(self):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=3600)
+
+    def request(self, method, path, body=None, headers=None, connection=None):
+        conn = connection or self.connection()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            if connection is None:
+                conn.close()
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def run_concurrently(server, requests, concurrency):
+    """
+    Send (method, path, body, headers) requests over keep-alive connections.
+
+    Returns:
+        (latencies in ms, wall-clock seconds)
+    """
+    latencies = []
+    errors = []
+    pending = list(reversed(requests))
+    lock = threading.Lock()
+
+    def worker():
+        conn = server.connection()
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    method, path, body, headers = pending.pop()
+                started = time.perf_counter()
+                status, _ = server.request(method, path, body, headers, connection=conn)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors.append(status)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f"{len(errors)} requests failed (status {errors[0]})")
+    return latencies, time.perf_counter() - started
+
+
+def bench_server(results, size, files, args):
+    with tempfile.TemporaryDirectory(prefix='theme-bench-') as directory:
+        server = LocalServer(files, directory, args.startup_timeout)
+        try:
+            gzip_headers = {'Accept-Encoding': 'gzip'}
+
+            # First request computes the analysis; later ones reuse the cached body
+            started = time.perf_counter()
+            status, _ = server.request('GET', '/api/themes', headers=gzip_headers)
+            if status != 200:
+                raise RuntimeError(f"/api/themes answered {status}")
+            results.add(f"api_themes.{size}.cold_ms", (time.perf_counter() - started) * 1000,
+                        'ms', 'lower')
+
+            latencies, seconds = run_concurrently(
+                server, [('GET', '/api/themes', None, gzip_headers)] * args.requests,
+                args.concurrency
+            )
+            results.latencies(f"api_themes.{size}.warm", latencies)
+            results.rate(f"api_themes.{size}.throughput", len(latencies), seconds, 'req/s')
+
+            # Distinct batches, so no upload is answered from the result cache
+            uploads = CorpusGenerator(args.seed + UPLOAD_SEED_OFFSET).chunks(
+                args.upload_requests * args.upload_batch
+            )
+            json_headers = {'Content-Type': 'application/json'}
+            requests = [
+                ('POST', '/api/upload',
+                 json.dumps({'documents': uploads[i:i + args.upload_batch]}).encode('utf-8'),
+                 json_headers)
+                for i in range(0, len(uploads), args.upload_batch)
+            ]
+            latencies, seconds = run_concurrently(server, requests, args.concurrency)
+            results.latencies(f"api_upload.{size}.json", latencies)
+            results.rate(f"api_upload.{size}.json_throughput", len(uploads), seconds)
+
+            # One NDJSON upload of a corpus-sized batch, answered progressively
+            body = ''.join(json.dumps(text, ensure_ascii=False) + '\n'
+                           for text in CorpusGenerator(args.seed + UPLOAD_SEED_OFFSET).chunks(size))
+            started = time.perf_counter()
+            status, _ = server.request('POST', '/api/upload', body.encode('utf-8'),
+                                       {'Content-Type': 'application/x-ndjson'})
+            if status != 200:
+                raise RuntimeError(f"NDJSON upload answered {status}")
+            results.rate(f"api_upload.{size}.ndjson_throughput", size,
+                         time.perf_counter() - started)
+        finally:
+            server.stop()
+
+
+# Baseline comparison
+
+def compare(current, baseline, tolerance):
+    """
+    Print current metrics against the baseline.
+
+    Returns:
+        Names of the metrics that regressed by more than tolerance
+    """
+    regressions = []
+    print(f"\n{'metric':<48} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, metric in current['metrics'].items():
+        reference = baseline['metrics'].get(name)
+        if reference is None:
+            print(f"{name:<48} {'-':>14} {metric['value']:>14,.3f}      new")
+            continue
+        base, value = reference['value'], metric['value']
+        change = (value - base) / base if base else 0.0
+        worse = -change if metric['better'] == 'higher' else change
+        flag = ''
+        if worse > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<48} {base:>14,.3f} {value:>14,.3f} {change:>+7.1%}{flag}")
+
+    if baseline.get('environment') != current['environment']:
+        differences = {key: (baseline.get('environment', {}).get(key), value)
+                       for key, value in current['environment'].items()
+                       if key != 'commit' and baseline.get('environment', {}).get(key) != value}
+        if differences:
+            print(f"\nWarning: baseline measured in another environment: {differences}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help="Corpus sizes in chunks (1000 to 1000000)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs of each in-process benchmark; the fastest counts")
+    parser.add_argument('--requests', type=int, default=200, help="GET /api/themes requests")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--upload-requests', type=int, default=20)
+    parser.add_argument('--upload-batch', type=int, default=100, help="Documents per JSON upload")
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--output', default=os.path.join(BENCHMARKS_DIR, 'results.json'))
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARKS_DIR, 'baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="Relative slowdown reported as a regression")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--skip-server', action='store_true')
+    parser.add_argument('--skip-clustering', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = Results()
+    generator = CorpusGenerator(args.seed)
+    for size in args.sizes:
+        print(f"{size} chunks")
+        texts = generator.chunks(size)
+        bench_preprocess(results, size, texts, args.repeat)
+        themes = bench_extract_simple(results, size, texts, args.repeat)
+        if not args.skip_clustering:
+            bench_extract_clustering(results, size, texts)
+        bench_serialization(results, size, themes, texts, args.repeat)
+        files, _ = generator.files(size)
+        bench_corpus_store(results, size, files, args.repeat)
+        if not args.skip_server:
+            bench_server(results, size, files, args)
+
+    current = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'baseline', 'update_baseline')},
+        'metrics': results.metrics
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Synthetic ANEEL-style regulation corpora for the benchmarks.
+
+Every regulation has a header, an ementa and a few articles with paragraphs,
+written from the words of SAMPLE_REGULATIONS, common regulatory filler and
+the keywords of one main theme (plus, sometimes, a second one), so keyword
+classification, clustering and structural chunking all see realistic input.
+A small share of regulations are republished with a new date, giving the
+near-duplicate detection something to collapse.
+
+Generation is deterministic for a given seed and streams one regulation at a
+time, so corpora of a million chunks are produced without holding the files.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import chunk_document
+from simple_server import SAMPLE_REGULATIONS, RegulationThemeAnalyzer
+
+FILLER_WORDS = [
+    'agência', 'nacional', 'elétrica', 'aneel', 'considerando', 'dispõe', 'sobre',
+    'procedimentos', 'estabelece', 'critérios', 'regras', 'aplicação', 'prazo',
+    'concessionária', 'permissionária', 'unidade', 'consumidora', 'sistema',
+    'medição', 'contrato', 'revisão', 'ciclo', 'anual', 'vigência', 'publicação',
+    'bandeira', 'tarifária', 'submódulo', 'prodist', 'procedimento', 'compensação'
+]
+
+MONTHS = ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto',
+          'setembro', 'outubro', 'novembro', 'dezembro']
+
+KINDS = ['RESOLUÇÃO NORMATIVA', 'RESOLUÇÃO HOMOLOGATÓRIA', 'DESPACHO', 'PORTARIA']
+
+MAX_ARTICLES = 6
+MAX_PARAGRAPHS = 2
+DUPLICATE_RATE = 0.02
+
+
+class CorpusGenerator:
+    """
+    Deterministic stream of synthetic regulations.
+
+    Args:
+        seed: Random seed; the same seed always yields the same corpus
+        duplicate_rate: Share of regulations republished with another date
+    """
+
+    def __init__(self, seed=42, duplicate_rate=DUPLICATE_RATE):
+        self.seed = seed
+        self.duplicate_rate = duplicate_rate
+        analyzer = RegulationThemeAnalyzer()
+        self.theme_keywords = [keywords for _, keywords in analyzer.theme_keywords.values()]
+        self.sample_words = ' '.join(SAMPLE_REGULATIONS).split()
+
+    def sentence(self, rng, keywords, length):
+        words = rng.sample(self.sample_words, length // 2) + rng.sample(FILLER_WORDS, length // 3)
+        words += rng.sample(keywords, min(len(keywords), rng.randint(1, 2)))
+        if rng.random() < 0.2:
+            words.append(rng.choice(rng.choice(self.theme_keywords)))
+        # A unique process number now and then, so the vocabulary keeps growing
+        if rng.random() < 0.3:
+            words.append(f"processo {48500 + rng.randint(0, 999)}.{rng.randint(0, 999999):06d}")
+        rng.shuffle(words)
+        return ' '.join(words).capitalize() + '.'
+
+    def regulation(self, rng, number):
+        """(header line, list of article and paragraph lines) of one regulation"""
+        keywords = rng.choice(self.theme_keywords)
+        header = (f"{rng.choice(KINDS)} ANEEL Nº {number}, DE {rng.randint(1, 28)} DE "
+                  f"{rng.choice(MONTHS).upper()} DE {rng.randint(2000, 2025)}")
+        lines = [self.sentence(rng, keywords, 12)]
+        for article in range(1, rng.randint(2, MAX_ARTICLES) + 1):
+            lines.append(f"Art. {article}º {self.sentence(rng, keywords, rng.randint(14, 28))}")
+            for paragraph in range(1, rng.randint(0, MAX_PARAGRAPHS) + 1):
+                lines.append(f"§ {paragraph}º {self.sentence(rng, keywords, rng.randint(12, 20))}")
+        return header, lines
+
+    def iter_files(self):
+        """
+        Endless stream of (file id, regulation text).
+
+        Republished regulations repeat an earlier body under a new header.
+        """
+        rng = random.Random(self.seed)
+        recent = []
+        number = 0
+        while True:
+            number += 1
+            if recent and rng.random() < self.duplicate_rate:
+                _, lines = rng.choice(recent)
+                header = f"{rng.choice(KINDS)} ANEEL Nº {number}, REPUBLICADA"
+            else:
+                header, lines = self.regulation(rng, number)
+                recent = (recent + [(header, lines)])[-50:]
+            yield f"file-{number:07d}", '\n'.join([header] + lines)
+
+    def files(self, n_chunks, level='paragraph'):
+        """
+        Regulations adding up to at least n_chunks chunks at the given level.
+
+        Returns:
+            (list of (file id, text), number of chunks)
+        """
+        files = []
+        total = 0
+        for file_id, text in self.iter_files():
+            if total >= n_chunks:
+                break
+            files.append((file_id, text))
+            total += sum(1 for _ in chunk_document(file_id, text, level=level))
+        return files, total
+
+    def chunks(self, n_chunks, level='paragraph'):
+        """Texts of exactly n_chunks chunks, in corpus order"""
+        texts = []
+        for file_id, text in self.iter_files():
+            for chunk in chunk_document(file_id, text, level=level):
+                texts.append(chunk.text)
+                if len(texts) == n_chunks:
+                    return texts
+        return texts
+
+
+def build_chunks(n_chunks, seed=42):
+    """Chunk texts of a synthetic corpus (see CorpusGenerator)"""
+    return CorpusGenerator(seed).chunks(n_chunks)
@@ -0,0 +1,208 @@
+"""
+Structural chunking of Brazilian legislation for theme analysis.
+
+Regulations are organised in articles (Art. 1º), paragraphs (§ 1º,
+Parágrafo único) and incisos (I -, II -, ...). chunk_document() walks a file
+line by line and yields one Chunk per structural unit at the requested level,
+remembering the source file id, the character offsets of the unit in the file
+and its position in the structure ("Art. 5º, § 2º, III").
+
+Everything is a generator: a file is consumed one line at a time and only the
+unit being built is held in memory, so arbitrarily large files (or a stream
+of lines from a download) can be chunked.
+"""
+
+import io
+import re
+
+LEVELS = ('article', 'paragraph', 'inciso')
+
+# Inserted articles carry a letter after the ordinal ("Art. 3º-A"); with spaces
+# around the dash the letter must end with a period, so "Art. 2º - A
+# distribuidora ..." is not read as an inserted article
+ARTICLE_PATTERN = re.compile(
+    r'Art(?:igo)?\.?\s*(\d+(?:\.\d+)*)\s*([º°ª])?'
+    r'(?:-(?-i:([A-Z]))(?![^\W\d_])|\s*-\s*(?-i:([A-Z]))(?=\.))?',
+    re.IGNORECASE
+)
+PARAGRAPH_PATTERN = re.compile(r'(?:§\s*(\d+)\s*[º°]?|(Parágrafo\s+único))', re.IGNORECASE)
+# A well-formed roman numeral below 100 (incisos never go that far), so
+# acronyms such as "CDM -", "DC -" or "MW)" do not open an inciso
+INCISO_PATTERN = re.compile(r'((?=[IVXL])(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3}))\s*[-–—)]\s*\S')
+
+# Articles and paragraphs often run together on one line in extracted text;
+# split before a heading that follows the end of a sentence
+INLINE_HEADING = re.compile(r'(?<=[.;:])\s+(?=(?:Art\.\s*\d|§\s*\d|Parágrafo\s+único))')
+
+
+class Chunk:
+    """
+    One structural unit of a source file.
+
+    Attributes:
+        file_id: Id of the source file
+        index: Position of the chunk within its file
+        label: Structural path, e.g. "Art. 5º, § 2º, III" ('' before Art. 1)
+        start: Offset of the first character of the unit in the file
+        end: Offset just past the last character of the unit
+        text: Whitespace-normalized text of the unit
+    """
+
+    __slots__ = ('file_id', 'index', 'label', 'start', 'end', 'text')
+
+    def __init__(self, file_id, index, label, start, end, text):
+        self.file_id = file_id
+        self.index = index
+        self.label = label
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def location(self):
+        return {'label': self.label, 'start': self.start, 'end': self.end}
+
+    def __repr__(self):
+        return f"Chunk({self.file_id!r}, {self.label!r}, {self.start}:{self.end})"
+
+
+def iter_lines(content):
+    """Lines of a string or of any iterable of lines, line endings kept"""
+    if isinstance(content, str):
+        return iter(io.StringIO(content, newline=''))
+    return iter(content)
+
+
+def iter_segments(content):
+    """Yield (offset, segment) pieces of the content, split at structural headings"""
+    offset = 0
+    for line in iter_lines(content):
+        start = 0
+        for boundary in INLINE_HEADING.finditer(line):
+            yield offset + start, line[start:boundary.end()]
+            start = boundary.end()
+        yield offset + start, line[start:]
+        offset += len(line)
+
+
+def heading_level(segment):
+    """
+    Structural level a segment opens, if any.
+
+    Returns:
+        (level index, label) -- 0 article, 1 paragraph, 2 inciso -- or None
+    """
+    match = ARTICLE_PATTERN.match(segment)
+    if match:
+        suffix = match.group(3) or match.group(4)
+        return 0, f"Art. {match.group(1)}{match.group(2) or ''}{'-' + suffix if suffix else ''}"
+    match = PARAGRAPH_PATTERN.match(segment)
+    if match:
+        return 1, f"§ {match.group(1)}º" if match.group(1) else 'Parágrafo único'
+    match = INCISO_PATTERN.match(segment)
+    if match:
+        return 2, match.group(1)
+    return None
+
+
+def chunk_document(file_id, content, level='paragraph', max_chars=4000, min_chars=40):
+    """
+    Split a legal text into structural chunks.
+
+    Args:
+        file_id: Id recorded on every chunk
+        content: File text, or an iterable of its lines
+        level: Finest unit that starts a new chunk ('article', 'paragraph' or
+            'inciso'); finer units stay inside their parent's chunk
+        max_chars: Units longer than this are split at line boundaries
+        min_chars: Shorter units (titles, bare headings) are merged into the
+            following chunk instead of being emitted on their own
+
+    Yields:
+        Chunk objects in file order
+    """
+    split_level = LEVELS.index(level)
+    path = ['', '', '']
+    parts = []
+    size = 0
+    start = end = None
+    label = ''
+    index = 0
+
+    def make_chunk():
+        return Chunk(file_id, index, label, start, end, ' '.join(parts))
+
+    for offset, segment in iter_segments(content):
+        stripped = segment.strip()
+        if not stripped:
+            continue
+        leading = len(segment) - len(segment.lstrip())
+        seg_start = offset + leading
+        seg_end = seg_start + len(stripped)
+
+        heading = heading_level(stripped)
+        if heading is not None and heading[0] == 2 and not (path[0] or path[1]):
+            # Incisos only exist inside an article or paragraph
+            heading = None
+        if heading is not None:
+            depth, heading_label = heading
+            path[depth] = heading_label
+            for deeper in range(depth + 1, len(path)):
+                path[deeper] = ''
+            if depth <= split_level and parts and size >= min_chars:
+                yield make_chunk()
+                index += 1
+                parts, size, start = [], 0, None
+            if depth <= split_level:
+                label = ', '.join(p for p in path[:split_level + 1] if p)
+        elif parts and size + len(stripped) > max_chars:
+            yield make_chunk()
+            index += 1
+            parts, size, start = [], 0, None
+
+        if start is None:
+            start = seg_start
+        end = seg_end
+        parts.append(stripped)
+        size += len(stripped) + 1
+
+    if parts:
+        yield make_chunk()
+
+
+def chunk_documents(files, level='paragraph', max_chars=4000, min_chars=40):
+    """Chunk every (file_id, content) pair, yielding chunks as they are produced"""
+    for file_id, content in files:
+        yield from chunk_document(file_id, content, level=level,
+                                  max_chars=max_chars, min_chars=min_chars)
+
+
+def aggregate_by_file(chunks):
+    """
+    Group chunks back into their source files.
+
+    Returns:
+        List of {'file_id', 'chunks', 'locations'} dicts in order of first
+        appearance, where locations holds each chunk's label and offsets
+    """
+    files = {}
+    for chunk in chunks:
+        entry = files.get(chunk.file_id)
+        if entry is None:
+            entry = files[chunk.file_id] = {'file_id': chunk.file_id, 'chunks': 0, 'locations': []}
+        entry['chunks'] += 1
+        entry['locations'].append(chunk.location())
+    return list(files.values())
+
+
+def add_source_documents(theme, chunks, positions):
+    """
+    Record on a theme dict the source files of its chunks.
+
+    Args:
+        theme: Theme dict; gains 'source_documents' and 'document_count'
+        chunks: All chunks of the analysed corpus
+        positions: Indices in chunks of the theme's members
+    """
+    sources = aggregate_by_file(chunks[position] for position in positions)
+    theme['source_documents'] = sources
+    theme['document_count'] = len(sources)
@@ -0,0 +1,166 @@
+"""
+Large-corpus clustering engine for the Flask theme analyzer.
+
+RegulationThemeAnalyzer.extract_themes fits a full KMeans on a float64 TF-IDF
+matrix with (1, 3)-grams, which stops scaling at tens of thousands of
+articles. LargeCorpusClusterer keeps the same inputs and outputs but:
+
+- builds a capped vocabulary of (1, 2)-grams from a bounded sample of the corpus
+- produces float32 sparse TF-IDF matrices one batch at a time
+- optionally reduces each batch with a TruncatedSVD (LSA) fitted on the sample
+- trains MiniBatchKMeans with partial_fit, batch by batch
+- assigns labels in a second streaming pass
+
+so peak memory is bounded by the batch size (plus the small reduced vectors
+when SVD is enabled) rather than by the size of the TF-IDF matrix.
+Each stage is timed and reported through StageTimings.
+"""
+
+import logging
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import Normalizer
+
+from profiling import StageTimings
+
+logger = logging.getLogger(__name__)
+
+
+class LargeCorpusClusterer:
+    """
+    Batch-wise TF-IDF + (optional) SVD + MiniBatchKMeans.
+
+    Args:
+        n_clusters: Number of clusters
+        max_features: Vocabulary cap
+        ngram_range: N-gram range of the vectorizer
+        n_components: SVD dimensions (None disables the reduction)
+        batch_size: Documents vectorized and fed to the model at a time
+        sample_size: Documents used to build the vocabulary and fit the SVD
+        min_df: Minimum document frequency of a term in the sample
+        max_df: Maximum document frequency ratio of a term in the sample
+        random_state: Seed for sampling, SVD and KMeans
+    """
+
+    def __init__(self, n_clusters=8, max_features=20000, ngram_range=(1, 2),
+                 n_components=100, batch_size=4096, sample_size=50000,
+                 min_df=2, max_df=0.8, random_state=42):
+        self.n_clusters = n_clusters
+        self.max_features = max_features
+        self.ngram_range = ngram_range
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.min_df = min_df
+        self.max_df = max_df
+        self.random_state = random_state
+
+        self.vectorizer = None
+        self.svd = None
+        self.normalizer = None
+        self.kmeans = None
+        self.feature_names = None
+        self.timings = StageTimings()
+
+    def iter_batches(self, processed_docs):
+        for start in range(0, len(processed_docs), self.batch_size):
+            yield processed_docs[start:start + self.batch_size]
+
+    def transform(self, docs):
+        """Vectorize (and reduce) one batch of preprocessed documents"""
+        with self.timings.stage('vectorize'):
+            matrix = self.vectorizer.transform(docs)
+        if self.svd is not None:
+            with self.timings.stage('reduce'):
+                matrix = self.normalizer.transform(
+                    self.svd.transform(matrix).astype(np.float32, copy=False)
+                )
+        return matrix
+
+    def fit_predict(self, processed_docs):
+        """
+        Cluster preprocessed documents.
+
+        Returns:
+            Array of cluster labels aligned with processed_docs
+        """
+        rng = np.random.default_rng(self.random_state)
+        n_docs = len(processed_docs)
+        n_clusters = min(self.n_clusters, n_docs)
+        # The first partial_fit call needs at least n_clusters samples
+        self.batch_size = max(self.batch_size, n_clusters)
+
+        with self.timings.stage('vocabulary'):
+            if n_docs > self.sample_size:
+                sample_idx = np.sort(rng.choice(n_docs, self.sample_size, replace=False))
+                sample = [processed_docs[i] for i in sample_idx]
+            else:
+                sample = processed_docs
+
+            self.vectorizer = TfidfVectorizer(
+                max_features=self.max_features,
+                ngram_range=self.ngram_range,
+                min_df=self.min_df if len(sample) > self.min_df else 1,
+                max_df=self.max_df,
+                dtype=np.float32
+            )
+            sample_matrix = self.vectorizer.fit_transform(sample)
+            self.feature_names = self.vectorizer.get_feature_names_out()
+
+        n_features = sample_matrix.shape[1]
+        if self.n_components and n_features > self.n_components:
+            with self.timings.stage('svd_fit'):
+                self.svd = TruncatedSVD(n_components=self.n_components,
+                                        random_state=self.random_state)
+                self.svd.fit(sample_matrix)
+                self.normalizer = Normalizer(copy=False)
+        del sample_matrix
+
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=self.batch_size,
+            random_state=self.random_state,
+            n_init=3
+        )
+
+        # Reduced batches are small (n_components float32 per document), so they
+        # are kept for the assignment pass; sparse batches are recomputed instead
+        reduced_batches = [] if self.svd is not None else None
+        for batch in self.iter_batches(processed_docs):
+            matrix = self.transform(batch)
+            if reduced_batches is not None:
+                reduced_batches.append(matrix)
+            with self.timings.stage('cluster'):
+                self.kmeans.partial_fit(matrix)
+
+        labels = np.empty(n_docs, dtype=np.int32)
+        offset = 0
+        for batch_index, batch in enumerate(self.iter_batches(processed_docs)):
+            if reduced_batches is not None:
+                matrix = reduced_batches[batch_index]
+            else:
+                matrix = self.transform(batch)
+            with self.timings.stage('assign'):
+                labels[offset:offset + len(batch)] = self.kmeans.predict(matrix)
+            offset += len(batch)
+
+        return labels
+
+    def term_space_centroids(self):
+        """Cluster centroids expressed over the vocabulary (undoing the SVD)"""
+        centers = self.kmeans.cluster_centers_
+        if self.svd is not None:
+            centers = self.svd.inverse_transform(centers)
+        return centers.astype(np.float32, copy=False)
+
+    def cluster_keywords(self, cluster_id, top_n=10):
+        """Top terms of a cluster centroid, mapped back to the vocabulary"""
+        center = self.kmeans.cluster_centers_[cluster_id]
+        if self.svd is not None:
+            center = self.svd.inverse_transform(center.reshape(1, -1))[0]
+        top_indices = center.argsort()[-top_n:][::-1]
+        return [self.feature_names[i] for i in top_indices]
+
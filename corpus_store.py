@@ -0,0 +1,382 @@
+"""
+Compact, memory-mapped corpus store.
+
+Held as Python objects, a corpus costs several times its text size: every
+text is a str object (two bytes per character as soon as it has an accented
+letter), every chunk an object with its own label string, and every analysis
+keeps lists of token strings per document. CorpusStore keeps the same corpus
+in a few contiguous buffers:
+
+- the texts as one UTF-8 blob with offsets
+- the tokens (as produced by the analyzer's pipeline) as ids into an
+  interned vocabulary, one flat array with offsets
+- the content digest of every text, so corpora are diffed (see
+  search_index.document_keys) without hashing them again
+- for chunks, their metadata as parallel integer arrays, with file ids and
+  labels interned in tables
+
+save() writes everything to one file; open() maps it read-only, so loading is
+near-instant and every process that opens (or inherits) the mapping shares
+one copy of its pages. Only the vocabulary and the file and label tables
+become Python objects.
+
+StoredTexts and StoredChunks are read-only sequence views over a store, or
+over a subset of its documents (see select()); items are decoded on access.
+PreprocessingPipeline.iter_tokens() reads the stored tokens of a view instead
+of tokenizing its texts again.
+"""
+
+import abc
+import json
+import mmap
+import os
+import sys
+import threading
+from array import array
+
+from chunking import Chunk
+from text_preprocessing import content_key
+
+MAGIC = b'TNCORPUS'
+FORMAT_VERSION = 1
+
+# Sections start on 8-byte boundaries so they can be cast in place
+ALIGNMENT = 8
+
+DIGEST_SIZE = 16
+
+# Typed sections: (name, array typecode), in file order
+ARRAY_SECTIONS = (
+    ('text_offsets', 'Q'), ('token_offsets', 'Q'), ('token_ids', 'I'),
+    ('vocabulary_offsets', 'Q'), ('file_offsets', 'Q'), ('label_offsets', 'Q'),
+    ('chunk_files', 'I'), ('chunk_indexes', 'I'), ('chunk_labels', 'I'),
+    ('chunk_starts', 'Q'), ('chunk_ends', 'Q')
+)
+BYTE_SECTIONS = ('texts', 'digests', 'vocabulary', 'files', 'labels')
+
+CHUNK_SECTIONS = ('chunk_files', 'chunk_indexes', 'chunk_labels', 'chunk_starts', 'chunk_ends')
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode_table(strings):
+    """(offsets, UTF-8 blob) of a list of strings"""
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8', 'surrogatepass')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _decode_table(offsets, blob):
+    """Interned strings of an encoded table"""
+    return [sys.intern(str(blob[offsets[i]:offsets[i + 1]], 'utf-8', 'surrogatepass'))
+            for i in range(len(offsets) - 1)]
+
+
+class CorpusStore:
+    """
+    Corpus texts, tokens and chunk metadata in contiguous buffers.
+
+    Built in memory with build(), written with save() and mapped back with
+    open(). Use texts() and chunks() to read it.
+    """
+
+    def __init__(self, header, sections, mapping=None):
+        self.header = header
+        self.version = header['version']
+        self.tokenizer = header['tokenizer']
+        self.characters = header['characters']
+        self.has_chunks = header['chunks']
+        self.path = None
+        self._sections = sections
+        # Keeps the file mapped for as long as the store (or a view) is alive
+        self._mapping = mapping
+        self._text_offsets = sections['text_offsets']
+        self._texts = sections['texts']
+        self._token_offsets = sections['token_offsets']
+        self._token_ids = sections['token_ids']
+        self._digests = sections['digests']
+        self.vocabulary = _decode_table(sections['vocabulary_offsets'], sections['vocabulary'])
+        self.files = _decode_table(sections['file_offsets'], sections['files'])
+        self.labels = _decode_table(sections['label_offsets'], sections['labels'])
+
+    def __len__(self):
+        return self.header['documents']
+
+    @property
+    def nbytes(self):
+        """Size of the buffers (the file size, for a mapped store)"""
+        return sum(memoryview(section).nbytes for section in self._sections.values())
+
+    @property
+    def mapped(self):
+        return self._mapping is not None
+
+    @classmethod
+    def build(cls, documents, iter_tokens, version, tokenizer=''):
+        """
+        Store a corpus.
+
+        Args:
+            documents: Document texts, or chunks (chunking.Chunk)
+            iter_tokens: Callable(list of texts) -> token sequence of each text,
+                e.g. PreprocessingPipeline.iter_tokens
+            version: Corpus version (see document_repository.corpus_fingerprint)
+            tokenizer: Signature of the tokenizer settings (see
+                TextPreprocessor.signature); stored tokens are only reused by
+                a tokenizer with the same signature
+        """
+        documents = documents if isinstance(documents, (list, tuple)) else list(documents)
+        has_chunks = bool(documents) and not isinstance(documents[0], str)
+        texts = [chunk.text for chunk in documents] if has_chunks else documents
+
+        text_offsets = array('Q', [0])
+        blob = bytearray()
+        token_offsets = array('Q', [0])
+        token_ids = array('I')
+        digests = bytearray()
+        term_ids = {}
+        characters = 0
+        for text, tokens in zip(texts, iter_tokens(texts)):
+            blob += text.encode('utf-8', 'surrogatepass')
+            text_offsets.append(len(blob))
+            digests += content_key(text)
+            characters += len(text)
+            for token in tokens:
+                if token not in term_ids:
+                    term_ids[token] = len(term_ids)
+            token_ids.extend(map(term_ids.__getitem__, tokens))
+            token_offsets.append(len(token_ids))
+
+        sections = {name: array(typecode) for name, typecode in ARRAY_SECTIONS}
+        sections.update(text_offsets=text_offsets, texts=bytes(blob), token_offsets=token_offsets,
+                        token_ids=token_ids, digests=bytes(digests))
+        sections['vocabulary_offsets'], sections['vocabulary'] = _encode_table(term_ids)
+
+        file_ids = {}
+        labels = {}
+        if has_chunks:
+            for chunk in documents:
+                sections['chunk_files'].append(file_ids.setdefault(chunk.file_id, len(file_ids)))
+                sections['chunk_indexes'].append(chunk.index)
+                sections['chunk_labels'].append(labels.setdefault(chunk.label, len(labels)))
+                sections['chunk_starts'].append(chunk.start)
+                sections['chunk_ends'].append(chunk.end)
+        sections['file_offsets'], sections['files'] = _encode_table(file_ids)
+        sections['label_offsets'], sections['labels'] = _encode_table(labels)
+
+        header = {
+            'format': FORMAT_VERSION,
+            'byteorder': sys.byteorder,
+            'version': version,
+            'tokenizer': tokenizer,
+            'documents': len(texts),
+            'characters': characters,
+            'chunks': has_chunks
+        }
+        return cls(header, sections)
+
+    def save(self, path):
+        """Write the store to path (atomically replacing it)"""
+        names = [name for name, _ in ARRAY_SECTIONS] + list(BYTE_SECTIONS)
+        layout = {}
+        offset = 0
+        for name in names:
+            offset = _aligned(offset)
+            size = memoryview(self._sections[name]).nbytes
+            layout[name] = [offset, size]
+            offset += size
+        header = json.dumps(dict(self.header, sections=layout), separators=(',', ':')).encode('utf-8')
+        prefix = MAGIC + len(header).to_bytes(4, 'little') + header
+        data_start = _aligned(len(prefix))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(prefix.ljust(data_start, b'\x00'))
+            for name in names:
+                offset, _ = layout[name]
+                f.seek(data_start + offset)
+                f.write(memoryview(self._sections[name]).cast('B'))
+        os.replace(temporary, path)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Map a saved store read-only.
+
+        Raises:
+            OSError: if the file cannot be read
+            ValueError: if it is not a store written by this version on a
+                machine of the same byte order
+        """
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mapping[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a corpus store")
+            header_start = len(MAGIC) + 4
+            header_size = int.from_bytes(mapping[len(MAGIC):header_start], 'little')
+            header = json.loads(mapping[header_start:header_start + header_size])
+            if header.get('format') != FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+                raise ValueError(f"{path} was written in an incompatible format")
+            data_start = _aligned(header_start + header_size)
+            view = memoryview(mapping)
+            sections = {}
+            typecodes = dict(ARRAY_SECTIONS)
+            for name, (offset, size) in header.pop('sections').items():
+                section = view[data_start + offset:data_start + offset + size]
+                sections[name] = section.cast(typecodes[name]) if name in typecodes else section
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{path} is not a valid corpus store") from e
+        store = cls(header, sections, mapping)
+        store.path = path
+        return store
+
+    def text(self, position):
+        offsets = self._text_offsets
+        return str(self._texts[offsets[position]:offsets[position + 1]], 'utf-8', 'surrogatepass')
+
+    def terms(self, position):
+        """Token tuple of a document, made of the interned vocabulary strings"""
+        offsets = self._token_offsets
+        ids = self._token_ids[offsets[position]:offsets[position + 1]]
+        return tuple(map(self.vocabulary.__getitem__, ids))
+
+    def digest(self, position):
+        return bytes(self._digests[position * DIGEST_SIZE:(position + 1) * DIGEST_SIZE])
+
+    def chunk(self, position):
+        sections = self._sections
+        return Chunk(
+            self.files[sections['chunk_files'][position]], sections['chunk_indexes'][position],
+            self.labels[sections['chunk_labels'][position]], sections['chunk_starts'][position],
+            sections['chunk_ends'][position], self.text(position)
+        )
+
+    def texts(self):
+        """Sequence view of all texts"""
+        return StoredTexts(self)
+
+    def chunks(self):
+        """Sequence view of all chunks, or None when the store holds plain texts"""
+        return StoredChunks(self) if self.has_chunks else None
+
+
+class StoredView(abc.ABC):
+    """
+    Read-only sequence over the documents of a store (all of them, or the
+    positions given).
+
+    Lists of items are never held: items are decoded on access, and
+    select() returns another view.
+    """
+
+    __slots__ = ('store', 'positions')
+
+    def __init__(self, store, positions=None):
+        self.store = store
+        self.positions = range(len(store)) if positions is None else positions
+
+    @abc.abstractmethod
+    def _item(self, position):
+        """The item stored at a position of the store"""
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(position) for position in self.positions[index]]
+        return self._item(self.positions[index])
+
+    def __iter__(self):
+        return map(self._item, self.positions)
+
+    def __reduce__(self):
+        # Pickled (e.g. for a job worker) as the plain list it stands for
+        return list, (list(self),)
+
+    def select(self, indices):
+        """View of the items at the given indices of this view"""
+        positions = self.positions
+        return type(self)(self.store, array('I', (positions[i] for i in indices)))
+
+    def iter_terms(self):
+        """Stored token tuple of each document"""
+        return map(self.store.terms, self.positions)
+
+    @property
+    def characters(self):
+        if len(self.positions) == len(self.store):
+            return self.store.characters
+        return sum(len(self.store.text(position)) for position in self.positions)
+
+
+class StoredTexts(StoredView):
+    """Texts of a store"""
+
+    __slots__ = ()
+
+    def _item(self, position):
+        return self.store.text(position)
+
+    def document_keys(self):
+        """search_index.document_keys() of these texts, from the stored digests"""
+        keys = []
+        occurrences = {}
+        for position in self.positions:
+            digest = self.store.digest(position)
+            n = occurrences.get(digest, 0)
+            occurrences[digest] = n + 1
+            keys.append((digest, n))
+        return keys
+
+
+class StoredChunks(StoredView):
+    """Chunks of a store, built as chunking.Chunk on access"""
+
+    __slots__ = ()
+
+    def _item(self, position):
+        return self.store.chunk(position)
+
+    def document_keys(self):
+        """search_index.document_keys() of these chunks, from the stored digests"""
+        store = self.store
+        files = store._sections['chunk_files']
+        indexes = store._sections['chunk_indexes']
+        return [(store.files[files[position]], indexes[position], store.digest(position))
+                for position in self.positions]
+
+
+def select_documents(documents, positions):
+    """The documents at the given positions: a view for a stored corpus, a list otherwise"""
+    select = getattr(documents, 'select', None)
+    if select is not None:
+        return select(positions)
+    return [documents[position] for position in positions]
+
+
+def open_corpus_store(path, tokenizer):
+    """
+    The store saved at path, or None when it is missing, unreadable or was
+    tokenized with other settings
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        store = CorpusStore.open(path)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not open corpus store {path}: {e}")
+        return None
+    if store.tokenizer != tokenizer:
+        print(f"Corpus store {path} was tokenized with other settings; ignoring it")
+        return None
+    return store
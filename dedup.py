@@ -0,0 +1,190 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+Vector stores often hold several republished or amended versions of the same
+resolution. Before theme analysis the corpus is collapsed to one canonical
+representative per group of near-identical texts, so themes count unique
+documents.
+
+Each document's word shingles are hashed once into a one-permutation MinHash
+signature (the minimum hash per bin), which costs O(shingles) per document.
+Signatures are cut into bands; documents sharing a band bucket are candidate
+duplicates and are confirmed when their estimated Jaccard similarity reaches
+the threshold. Each new bucket member is only compared with the bucket's
+first member, so grouping stays roughly linear in the corpus size.
+"""
+
+import zlib
+
+from corpus_store import select_documents
+
+EMPTY_BIN = -1
+
+
+def shingles(tokens, size=3):
+    """Overlapping word n-grams of a token sequence (the whole text if shorter)"""
+    if len(tokens) <= size:
+        return [' '.join(tokens)] if tokens else []
+    return [' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+def signature(tokens, bins=64, shingle_size=3):
+    """
+    One-permutation MinHash signature of a token sequence.
+
+    Returns:
+        Tuple of one value per bin (EMPTY_BIN where no shingle fell), or None
+        for an empty document
+    """
+    values = [EMPTY_BIN] * bins
+    found = False
+    for shingle in shingles(tokens, shingle_size):
+        h = zlib.crc32(shingle.encode('utf-8'))
+        b = h % bins
+        v = h // bins
+        if values[b] == EMPTY_BIN or v < values[b]:
+            values[b] = v
+        found = True
+    return tuple(values) if found else None
+
+
+def estimated_similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    used = equal = 0
+    for x, y in zip(a, b):
+        if x == EMPTY_BIN and y == EMPTY_BIN:
+            continue
+        used += 1
+        if x == y:
+            equal += 1
+    return equal / used if used else 0.0
+
+
+class DedupResult:
+    """
+    Outcome of grouping a corpus.
+
+    Attributes:
+        canonical: Positions of the representatives, in corpus order
+        duplicates: Number of documents collapsed into each representative
+            (aligned with canonical)
+        group_of: Representative position of every document
+    """
+
+    __slots__ = ('canonical', 'duplicates', 'group_of')
+
+    def __init__(self, canonical, duplicates, group_of):
+        self.canonical = canonical
+        self.duplicates = duplicates
+        self.group_of = group_of
+
+    @property
+    def collapsed(self):
+        return len(self.group_of) - len(self.canonical)
+
+
+class Deduplicator:
+    """
+    Group near-identical documents.
+
+    Args:
+        threshold: Estimated Jaccard similarity from which two documents are
+            the same (0 < threshold <= 1)
+        bins: Signature length
+        bands: LSH bands the signature is cut into (bins must divide evenly)
+        shingle_size: Words per shingle
+    """
+
+    def __init__(self, threshold=0.8, bins=64, bands=16, shingle_size=3):
+        if bins % bands:
+            raise ValueError("bins must be a multiple of bands")
+        self.threshold = threshold
+        self.bins = bins
+        self.bands = bands
+        self.rows = bins // bands
+        self.shingle_size = shingle_size
+
+    def group(self, texts, token_lists):
+        """
+        Group documents and pick the longest text of each group as its
+        representative.
+
+        Args:
+            texts: Document texts
+            token_lists: Tokens of each document (e.g. from the preprocessing
+                pipeline), aligned with texts; read once, so an iterator will do
+
+        Returns:
+            DedupResult
+        """
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        signatures = []
+        buckets = {}
+        rows = self.rows
+        for position, tokens in enumerate(token_lists):
+            sig = signature(tokens, self.bins, self.shingle_size)
+            signatures.append(sig)
+            if sig is None:
+                continue
+            for band in range(self.bands):
+                values = sig[band * rows:(band + 1) * rows]
+                if all(value == EMPTY_BIN for value in values):
+                    continue
+                key = (band, values)
+                first = buckets.get(key)
+                if first is None:
+                    buckets[key] = position
+                    continue
+                root, other = find(position), find(first)
+                if root != other and estimated_similarity(sig, signatures[first]) >= self.threshold:
+                    parent[root] = other
+
+        # Representative: longest text of the group, earliest on ties
+        lengths = [len(text) for text in texts]
+        best = {}
+        for position, length in enumerate(lengths):
+            root = find(position)
+            current = best.get(root)
+            if current is None or length > lengths[current]:
+                best[root] = position
+
+        group_of = [best[find(position)] for position in range(len(texts))]
+        counts = {}
+        for representative in group_of:
+            counts[representative] = counts.get(representative, 0) + 1
+        canonical = sorted(counts)
+        return DedupResult(canonical, [counts[p] - 1 for p in canonical], group_of)
+
+
+def add_duplicate_counts(theme, duplicates, positions):
+    """
+    Record on a theme dict how many near-duplicates its members absorbed.
+
+    Args:
+        theme: Theme dict; gains 'duplicates_collapsed'
+        duplicates: Collapsed duplicate count of every analysed document
+        positions: Indices of the theme's members
+    """
+    theme['duplicates_collapsed'] = sum(duplicates[position] for position in positions)
+
+
+def collapse_duplicates(deduplicator, documents, token_lists, chunks=None):
+    """
+    Keep one representative per group of near-duplicates.
+
+    Returns:
+        (documents, chunks, result): the canonical documents and their chunks
+        (None when no chunks were given) in corpus order, and the DedupResult;
+        for a stored corpus (see corpus_store.py) views instead of lists
+    """
+    result = deduplicator.group(documents, token_lists)
+    unique = select_documents(documents, result.canonical)
+    unique_chunks = select_documents(chunks, result.canonical) if chunks is not None else None
+    return unique, unique_chunks, result
@@ -0,0 +1,259 @@
+"""
+Persistent on-disk cache of Vector Store documents with incremental sync.
+
+Raw file contents are stored in a local SQLite database keyed by the vector
+store file id, together with a content hash, the remote version marker and
+the time they were fetched. A sync lists the remote file ids and only
+downloads files that are new or whose remote version changed, and deletes
+files that were removed remotely; a download whose content hash matches the
+cached one only updates the version marker. Restarts therefore cost one
+listing instead of a full re-download, and the cached corpus can still be
+served when the remote store is unreachable.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    remote_version TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    content TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Number of downloaded files written per transaction during a sync
+COMMIT_EVERY = 100
+
+
+def content_hash(text):
+    """Hash used to detect content changes"""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def remote_version(file_obj):
+    """
+    Version marker of a vector store file as reported by files.list.
+
+    The file id and its creation time are the source of truth: file contents
+    are immutable, so other content means another upload. usage_bytes is not
+    used -- it measures the store's processed chunks, changes while a file is
+    still being processed and says nothing about the content. The content
+    hash of each download settles whether anything really changed.
+    """
+    return str(getattr(file_obj, 'created_at', ''))
+
+
+def same_version(local, remote):
+    """Compare version markers, reading older "created_at:usage_bytes" ones by creation time"""
+    return local is not None and local.partition(':')[0] == remote
+
+
+class SyncResult:
+    """Counters describing one delta sync"""
+
+    __slots__ = ('listed', 'added', 'updated', 'unchanged', 'deleted', 'failed', 'duration')
+
+    def __init__(self):
+        self.listed = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.failed = 0
+        self.duration = 0.0
+
+    @property
+    def changed(self):
+        return bool(self.added or self.updated or self.deleted)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class DocumentCache:
+    """
+    SQLite-backed document cache.
+
+    Args:
+        path: Database file; parent directories are created when missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+        self.last_sync = None
+        self.last_sync_error = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        conn.commit()
+        return conn
+
+    def reopen(self):
+        """
+        Open a fresh connection, e.g. in a forked child process.
+
+        SQLite connections must not be used across os.fork(); the inherited one
+        is abandoned rather than closed so the parent's handle is unaffected.
+        """
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def versions(self):
+        """Map of file id to the remote version stored locally"""
+        with self._lock:
+            rows = self._conn.execute('SELECT file_id, remote_version FROM documents')
+            return dict(rows.fetchall())
+
+    def iter_documents(self):
+        """
+        Yield (file_id, content) in remote listing order.
+
+        Contents are read one file at a time, so only the file being consumed
+        is held in memory.
+        """
+        with self._lock:
+            file_ids = [row[0] for row in self._conn.execute(
+                'SELECT file_id FROM documents ORDER BY position, file_id'
+            )]
+        for file_id in file_ids:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT content FROM documents WHERE file_id = ?', (file_id,)
+                ).fetchone()
+            if row is not None:
+                yield file_id, row[0]
+
+    def get_metadata(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM metadata WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def sync(self, fetcher):
+        """
+        Bring the cache in line with the remote vector store.
+
+        Only new or changed files are downloaded; files no longer listed
+        remotely are deleted. Listing errors propagate and leave the cache
+        untouched, so the previous contents can still be served.
+
+        Args:
+            fetcher: VectorStoreFetcher for the remote store
+
+        Returns:
+            SyncResult with the change counters
+        """
+        started = time.time()
+        result = SyncResult()
+
+        try:
+            remote_files = list(fetcher.iter_files())
+        except Exception as e:
+            self.last_sync_error = str(e)
+            raise
+
+        result.listed = len(remote_files)
+        local_versions = self.versions()
+        positions = {}
+        versions = {}
+        to_fetch = []
+
+        for position, file_obj in enumerate(remote_files):
+            positions[file_obj.id] = position
+            versions[file_obj.id] = remote_version(file_obj)
+            if not same_version(local_versions.get(file_obj.id), versions[file_obj.id]):
+                to_fetch.append(file_obj)
+            else:
+                result.unchanged += 1
+
+        written = 0
+        for file_id, text, error in fetcher.iter_contents(to_fetch):
+            if error is not None:
+                print(f"Error retrieving file {file_id}: {error}")
+                result.failed += 1
+                continue
+
+            digest = content_hash(text)
+            with self._lock:
+                if file_id in local_versions:
+                    row = self._conn.execute(
+                        'SELECT content_hash FROM documents WHERE file_id = ?', (file_id,)
+                    ).fetchone()
+                    if row is not None and row[0] == digest:
+                        # Same content under a new marker: nothing to rewrite
+                        self._conn.execute(
+                            'UPDATE documents SET remote_version = ?, fetched_at = ? WHERE file_id = ?',
+                            (versions[file_id], time.time(), file_id)
+                        )
+                        result.unchanged += 1
+                        continue
+                    result.updated += 1
+                else:
+                    result.added += 1
+
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO documents '
+                    '(file_id, position, remote_version, content_hash, content, fetched_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (file_id, positions[file_id], versions[file_id],
+                     digest, text, time.time())
+                )
+                written += 1
+                # Commit in batches so an interrupted sync keeps its progress
+                if written % COMMIT_EVERY == 0:
+                    self._conn.commit()
+
+        removed = [file_id for file_id in local_versions if file_id not in positions]
+
+        with self._lock:
+            self._conn.executemany('DELETE FROM documents WHERE file_id = ?',
+                                   [(file_id,) for file_id in removed])
+            self._conn.executemany('UPDATE documents SET position = ? WHERE file_id = ?',
+                                   [(position, file_id) for file_id, position in positions.items()])
+            self._conn.execute('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)',
+                               ('last_sync_at', str(time.time())))
+            self._conn.commit()
+
+        result.deleted = len(removed)
+        result.duration = time.time() - started
+        self.last_sync = result
+        self.last_sync_error = None
+        return result
+
+    def status(self):
+        """Describe the cache contents and the last sync"""
+        last_sync_at = self.get_metadata('last_sync_at')
+        return {
+            'path': self.path,
+            'documents': len(self),
+            'last_sync_at': float(last_sync_at) if last_sync_at else None,
+            'last_sync': self.last_sync.as_dict() if self.last_sync else None,
+            'last_sync_error': self.last_sync_error
+        }
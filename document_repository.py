@@ -0,0 +1,322 @@
+"""
+Process-wide document repository for the Theme Navigator servers.
+
+The repository loads the regulation corpus once, keeps an immutable snapshot
+that every request handler reads, and refreshes that snapshot in a background
+thread (on a fixed interval or on demand). Request handlers never talk to the
+remote Vector Store themselves, so a slow or unavailable store never blocks a
+request: the previous snapshot keeps being served until a refresh succeeds.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from corpus_store import CorpusStore
+from profiling import stage
+
+# Seconds between checks of a followed corpus file (see DocumentRepository.follow)
+FOLLOW_INTERVAL = 5
+
+
+class DocumentSnapshot:
+    """
+    Immutable view of the corpus at a point in time.
+
+    Documents may be plain texts or chunks with a .text attribute (see
+    chunking.Chunk); for chunks, .documents holds their texts and .chunks the
+    chunks themselves, so results can be traced back to the source files.
+
+    A CorpusStore is served through its views instead (.store keeps it, None
+    for corpora held as Python objects), with the version it was built for.
+    """
+
+    __slots__ = ('documents', 'chunks', 'source', 'loaded_at', 'version', 'store')
+
+    def __init__(self, documents, source, loaded_at=None):
+        self.source = source
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        if isinstance(documents, CorpusStore):
+            self.store = documents
+            self.documents = documents.texts()
+            self.chunks = documents.chunks()
+            self.version = documents.version
+            return
+        self.store = None
+        documents = tuple(documents)
+        if documents and not isinstance(documents[0], str):
+            self.chunks = documents
+            self.documents = tuple(chunk.text for chunk in documents)
+        else:
+            self.chunks = None
+            self.documents = documents
+        self.version = corpus_fingerprint(self.documents)
+
+    @property
+    def age_seconds(self):
+        """Seconds elapsed since this snapshot was loaded"""
+        return max(0.0, time.time() - self.loaded_at)
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def corpus_fingerprint(documents):
+    """
+    Compute a short, stable fingerprint for a sequence of documents.
+
+    Two corpora with the same documents in the same order share a fingerprint,
+    so it can be used as a version key for anything derived from the corpus.
+    """
+    digest = hashlib.sha1()
+    for doc in documents:
+        digest.update(doc.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\x00')
+    return digest.hexdigest()[:16]
+
+
+class DocumentRepository:
+    """
+    Shared, thread-safe holder of the current corpus snapshot.
+
+    Args:
+        loader: Callable returning a list of document texts (or chunks), a
+            corpus_store.CorpusStore, or None when the remote source is not
+            available
+        fallback_documents: Documents served when the loader never succeeded
+        refresh_interval: Seconds between background refreshes (None or 0
+            disables periodic refresh; refresh() can still be called)
+        source_name: Label reported for snapshots produced by the loader
+        fallback_source_name: Label reported for the fallback snapshot
+    """
+
+    def __init__(self, loader, fallback_documents, refresh_interval=None,
+                 source_name='vector_store', fallback_source_name='sample_data'):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.source_name = source_name
+        self.fallback_source_name = fallback_source_name
+
+        self._snapshot = DocumentSnapshot(fallback_documents, fallback_source_name)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()
+        self._thread = None
+        self._listeners = []
+        # Callable asking another process to refresh instead (prefork workers
+        # ask the parent, whose refreshed corpus they follow)
+        self.refresh_requester = None
+
+        self.last_refresh_at = None
+        self.last_refresh_error = None
+        self.refresh_count = 0
+
+    def snapshot(self):
+        """Return the current snapshot (never blocks on the remote store)"""
+        with self._lock:
+            return self._snapshot
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) every time a new snapshot is installed"""
+        self._listeners.append(callback)
+
+    def clear_listeners(self):
+        """Stop calling the listeners (e.g. in a process that no longer serves)"""
+        self._listeners = []
+
+    @property
+    def age_seconds(self):
+        """Age in seconds of the snapshot currently being served"""
+        return self.snapshot().age_seconds
+
+    @property
+    def is_refreshing(self):
+        return self._refresh_lock.locked()
+
+    def refresh(self):
+        """
+        Reload the corpus synchronously and swap in the new snapshot.
+
+        Returns:
+            True if a new snapshot was installed, False if the loader failed or
+            another refresh was already running
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+
+        try:
+            self.last_refresh_at = time.time()
+            try:
+                with stage('fetch'):
+                    documents = self.loader()
+            except Exception as e:
+                self.last_refresh_error = str(e)
+                print(f"Error refreshing documents: {e}")
+                return False
+
+            if not documents:
+                self.last_refresh_error = 'loader returned no documents'
+                return False
+
+            snapshot = DocumentSnapshot(documents, self.source_name)
+            self._install(snapshot)
+            self.last_refresh_error = None
+            self.refresh_count += 1
+            print(f"Document repository refreshed: {len(snapshot)} documents "
+                  f"(version {snapshot.version})")
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def seed(self, documents, source):
+        """
+        Serve documents that are available locally until the first refresh.
+
+        Used at startup to serve e.g. the on-disk cache straight away while
+        the slower remote load runs in the background.
+        """
+        if documents:
+            self._install(DocumentSnapshot(documents, source))
+
+    def _install(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Error in document repository listener: {e}")
+
+    def request_refresh(self):
+        """
+        Ask the background thread to refresh as soon as possible.
+
+        Returns immediately; if no background thread is running a one-off
+        refresh thread is started instead.
+        """
+        if self.refresh_requester is not None:
+            self.refresh_requester()
+        elif self._thread is not None and self._thread.is_alive():
+            self._wakeup_event.set()
+        else:
+            threading.Thread(target=self.refresh, name='document-refresh', daemon=True).start()
+
+    def start(self, block=True):
+        """
+        Perform the initial load and start the background refresh thread.
+
+        Args:
+            block: Load synchronously before returning. When False the fallback
+                snapshot is served until the first background load completes.
+        """
+        if block:
+            self.refresh()
+        elif not self.refresh_interval:
+            self.request_refresh()
+
+        self.start_refresh_thread(refresh_immediately=not block)
+
+    def start_refresh_thread(self, refresh_immediately=False):
+        """
+        Start the periodic refresh thread if an interval is configured.
+
+        Also used after os.fork(), since threads do not survive into children.
+        """
+        if not self.refresh_interval:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(refresh_immediately,), name='document-refresh', daemon=True
+        )
+        self._thread.start()
+
+    def follow(self, path, open_documents, interval=FOLLOW_INTERVAL):
+        """
+        Install the corpus another process writes to path, every time the file
+        is replaced, instead of loading it here.
+
+        Prefork workers follow the corpus store the parent refreshes, so they
+        all serve the same corpus, mapped from the same file.
+
+        Args:
+            path: File to watch (replaced atomically by the writer)
+            open_documents: Callable(path) returning the documents in it (e.g.
+                a mapped corpus_store.CorpusStore), or None when unreadable
+            interval: Seconds between checks of the file
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._follow, args=(path, open_documents, interval), name='document-follow',
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh thread"""
+        self._stop_event.set()
+        self._wakeup_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        """Describe the current snapshot and refresh state"""
+        snapshot = self.snapshot()
+        store = snapshot.store
+        return {
+            'source': snapshot.source,
+            'corpus_store': None if store is None else {
+                'path': store.path, 'mapped': store.mapped, 'bytes': store.nbytes,
+                'vocabulary': len(store.vocabulary)
+            },
+            'total_documents': len(snapshot),
+            'version': snapshot.version,
+            'loaded_at': snapshot.loaded_at,
+            'snapshot_age_seconds': round(snapshot.age_seconds, 3),
+            'refresh_interval': self.refresh_interval,
+            'refreshing': self.is_refreshing,
+            'last_refresh_at': self.last_refresh_at,
+            'last_refresh_error': self.last_refresh_error,
+            'refresh_count': self.refresh_count
+        }
+
+    def _run(self, refresh_immediately):
+        if refresh_immediately:
+            self.refresh()
+        while not self._stop_event.is_set():
+            self._wakeup_event.wait(self.refresh_interval)
+            self._wakeup_event.clear()
+            if self._stop_event.is_set():
+                break
+            self.refresh()
+
+    def _follow(self, path, open_documents, interval):
+        seen = file_signature(path)
+        while not self._stop_event.wait(interval):
+            current = file_signature(path)
+            if current is None or current == seen:
+                continue
+            seen = current
+            try:
+                documents = open_documents(path)
+            except Exception as e:
+                print(f"Error reading followed corpus {path}: {e}")
+                continue
+            if not documents:
+                continue
+            snapshot = DocumentSnapshot(documents, self.source_name)
+            if snapshot.version != self.snapshot().version:
+                self._install(snapshot)
+                self.refresh_count += 1
+                self.last_refresh_at = time.time()
+
+
+def file_signature(path):
+    """What changes when a file is replaced or rewritten (None when missing)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,131 @@
+"""
+HTTP caching: in-memory templates and conditional requests.
+
+Templates are read once, kept in memory together with a gzip-compressed copy
+and reloaded only when the file's modification time or size changes (one
+os.stat per request). Each one carries an ETag and a Last-Modified date, so
+browsers revalidate with If-None-Match / If-Modified-Since and get a 304
+without a body when nothing changed.
+
+API responses are a function of the corpus version and the request target,
+so their ETag is derived from both; a revalidation is answered with a 304
+before any analysis or serialization runs. Responses are sent with
+Cache-Control: no-cache, i.e. clients may keep them but must revalidate.
+
+ETags are weak (W/"...") because the same resource is sent gzip-compressed
+or not depending on Accept-Encoding.
+"""
+
+import email.utils
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+
+# API paths whose responses depend only on the corpus version and the URL
+CACHEABLE_API_PATHS = ('/api/themes', '/api/theme/', '/api/documents', '/api/search')
+
+
+class CachedTemplate:
+    """One template file held in memory"""
+
+    __slots__ = ('body', 'gzip_body', 'etag', 'last_modified', 'mtime', 'size')
+
+    def __init__(self, body, mtime, size):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=9)
+        self.etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+        self.mtime = mtime
+        self.size = size
+
+
+class TemplateCache:
+    """
+    Thread-safe cache of template files, reloaded on change.
+
+    Args:
+        directory: Directory the template names are relative to
+    """
+
+    def __init__(self, directory='templates'):
+        self.directory = directory
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, name):
+        """
+        The cached template, (re)loaded when the file changed.
+
+        Raises:
+            FileNotFoundError: when the template does not exist
+        """
+        path = os.path.join(self.directory, name)
+        stat = os.stat(path)
+        cached = self._templates.get(name)
+        if cached is not None and cached.mtime == stat.st_mtime and cached.size == stat.st_size:
+            return cached
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        cached = CachedTemplate(body, stat.st_mtime, stat.st_size)
+        with self._lock:
+            self._templates[name] = cached
+            self.loads += 1
+        return cached
+
+    def first(self, *names):
+        """The first of several templates that exists"""
+        for name in names[:-1]:
+            try:
+                return self.get(name)
+            except FileNotFoundError:
+                continue
+        return self.get(names[-1])
+
+
+def is_cacheable_api_path(path):
+    return path.startswith(CACHEABLE_API_PATHS)
+
+
+def corpus_etag(version, target):
+    """Weak ETag of an API response: corpus version plus request path and query"""
+    return f'W/"{version}-{zlib.crc32(target.encode("utf-8")):08x}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def not_modified(headers, etag, mtime=None):
+    """
+    Whether a conditional GET can be answered with 304.
+
+    If-None-Match takes precedence; If-Modified-Since is only considered
+    without it and when the resource has a modification time.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and mtime is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
@@ -0,0 +1,427 @@
+"""
+Vectorized scoring engine for the industrial location analysis.
+
+Implements the region ranking of templates/industrial_location.html
+(calculateAnalysis) in NumPy so that many load/weight scenarios are scored
+at once: every input becomes an array with one row per evaluated case and the
+regions along the second axis, and costs, criteria scores and the weighted
+total are computed with broadcasting. The maximum OPEX used to normalize the
+cost score is taken once per case instead of once per region.
+
+On top of plain scenarios the engine runs sensitivity analyses:
+
+- sweep: a grid over the weights (every combination of the listed values),
+  reporting how often each region ranks first and its mean rank
+- monte_carlo: random energy prices (lognormal multipliers per region),
+  reporting score and OPEX percentiles and the probability of ranking first
+
+REGIONAL_DATA mirrors the table in the page; both must be kept in step.
+"""
+
+import itertools
+import math
+
+import numpy as np
+
+# Regional data of the Brazilian regions (2024-2025)
+REGIONAL_DATA = {
+    'Sul (RS, SC, PR)': {
+        'tusd': 85, 'tust': 45, 'energyPrice': 220, 'connectionCost': 450000,
+        'connectionAvailability': 'Alta', 'connectionTime': 18, 'taxIncentive': 12,
+        'landCost': 'Médio', 'renewableEnergy': 65, 'congestionRisk': 'Baixo',
+        'infrastructure': 'Boa', 'color': '#667eea'
+    },
+    'Sudeste (SP, RJ, MG, ES)': {
+        'tusd': 120, 'tust': 65, 'energyPrice': 260, 'connectionCost': 650000,
+        'connectionAvailability': 'Média', 'connectionTime': 24, 'taxIncentive': 5,
+        'landCost': 'Alto', 'renewableEnergy': 45, 'congestionRisk': 'Alto',
+        'infrastructure': 'Boa', 'color': '#f56565'
+    },
+    'Nordeste (BA, CE, PE, RN)': {
+        'tusd': 95, 'tust': 50, 'energyPrice': 200, 'connectionCost': 380000,
+        'connectionAvailability': 'Alta', 'connectionTime': 20, 'taxIncentive': 75,
+        'landCost': 'Baixo', 'renewableEnergy': 80, 'congestionRisk': 'Baixo',
+        'infrastructure': 'Regular', 'color': '#48bb78'
+    },
+    'Centro-Oeste (GO, MT, MS, DF)': {
+        'tusd': 100, 'tust': 55, 'energyPrice': 230, 'connectionCost': 420000,
+        'connectionAvailability': 'Média', 'connectionTime': 22, 'taxIncentive': 30,
+        'landCost': 'Médio', 'renewableEnergy': 55, 'congestionRisk': 'Médio',
+        'infrastructure': 'Regular', 'color': '#ed8936'
+    },
+    'Norte (PA, AM)': {
+        'tusd': 110, 'tust': 70, 'energyPrice': 240, 'connectionCost': 550000,
+        'connectionAvailability': 'Baixa', 'connectionTime': 30, 'taxIncentive': 50,
+        'landCost': 'Baixo', 'renewableEnergy': 90, 'congestionRisk': 'Médio',
+        'infrastructure': 'Precária', 'color': '#9f7aea'
+    }
+}
+
+HOURS_PER_YEAR = 8760
+CHARGES_RATE = 0.15            # estimated sector charges, share of the energy cost
+INFRASTRUCTURE_RATE = 0.5      # infrastructure CAPEX, share of the connection CAPEX
+MAX_CONNECTION_MONTHS = 36
+AVAILABILITY_SCORES = {'Alta': 100, 'Média': 60, 'Baixa': 30}
+INFRASTRUCTURE_SCORES = {'Boa': 100, 'Regular': 60, 'Precária': 30}
+
+# Criteria in the order of the weight vector
+WEIGHT_KEYS = ('cost', 'connectionTime', 'reliability', 'taxIncentives', 'infrastructure', 'renewable')
+DEFAULT_WEIGHTS = {'cost': 40, 'connectionTime': 20, 'reliability': 15, 'taxIncentives': 10,
+                   'infrastructure': 10, 'renewable': 5}
+DEFAULT_LOAD = {'avgLoad': 50, 'peakLoad': 70, 'loadFactor': 80}
+
+# Upper bound on scenario x sweep point x sample cases per request
+MAX_CASES = 2000000
+# Cases evaluated per NumPy batch, to bound temporary arrays
+BATCH_CASES = 100000
+
+
+class ScenarioError(ValueError):
+    """Invalid scoring request"""
+
+
+class RegionTable:
+    """
+    Regional data as column arrays (one entry per region).
+
+    Args:
+        regional_data: Mapping of region name -> attributes, as REGIONAL_DATA
+    """
+
+    def __init__(self, regional_data=REGIONAL_DATA):
+        self.names = list(regional_data)
+        self.data = regional_data
+        rows = list(regional_data.values())
+        column = lambda key: np.array([row[key] for row in rows], dtype=np.float64)
+        self.tusd = column('tusd')
+        self.tust = column('tust')
+        self.energy_price = column('energyPrice')
+        self.connection_cost = column('connectionCost')
+        self.connection_time = column('connectionTime')
+        self.tax_incentive = column('taxIncentive')
+        self.renewable = column('renewableEnergy')
+        self.reliability = np.array([AVAILABILITY_SCORES[row['connectionAvailability']] for row in rows],
+                                    dtype=np.float64)
+        self.infrastructure = np.array([INFRASTRUCTURE_SCORES[row['infrastructure']] for row in rows],
+                                       dtype=np.float64)
+        # Criteria that do not depend on the scenario
+        self.time_score = (1 - self.connection_time / MAX_CONNECTION_MONTHS) * 100
+
+    def __len__(self):
+        return len(self.names)
+
+
+def evaluate(table, avg_load, peak_load, load_factor, weights, price_multiplier=None):
+    """
+    Costs and scores of every case against every region.
+
+    Args:
+        table: RegionTable
+        avg_load, peak_load, load_factor: Arrays of shape (n,) -- MW, MW, %
+        weights: Array (n, 6) in WEIGHT_KEYS order, in percent
+        price_multiplier: Optional (n, regions) factors on the energy price
+
+    Returns:
+        Dict of arrays of shape (n, regions): opex components, capex, scores
+    """
+    energy = (avg_load * HOURS_PER_YEAR * (load_factor / 100))[:, None]   # MWh/year
+    peak = peak_load[:, None]
+
+    price = table.energy_price if price_multiplier is None else table.energy_price * price_multiplier
+    energy_cost = energy * price
+    tusd_cost = peak * table.tusd * 12
+    tust_cost = peak * table.tust * 12
+    charges = energy_cost * CHARGES_RATE
+    opex = energy_cost + tusd_cost + tust_cost + charges
+
+    connection_capex = peak * table.connection_cost
+    infrastructure_capex = connection_capex * INFRASTRUCTURE_RATE
+    capex = connection_capex + infrastructure_capex
+
+    max_opex = opex.max(axis=1, keepdims=True)
+    cost_score = (1 - opex / np.where(max_opex > 0, max_opex, 1)) * 100
+    shape = opex.shape
+    criteria = np.stack([
+        cost_score,
+        np.broadcast_to(table.time_score, shape),
+        np.broadcast_to(table.reliability, shape),
+        np.broadcast_to(table.tax_incentive, shape),
+        np.broadcast_to(table.infrastructure, shape),
+        np.broadcast_to(table.renewable, shape),
+    ], axis=2)
+    score = np.einsum('nrc,nc->nr', criteria, weights / 100)
+
+    return {
+        'energy': np.broadcast_to(energy, shape),
+        'energy_cost': energy_cost,
+        'tusd_cost': np.broadcast_to(tusd_cost, shape),
+        'tust_cost': np.broadcast_to(tust_cost, shape),
+        'charges': charges,
+        'opex': opex,
+        'connection_capex': np.broadcast_to(connection_capex, shape),
+        'infrastructure_capex': np.broadcast_to(infrastructure_capex, shape),
+        'capex': np.broadcast_to(capex, shape),
+        'cost_score': cost_score,
+        'score': score,
+    }
+
+
+def ranks(scores):
+    """1-based rank of each region per case, best score first (n, regions)"""
+    order = np.argsort(-scores, axis=1, kind='stable')
+    result = np.empty_like(order)
+    np.put_along_axis(result, order, np.arange(1, scores.shape[1] + 1), axis=1)
+    return result
+
+
+def parse_scenario(raw, index):
+    """(name, load tuple, weight vector, energy price multiplier) of one request scenario"""
+    if not isinstance(raw, dict):
+        raise ScenarioError(f"Scenario {index} must be an object")
+    try:
+        load = tuple(float(raw.get(key, DEFAULT_LOAD[key])) for key in ('avgLoad', 'peakLoad', 'loadFactor'))
+        raw_weights = dict(DEFAULT_WEIGHTS, **(raw.get('weights') or {}))
+        weights = [float(raw_weights[key]) for key in WEIGHT_KEYS]
+        multiplier = float(raw.get('energyPriceMultiplier', 1.0))
+    except (TypeError, ValueError):
+        raise ScenarioError(f"Scenario {index} has a non-numeric value")
+    if not np.isfinite([*load, *weights, multiplier]).all():
+        raise ScenarioError(f"Scenario {index} has a non-finite value")
+    if min(load) < 0 or multiplier <= 0:
+        raise ScenarioError(f"Scenario {index} has a negative load or price multiplier")
+    return str(raw.get('name', f"Cenário {index + 1}")), load, weights, multiplier
+
+
+def sweep_values(sweep):
+    """
+    Validated (keys, value lists) of a weight sweep.
+
+    Args:
+        sweep: Mapping of weight key -> list of values
+    """
+    unknown = set(sweep) - set(WEIGHT_KEYS)
+    if unknown:
+        raise ScenarioError(f"Unknown weights in sweep: {', '.join(sorted(unknown))}")
+    keys = [key for key in WEIGHT_KEYS if key in sweep]
+    if not all(isinstance(sweep[key], list) for key in keys):
+        raise ScenarioError("Sweep values must be lists of numbers")
+    try:
+        values = [[float(v) for v in sweep[key]] for key in keys]
+    except (TypeError, ValueError):
+        raise ScenarioError("Sweep values must be lists of numbers")
+    if not all(np.isfinite(v).all() for v in values):
+        raise ScenarioError("Sweep values must be finite")
+    return keys, values
+
+
+def sweep_size(values):
+    """Number of grid points a sweep expands to (see weight_grid)"""
+    return max(1, math.prod(len(v) for v in values))
+
+
+def weight_grid(base_weights, keys, values):
+    """
+    Every combination of the swept weight values (other weights fixed).
+
+    Args:
+        base_weights: Weight vector of the scenario
+        keys, values: Swept weights and their values, from sweep_values()
+
+    Returns:
+        Array (points, 6)
+    """
+    grid = np.tile(np.asarray(base_weights, dtype=np.float64), (sweep_size(values), 1))
+    for row, combination in zip(grid, itertools.product(*values)):
+        for key, value in zip(keys, combination):
+            row[WEIGHT_KEYS.index(key)] = value
+    return grid
+
+
+class LocationScorer:
+    """
+    Score load/weight scenarios against the regions.
+
+    Args:
+        regional_data: Mapping of region name -> attributes (default REGIONAL_DATA)
+    """
+
+    def __init__(self, regional_data=REGIONAL_DATA):
+        self.table = RegionTable(regional_data)
+
+    def score(self, request):
+        """
+        Evaluate a scoring request.
+
+        Args:
+            request: Dict with 'scenarios' (list of {name, avgLoad, peakLoad,
+                loadFactor, weights, energyPriceMultiplier}) and optionally
+                'sweep' ({'weights': {key: [values]}}), 'monte_carlo'
+                ({'samples', 'price_volatility', 'seed'}) and 'points' (return
+                every sweep point)
+
+        Returns:
+            Dict with one result per scenario
+
+        Raises:
+            ScenarioError: for invalid requests
+        """
+        raw_scenarios = request.get('scenarios')
+        if raw_scenarios is None:
+            raw_scenarios = [request]
+        if not isinstance(raw_scenarios, list) or not raw_scenarios:
+            raise ScenarioError("scenarios must be a non-empty list")
+        scenarios = [parse_scenario(raw, i) for i, raw in enumerate(raw_scenarios)]
+
+        sweep = request.get('sweep') or {}
+        monte_carlo = request.get('monte_carlo') or {}
+        if not isinstance(sweep, dict) or not isinstance(monte_carlo, dict):
+            raise ScenarioError("sweep and monte_carlo must be objects")
+        sweep = sweep.get('weights')
+        if sweep is not None and not isinstance(sweep, dict):
+            raise ScenarioError("sweep.weights must map weight names to lists of values")
+        try:
+            samples = int(monte_carlo.get('samples', 1000)) if monte_carlo else 0
+            volatility = float(monte_carlo.get('price_volatility', 0.1))
+        except (TypeError, ValueError, OverflowError):
+            raise ScenarioError("monte_carlo.samples and price_volatility must be numbers")
+        if samples < 0 or not (np.isfinite(volatility) and volatility >= 0):
+            raise ScenarioError("samples and price_volatility must be finite and not negative")
+        seed = monte_carlo.get('seed')
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+            raise ScenarioError("monte_carlo.seed must be a non-negative integer")
+        # Counted before any grid is built, so oversized sweeps cost nothing
+        keys, values = sweep_values(sweep) if sweep else ((), ())
+        points = sweep_size(values) if sweep else 0
+        n_cases = len(scenarios) * (1 + points + samples)
+        if n_cases > MAX_CASES:
+            raise ScenarioError(f"Request needs {n_cases} evaluations, more than {MAX_CASES}")
+        grids = [weight_grid(weights, keys, values) for _, _, weights, _ in scenarios] if sweep else None
+
+        results = self._rank_scenarios(scenarios)
+        if grids:
+            for result, scenario, grid in zip(results, scenarios, grids):
+                result['sweep'] = self._sweep(scenario, grid, bool(request.get('points')))
+        if samples:
+            rng = np.random.default_rng(seed)
+            for result, scenario in zip(results, scenarios):
+                result['monte_carlo'] = self._monte_carlo(scenario, samples, volatility, rng)
+
+        return {'regions': self.table.names, 'scenarios': results, 'evaluations': n_cases}
+
+    def _arrays(self, scenarios):
+        load = np.array([load for _, load, _, _ in scenarios], dtype=np.float64)
+        weights = np.array([weights for _, _, weights, _ in scenarios], dtype=np.float64)
+        multiplier = np.array([m for _, _, _, m in scenarios], dtype=np.float64)[:, None]
+        return load[:, 0], load[:, 1], load[:, 2], weights, multiplier
+
+    def _rank_scenarios(self, scenarios):
+        """Full ranking of every scenario, as calculateAnalysis builds it"""
+        avg, peak, load_factor, weights, multiplier = self._arrays(scenarios)
+        multiplier = np.broadcast_to(multiplier, (len(scenarios), len(self.table)))
+        values = evaluate(self.table, avg, peak, load_factor, weights, multiplier)
+        rank = ranks(values['score'])
+        table = self.table
+
+        incentive_savings = values['opex'] * table.tax_incentive / 100
+        with np.errstate(divide='ignore', invalid='ignore'):
+            payback = np.where(incentive_savings > 0, values['capex'] / incentive_savings, np.inf)
+        # Average cost over 10 years (no inflation or discounting)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg_cost = (values['opex'] * 10 + values['capex']) / (values['energy'] * 10)
+
+        results = []
+        for s, (name, _, scenario_weights, _) in enumerate(scenarios):
+            regions = []
+            for r in np.argsort(rank[s]):
+                regions.append({
+                    'region': table.names[r],
+                    'rank': int(rank[s, r]),
+                    'score': float(values['score'][s, r]),
+                    'costScore': float(values['cost_score'][s, r]),
+                    'timeScore': float(table.time_score[r]),
+                    'reliabilityScore': float(table.reliability[r]),
+                    'infraScore': float(table.infrastructure[r]),
+                    'opex': {
+                        'energyCost': float(values['energy_cost'][s, r]),
+                        'tusdCost': float(values['tusd_cost'][s, r]),
+                        'tustCost': float(values['tust_cost'][s, r]),
+                        'charges': float(values['charges'][s, r]),
+                        'total': float(values['opex'][s, r])
+                    },
+                    'capex': {
+                        'connection': float(values['connection_capex'][s, r]),
+                        'infrastructure': float(values['infrastructure_capex'][s, r]),
+                        'total': float(values['capex'][s, r])
+                    },
+                    'firstYearCost': float(values['opex'][s, r] + values['capex'][s, r]),
+                    'avgCostMWh': float(avg_cost[s, r]) if np.isfinite(avg_cost[s, r]) else None,
+                    'payback': round(float(payback[s, r]), 1) if payback[s, r] <= 100 else None
+                })
+            results.append({
+                'name': name,
+                'weights': dict(zip(WEIGHT_KEYS, scenario_weights)),
+                'ranking': regions
+            })
+        return results
+
+    def _batched_scores(self, scenario, weights, multipliers):
+        """Scores and OPEX of one scenario under many weights/price multipliers"""
+        _, (avg, peak, load_factor), _, _ = scenario
+        n = len(weights) if weights is not None else len(multipliers)
+        scores = np.empty((n, len(self.table)))
+        opex = np.empty((n, len(self.table)))
+        for start in range(0, n, BATCH_CASES):
+            end = min(n, start + BATCH_CASES)
+            size = end - start
+            values = evaluate(
+                self.table, np.full(size, avg), np.full(size, peak), np.full(size, load_factor),
+                weights[start:end] if weights is not None else np.tile(scenario[2], (size, 1)),
+                multipliers[start:end] if multipliers is not None else None
+            )
+            scores[start:end] = values['score']
+            opex[start:end] = values['opex']
+        return scores, opex
+
+    def _rank_summary(self, scores):
+        rank = ranks(scores)
+        return {
+            'winRate': dict(zip(self.table.names, (rank == 1).mean(axis=0).round(4).tolist())),
+            'meanRank': dict(zip(self.table.names, rank.mean(axis=0).round(3).tolist()))
+        }
+
+    def _sweep(self, scenario, grid, include_points):
+        multiplier = np.full((len(grid), len(self.table)), scenario[3])
+        scores, _ = self._batched_scores(scenario, grid, multiplier)
+        summary = {'points': len(grid)}
+        summary.update(self._rank_summary(scores))
+        if include_points:
+            best = scores.argmax(axis=1)
+            summary['results'] = [
+                {'weights': dict(zip(WEIGHT_KEYS, row.tolist())),
+                 'best': self.table.names[b],
+                 'scores': scores[i].round(3).tolist()}
+                for i, (row, b) in enumerate(zip(grid, best))
+            ]
+        return summary
+
+    def _monte_carlo(self, scenario, samples, volatility, rng):
+        # Lognormal multipliers with mean 1, independent per region
+        sigma = np.sqrt(np.log1p(volatility ** 2))
+        multipliers = scenario[3] * rng.lognormal(-sigma ** 2 / 2, sigma, size=(samples, len(self.table)))
+        scores, opex = self._batched_scores(scenario, None, multipliers)
+        summary = {'samples': samples, 'priceVolatility': volatility}
+        summary.update(self._rank_summary(scores))
+        percentiles = (5, 50, 95)
+        score_pct = np.percentile(scores, percentiles, axis=0)
+        opex_pct = np.percentile(opex, percentiles, axis=0)
+        summary['score'] = {
+            name: {'mean': round(float(scores[:, r].mean()), 3),
+                   **{f'p{p}': round(float(score_pct[i, r]), 3) for i, p in enumerate(percentiles)}}
+            for r, name in enumerate(self.table.names)
+        }
+        summary['opex'] = {
+            name: {'mean': round(float(opex[:, r].mean()), 2),
+                   **{f'p{p}': round(float(opex_pct[i, r]), 2) for i, p in enumerate(percentiles)}}
+            for r, name in enumerate(self.table.names)
+        }
+        return summary
@@ -0,0 +1,369 @@
+"""
+Asynchronous analysis jobs.
+
+Large uploads and full-corpus clustering runs can take longer than an HTTP
+client is willing to wait. Submitted as jobs they return an id right away,
+a worker pool runs the analysis and /api/jobs/<id> reports its progress (the
+stage it is in, see profiling.stage) and, once finished, its result.
+
+Identical jobs (same key: same documents and parameters) are merged: a
+submission while one is queued, running or finished within the TTL gets that
+job back. At most max_pending jobs wait or run at a time; further submissions
+raise QueueFull (answered with 503 and Retry-After). Finished jobs are kept
+for result_ttl seconds.
+
+Jobs run in worker processes (the CPU-bound scikit-learn work of app.py) or
+threads; the pool is created on first use, so it is never inherited through a
+fork. With a directory every state change is also written to <id>.json, so
+every process serving that directory (the prefork workers of simple_server.py)
+can report any job, and finished results survive a restart.
+"""
+
+import functools
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from profiling import set_stage_listener
+
+JOB_OPTIONS = {
+    'workers': int(os.getenv('JOB_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    'max_pending': int(os.getenv('JOB_MAX_PENDING', '32')),
+    'result_ttl': float(os.getenv('JOB_RESULT_TTL', '3600')),
+    'directory': os.getenv('JOB_DIR', '.cache/jobs') or None
+}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+# Seconds between sweeps of expired job files
+SWEEP_INTERVAL = 60
+
+
+class QueueFull(Exception):
+    """Too many jobs pending"""
+
+
+class Job:
+    """One submitted job and its state"""
+
+    __slots__ = ('id', 'key', 'status', 'submitted_at', 'started_at', 'finished_at', 'expires_at',
+                 'stage', 'stages_started', 'submissions', 'result', 'error')
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.expires_at = None
+        self.stage = None
+        self.stages_started = 0
+        self.submissions = 1
+        self.result = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def as_dict(self):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'expires_at': self.expires_at,
+            'submissions': self.submissions,
+            'progress': {'stage': self.stage, 'stages_started': self.stages_started}
+        }
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+def wants_async(params, prefer=None):
+    """?async=1, or a Prefer: respond-async header (RFC 7240)"""
+    if params.get('async') in ('1', 'true'):
+        return True
+    return 'respond-async' in (prefer or '').lower()
+
+
+# Progress events of worker processes go to this queue (set by _init_worker)
+_worker_events = None
+
+
+def _init_worker(events):
+    global _worker_events
+    _worker_events = events
+
+
+def _report_to_parent(job_id, event, value=None):
+    _worker_events.put((job_id, event, value))
+
+
+def _run_job(job_id, function, args, report=None):
+    """Run one job in a worker, reporting when it starts and each stage it enters"""
+    if report is None:
+        report = functools.partial(_report_to_parent, job_id)
+    report('started')
+    set_stage_listener(lambda name: report('stage', name))
+    try:
+        return function(*args)
+    finally:
+        set_stage_listener(None)
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs run by a worker pool.
+
+    Args:
+        workers: Worker processes or threads
+        max_pending: Jobs queued or running at most
+        result_ttl: Seconds finished jobs are kept
+        processes: Run jobs in worker processes (functions and arguments
+            must be picklable) instead of threads
+        directory: Where job states are written, or None
+    """
+
+    def __init__(self, workers=2, max_pending=32, result_ttl=3600, processes=False, directory=None):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.processes = processes
+        self.directory = directory
+        self._jobs = {}
+        # Latest job of each key, for merging identical submissions
+        self._by_key = {}
+        self._pending = 0
+        self._executor = None
+        self._events = None
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.submitted = 0
+        self.merged = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, key, function, *args):
+        """
+        Run function(*args) as a job, unless an identical one (same key) is
+        pending or finished successfully within the TTL.
+
+        Returns:
+            (job dict, whether it was merged into an existing job)
+
+        Raises:
+            QueueFull: when max_pending jobs are already queued or running
+        """
+        with self._lock:
+            self._purge()
+            job = self._by_key.get(key)
+            if job is not None:
+                job.submissions += 1
+                self.merged += 1
+                return job.as_dict(), True
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self._pending} jobs pending; try again later")
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._pending += 1
+            self.submitted += 1
+            report = None if self.processes else functools.partial(self._event, job.id)
+            try:
+                future = self._get_executor().submit(_run_job, job.id, function, args, report)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool
+                self._executor = None
+                future = self._get_executor().submit(_run_job, job.id, function, args, report)
+            data = job.as_dict()
+            self._persist(data)
+        future.add_done_callback(functools.partial(self._finish, job))
+        return data, False
+
+    def get(self, job_id):
+        """State of a job as a dict (with its result once done), or None if unknown or expired"""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.as_dict()
+        return self._load(job_id)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                'workers': self.workers,
+                'processes': self.processes,
+                'max_pending': self.max_pending,
+                'result_ttl': self.result_ttl,
+                'queued': self._pending - running,
+                'running': running,
+                'kept': len(self._jobs),
+                'submitted': self.submitted,
+                'merged': self.merged,
+                'rejected': self.rejected,
+                'failed': self.failed
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            events, self._events = self._events, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if events is not None:
+            events.put(None)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.processes:
+                # spawn: worker processes must not inherit the locks held by
+                # the server's threads
+                context = multiprocessing.get_context('spawn')
+                if self._events is None:
+                    self._events = context.Queue()
+                    threading.Thread(target=self._drain_events, args=(self._events,),
+                                     name='job-events', daemon=True).start()
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=_init_worker,
+                    initargs=(self._events,)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+        return self._executor
+
+    def _drain_events(self, events):
+        while True:
+            item = events.get()
+            if item is None:
+                return
+            self._event(*item)
+
+    def _event(self, job_id, event, value=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # A late event of a job that already finished is dropped
+            if job is None or job.finished:
+                return
+            if event == 'started':
+                job.status = RUNNING
+                job.started_at = time.time()
+            elif event == 'stage':
+                job.stage = value
+                job.stages_started += 1
+            # Written under the lock so a late write never replaces a newer state
+            self._persist(job.as_dict())
+
+    def _finish(self, job, future):
+        try:
+            exception = future.exception()
+        except CancelledError as e:
+            exception = e
+        result = future.result() if exception is None else None
+        error = None if exception is None else str(exception) or type(exception).__name__
+        with self._lock:
+            job.finished_at = time.time()
+            job.expires_at = job.finished_at + self.result_ttl
+            job.result = result
+            job.error = error
+            job.status = DONE if error is None else FAILED
+            self._pending -= 1
+            if error is not None:
+                self.failed += 1
+                # Failed jobs are reported but not merged into
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+            if isinstance(exception, BrokenProcessPool) and self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self._persist(job.as_dict())
+
+    def _purge(self):
+        """Forget finished jobs past their TTL (called with the lock held)"""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.expires_at is not None and job.expires_at <= now]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            self._remove(job_id)
+        if self.directory and now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self._sweep(now)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _persist(self, data):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(data['id'])
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temporary, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Warning: could not write job {data['id']}: {e}")
+
+    def _load(self, job_id):
+        """A job written by another process (or before a restart), unless expired"""
+        if not self.directory or not JOB_ID.fullmatch(job_id):
+            return None
+        path = self._path(job_id)
+        try:
+            # Jobs whose file was not touched for a TTL are gone, even if
+            # their process died before finishing them
+            if os.path.getmtime(path) + self.result_ttl <= time.time():
+                self._remove(job_id)
+                return None
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('expires_at') is not None and data['expires_at'] <= time.time():
+            self._remove(job_id)
+            return None
+        return data
+
+    def _remove(self, job_id):
+        if self.directory:
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+
+    def _sweep(self, now):
+        """Delete job files untouched for a TTL"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.json') and os.path.getmtime(path) + self.result_ttl <= now:
+                    os.remove(path)
+            except OSError:
+                pass
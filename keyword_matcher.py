@@ -0,0 +1,89 @@
+"""
+Compiled multi-pattern matcher for the theme keyword table.
+
+RegulationThemeAnalyzer.extract_themes_simple classifies a document under a
+theme when any of the theme's keywords is a substring of the document's
+preprocessed words joined by spaces. Keywords never contain spaces, so a
+keyword can never straddle two words of the joined string, and the test is
+equivalent to "the keyword is a substring of at least one word".
+
+The matcher compiles the keyword table once into a token -> theme bitmask
+hash map. Each distinct token is resolved against all keywords only the first
+time it is seen; afterwards classifying a document is a single pass of
+dictionary lookups over its tokens, OR-ing the masks together. Keywords that
+do contain whitespace (none in the default table) are still checked against
+the joined string, so the original substring semantics are kept exactly.
+"""
+
+
+class ThemeKeywordMatcher:
+    """
+    Classify token lists against a theme keyword table.
+
+    Args:
+        theme_keywords: Mapping of theme key to (theme name, keywords), as in
+            RegulationThemeAnalyzer.theme_keywords
+        max_cached_tokens: Bound on the token -> mask map; it is cleared when
+            it grows past this size
+    """
+
+    def __init__(self, theme_keywords, max_cached_tokens=200000):
+        self.theme_keys = list(theme_keywords)
+        self.max_cached_tokens = max_cached_tokens
+
+        # keyword -> mask of the themes listing it
+        word_keywords = {}
+        phrase_keywords = {}
+        always_mask = 0
+
+        for index, theme_key in enumerate(self.theme_keys):
+            bit = 1 << index
+            for keyword in theme_keywords[theme_key][1]:
+                if not keyword:
+                    # '' is a substring of every string, even an empty one
+                    always_mask |= bit
+                elif any(ch.isspace() for ch in keyword):
+                    phrase_keywords[keyword] = phrase_keywords.get(keyword, 0) | bit
+                else:
+                    word_keywords[keyword] = word_keywords.get(keyword, 0) | bit
+
+        self._word_keywords = tuple(word_keywords.items())
+        self._phrase_keywords = tuple(phrase_keywords.items())
+        self._always_mask = always_mask
+        self._token_masks = {}
+
+    def token_mask(self, token):
+        """Bitmask of the themes with a keyword contained in token"""
+        mask = self._token_masks.get(token)
+        if mask is None:
+            mask = 0
+            for keyword, bit in self._word_keywords:
+                if keyword in token:
+                    mask |= bit
+            if len(self._token_masks) >= self.max_cached_tokens:
+                self._token_masks.clear()
+            self._token_masks[token] = mask
+        return mask
+
+    def match_mask(self, words):
+        """Bitmask of the themes matched by a preprocessed word list"""
+        mask = self._always_mask
+        token_masks = self._token_masks
+        for word in words:
+            word_mask = token_masks.get(word)
+            if word_mask is None:
+                word_mask = self.token_mask(word)
+            mask |= word_mask
+
+        if self._phrase_keywords:
+            text = ' '.join(words)
+            for keyword, bit in self._phrase_keywords:
+                if keyword in text:
+                    mask |= bit
+
+        return mask
+
+    def match(self, words):
+        """Theme keys matched by a preprocessed word list, in table order"""
+        mask = self.match_mask(words)
+        return [key for index, key in enumerate(self.theme_keys) if mask >> index & 1]
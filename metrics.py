@@ -0,0 +1,359 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and fixed-bucket histograms are plain Python objects guarded
+by one lock each; recording a value costs a dict lookup and, for histograms, a
+bisect, so instrumentation stays on in production. Values that already live
+elsewhere (cache statistics, corpus size, memory) are not copied on every
+change: collectors registered with add_collector() read them when /metrics is
+scraped.
+
+Every metric is per process. In prefork mode each worker keeps its own
+registry, so a scrape reports the worker that happened to answer it.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFIX = 'theme_navigator_'
+
+# Seconds; covers cached responses (sub-millisecond) up to cold analyses
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PROCESS_STARTED = time.time()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types: a name, a help text and labelled values"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets.
+
+    Args:
+        buckets: Increasing upper bounds; +Inf is implied
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self, **labels):
+        """(sum, count) of one label set"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[1], state[2]) if state else (0.0, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total, count))
+                           for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, help_text, labelnames=(), **kwargs):
+        name = PREFIX + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def add_collector(self, collect):
+        """
+        Register a callable read on every scrape.
+
+        It returns an iterable of (name, kind, help, samples), samples being a
+        list of (labels dict, value); a failing collector is skipped.
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            try:
+                families = list(collect())
+            except Exception:
+                continue
+            for name, kind, help_text, samples in families:
+                name = PREFIX + name
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def max_rss_bytes():
+    """Peak resident memory of this process (high-water mark), or None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def rss_bytes():
+    """Current resident memory from /proc (Linux), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def process_metrics():
+    """Collector for uptime and memory"""
+    current = rss_bytes()
+    peak = max_rss_bytes()
+    if current is not None and peak is not None:
+        # getrusage and /proc round differently; the peak is never below the current value
+        peak = max(peak, current)
+    return [
+        ('process_uptime_seconds', 'gauge', 'Seconds since the process started',
+         [({}, round(time.time() - PROCESS_STARTED, 3))]),
+        ('process_resident_memory_bytes', 'gauge', 'Resident memory',
+         [({}, current)]),
+        ('process_max_resident_memory_bytes', 'gauge', 'Peak resident memory (high-water mark)',
+         [({}, peak)])
+    ]
+
+
+def cache_metrics(name, stats):
+    """
+    Collector families of a cache from its stats() dict (hits, misses and,
+    when present, entries, bytes, evictions and cached_documents)
+
+    Args:
+        name: Metric name prefix, e.g. 'result_cache'
+    """
+    label = name.replace('_', ' ')
+    families = [
+        (f'{name}_hits_total', 'counter', f'Lookups answered by the {label}', [({}, stats['hits'])]),
+        (f'{name}_misses_total', 'counter', f'Lookups missing the {label}', [({}, stats['misses'])]),
+        (f'{name}_hit_ratio', 'gauge', f'Hits over lookups of the {label} since start',
+         [({}, stats.get('hit_rate'))])
+    ]
+    for field, kind in (('entries', 'gauge'), ('bytes', 'gauge'), ('evictions', 'counter'),
+                        ('cached_documents', 'gauge')):
+        if field in stats:
+            metric = f'{name}_{field}_total' if kind == 'counter' else f'{name}_{field}'
+            families.append((metric, kind, f"{field.replace('_', ' ').capitalize()} of the {label}",
+                             [({}, stats[field])]))
+    return families
+
+
+def job_metrics(stats):
+    """Collector families of a jobs.JobQueue from its stats() dict"""
+    return [
+        ('jobs_queued', 'gauge', 'Jobs waiting for a worker', [({}, stats['queued'])]),
+        ('jobs_running', 'gauge', 'Jobs being run', [({}, stats['running'])]),
+        ('jobs_submitted_total', 'counter', 'Jobs submitted', [({}, stats['submitted'])]),
+        ('jobs_merged_total', 'counter', 'Submissions merged into an identical job',
+         [({}, stats['merged'])]),
+        ('jobs_rejected_total', 'counter', 'Submissions rejected because the queue was full',
+         [({}, stats['rejected'])]),
+        ('jobs_failed_total', 'counter', 'Jobs that raised an error', [({}, stats['failed'])])
+    ]
+
+
+# Character count of the last corpus version seen by corpus_metrics()
+_corpus_characters = {}
+
+
+def corpus_metrics(documents, version, source=None, age_seconds=None):
+    """Collector families describing the served corpus (its size in characters is computed once per version)"""
+    characters = _corpus_characters.get(version)
+    if characters is None:
+        # A corpus store knows its size without decoding every text
+        characters = getattr(documents, 'characters', None)
+        if characters is None:
+            characters = sum(map(len, documents))
+        _corpus_characters.clear()
+        _corpus_characters[version] = characters
+    info = {'version': version}
+    if source is not None:
+        info['source'] = source
+    families = [
+        ('corpus_info', 'gauge', 'Version (and source) of the served corpus', [(info, 1)]),
+        ('corpus_documents', 'gauge', 'Documents (chunks) in the served corpus', [({}, len(documents))]),
+        ('corpus_characters', 'gauge', 'Characters in the served corpus', [({}, characters)])
+    ]
+    if age_seconds is not None:
+        families.append(('corpus_snapshot_age_seconds', 'gauge', 'Seconds since the corpus snapshot was loaded',
+                         [({}, round(age_seconds, 3))]))
+    return families
+
+
+def route_label(path, routes):
+    """
+    Bounded route label of a request path.
+
+    Args:
+        routes: Exact paths, or prefixes ending in '/' (other than '/' itself)
+            mapped to '<prefix><name>'
+    """
+    if path in routes:
+        return path
+    for route in routes:
+        if len(route) > 1 and route.endswith('/') and path.startswith(route):
+            return route + '<name>'
+    return 'other'
+
+
+# Process-wide registry and the metrics shared by both servers
+REGISTRY = MetricsRegistry()
+REGISTRY.add_collector(process_metrics)
+
+REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests answered',
+                            ('method', 'route', 'status'))
+IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests being answered')
+REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds',
+                                     'Time spent answering HTTP requests', ('method', 'route'))
+STAGE_SECONDS = REGISTRY.histogram('stage_duration_seconds',
+                                   'Time spent in each processing stage', ('stage',))
+
+
+def observe_request(method, route, status, seconds):
+    REQUESTS.inc(method=method, route=route, status=status)
+    REQUEST_SECONDS.observe(seconds, method=method, route=route)
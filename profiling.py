@@ -0,0 +1,191 @@
+"""
+Lightweight timing helpers: processing stages, per-request profiles and a
+startup profiler.
+
+stage() times one named stage (fetch, preprocess, dedup, classify, cluster,
+serialize...): the duration goes to the stage histogram of metrics.py and,
+when the current thread is serving a request with ?profile=1, to that
+request's RequestProfile. StageTimings collects the same durations per
+analysis run. A thread running a background job can also register a stage
+listener, told the name of every stage it enters (see jobs.py).
+
+StartupProfiler is meant to be created at the very top of a server module,
+before its heavy imports, so `--profile-startup` can report how long each
+top-level import and each startup phase took.
+"""
+
+import builtins
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_active = threading.local()
+
+
+class RequestProfile:
+    """Stages run while serving one request, in the order they finished"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.depth = 0
+
+    def as_dict(self):
+        """
+        Stage breakdown: nested stages (depth > 0) are included in the
+        duration of their enclosing stage
+        """
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages': [{'stage': name, 'ms': round(seconds * 1000, 3), 'depth': depth}
+                       for name, seconds, depth in self.stages]
+        }
+
+    def server_timing(self):
+        """Server-Timing header value (durations of top-level stages, in ms)"""
+        totals = {}
+        for name, seconds, depth in self.stages:
+            if depth == 0:
+                totals[name] = totals.get(name, 0.0) + seconds
+        return ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items())
+
+
+def start_request_profile():
+    """Profile the stages run by the current thread until stop_request_profile()"""
+    _active.profile = RequestProfile()
+    return _active.profile
+
+
+def stop_request_profile():
+    profile = getattr(_active, 'profile', None)
+    _active.profile = None
+    return profile
+
+
+def current_request_profile():
+    return getattr(_active, 'profile', None)
+
+
+def set_stage_listener(listener):
+    """Call listener(stage name) whenever the current thread enters a stage (None removes it)"""
+    _active.listener = listener
+
+
+@contextmanager
+def stage(name):
+    """Time a processing stage (see the module docstring)"""
+    listener = getattr(_active, 'listener', None)
+    if listener is not None:
+        listener(name)
+    profile = getattr(_active, 'profile', None)
+    if profile is not None:
+        depth = profile.depth
+        profile.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage=name)
+        if profile is not None:
+            profile.depth = depth
+            profile.stages.append((name, seconds, depth))
+
+
+class StageTimings:
+    """Wall-clock duration of each named stage of an analysis run"""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            with stage(name):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def as_dict(self):
+        return {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+    def log(self, label):
+        summary = ', '.join(f"{name}={seconds:.3f}s" for name, seconds in self.stages.items())
+        logger.info(f"{label} timings: {summary}")
+
+
+class StartupProfiler:
+    """
+    Record import times and startup phases.
+
+    Args:
+        enabled: When False every method is a no-op
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.phases = []
+        self.imports = {}
+        self._local = threading.local()
+        self._original_import = None
+        if enabled:
+            self._install_import_timer()
+
+    def _install_import_timer(self):
+        original_import = builtins.__import__
+        self._original_import = original_import
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level or name in sys.modules:
+                return original_import(name, globals, locals, fromlist, level)
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            started = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                self._local.depth = depth
+                # Only outermost imports are reported; their time includes
+                # everything they import in turn
+                if depth == 0:
+                    top_level = name.partition('.')[0]
+                    self.imports[top_level] = self.imports.get(top_level, 0.0) + time.perf_counter() - started
+
+        builtins.__import__ = timed_import
+
+    def mark(self, phase):
+        """Record the time since the previous mark under the given phase name"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last_mark, now - self.started))
+        self.last_mark = now
+
+    def stop_import_timer(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def report(self, top=15):
+        """Print the startup report to stdout"""
+        if not self.enabled:
+            return
+        self.stop_import_timer()
+        print("Startup profile")
+        print(f"  {'phase':<32} {'duration':>10} {'elapsed':>10}")
+        for phase, duration, elapsed in self.phases:
+            print(f"  {phase:<32} {duration * 1000:>8.1f}ms {elapsed * 1000:>8.1f}ms")
+        if self.imports:
+            print(f"  {'import':<32} {'duration':>10}")
+            for name, seconds in sorted(self.imports.items(), key=lambda x: x[1], reverse=True)[:top]:
+                print(f"  {name:<32} {seconds * 1000:>8.1f}ms")
+        sys.stdout.flush()
@@ -0,0 +1,152 @@
+"""
+Theme analysis scoped to a query (/api/themes?q=...).
+
+Instead of analysing the whole corpus, the documents matching the query are
+picked from the BM25 search index (the best `max_documents` of them) and
+only that subset goes through deduplication and theme extraction. A query is
+normalized to its sorted, distinct tokens -- the index ranks by terms, so
+"Geração distribuída" and "distribuída, geração" select the same documents
+-- and its analysis is cached in the result cache per normalized query and
+corpus version.
+
+Every query is counted; when a new corpus version is indexed, the most
+popular ones are analysed again in a background thread, so analysts asking
+for them after a refresh hit a warm cache.
+"""
+
+import os
+import threading
+from collections import Counter
+
+from profiling import stage
+
+QUERY_OPTIONS = {
+    'max_documents': int(os.getenv('THEME_QUERY_MAX_DOCUMENTS', '2000')),
+    'precompute': int(os.getenv('THEME_QUERY_PRECOMPUTE', '20'))
+}
+
+# Distinct queries counted at most; the least popular half is dropped beyond that
+MAX_TRACKED_QUERIES = 1000
+
+
+def normalize_query(query, tokenize):
+    """Sorted distinct tokens of a query, as one string ('' when none is left)"""
+    return ' '.join(sorted(set(tokenize(query))))
+
+
+class QueryThemes:
+    """
+    Query-scoped theme analyses, cached and precomputed.
+
+    Args:
+        search_index: search_index.InvertedIndex kept in step with the corpus
+            by its owner
+        analyze: Callable(documents, chunks, ids, n_clusters) -> analysis dict
+            with 'themes', 'by_name' and 'unique_documents', where ids are
+            the corpus ids of the documents
+        result_cache: ResultCache the analyses are kept in
+        tokenize: The analyzer's tokenizer, used to normalize queries
+        method: Analysis label in the cache keys (e.g. 'keywords')
+        max_documents: Best-ranked matches analysed at most
+        precompute: Popular queries analysed again for every new corpus
+            version (0 disables precomputing)
+    """
+
+    def __init__(self, search_index, analyze, result_cache, tokenize, method='keywords',
+                 max_documents=2000, precompute=20):
+        self.search_index = search_index
+        self.analyze = analyze
+        self.result_cache = result_cache
+        self.tokenize = tokenize
+        self.method = method
+        self.max_documents = max_documents
+        self.precompute_count = precompute
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._precomputing = None
+        self.precomputed = 0
+
+    def analysis(self, query, n_clusters=8, record=True):
+        """
+        Themes of the documents matching a query, over the corpus version
+        currently indexed.
+
+        Returns:
+            Analysis dict, plus 'query' (normalized), 'corpus_version',
+            'matched_documents' and 'analysed_documents'
+
+        Raises:
+            ValueError: when the query has no searchable term
+        """
+        normalized = normalize_query(query, self.tokenize)
+        if not normalized:
+            raise ValueError("Query has no searchable terms")
+        if record:
+            self._record(normalized, n_clusters)
+
+        def compute():
+            with stage('search'):
+                version, documents, positions, total = self.search_index.match(
+                    normalized, self.max_documents
+                )
+            texts = [document if isinstance(document, str) else document.text for document in documents]
+            chunks = None if not documents or isinstance(documents[0], str) else documents
+            analysis = self.analyze(texts, chunks, positions, n_clusters)
+            # The version actually searched: a sync may land between the lookup and the search
+            return dict(analysis, query=normalized, corpus_version=version,
+                        matched_documents=total, analysed_documents=len(documents))
+
+        key = (self.search_index.version, 'query', self.method, normalized, n_clusters,
+               self.max_documents)
+        return self.result_cache.get_or_compute(key, compute)
+
+    def popular(self, n):
+        """The n most requested (normalized query, n_clusters) pairs"""
+        with self._lock:
+            return [entry for entry, _ in self._counts.most_common(n)]
+
+    def precompute(self):
+        """
+        Analyse the popular queries for the corpus version currently indexed,
+        in a background thread (a run already going picks up a newer version
+        when it is done)
+        """
+        if self.precompute_count <= 0:
+            return None
+        with self._lock:
+            if self._precomputing is not None and self._precomputing.is_alive():
+                return None
+            self._precomputing = threading.Thread(target=self._precompute, name='query-precompute',
+                                                  daemon=True)
+            self._precomputing.start()
+            return self._precomputing
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_queries': len(self._counts),
+                'max_documents': self.max_documents,
+                'precompute': self.precompute_count,
+                'precomputed': self.precomputed,
+                'precomputing': self._precomputing is not None and self._precomputing.is_alive()
+            }
+
+    def _record(self, normalized, n_clusters):
+        with self._lock:
+            self._counts[(normalized, n_clusters)] += 1
+            if len(self._counts) > MAX_TRACKED_QUERIES:
+                self._counts = Counter(dict(self._counts.most_common(MAX_TRACKED_QUERIES // 2)))
+
+    def _precompute(self):
+        version = None
+        # Go again when a newer corpus was indexed during the run
+        while version != self.search_index.version:
+            version = self.search_index.version
+            for query, n_clusters in self.popular(self.precompute_count):
+                try:
+                    self.analysis(query, n_clusters, record=False)
+                except Exception as e:
+                    print(f"Error precomputing themes for query {query!r}: {e}")
+                    continue
+                with self._lock:
+                    self.precomputed += 1
@@ -0,0 +1,153 @@
+"""
+Memoization of theme analysis results.
+
+Results are keyed by the corpus fingerprint (see
+document_repository.corpus_fingerprint) plus the analysis parameters, so a
+result computed for one version of the corpus is never served for another.
+Entries are evicted least-recently-used first, both by count and by an
+approximate memory budget. When the document repository installs a new
+snapshot the entries of older versions are dropped eagerly.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def estimate_size(obj, _seen=None):
+    """
+    Approximate the memory held by a JSON-like structure, in bytes.
+
+    Shared sub-objects (e.g. the same document string in several themes) are
+    only counted once.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    return size
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with an entry limit and a memory cap.
+
+    Keys are tuples whose first element is the corpus version. Cached values
+    are shared between requests and must be treated as read-only.
+
+    Args:
+        max_entries: Maximum number of cached results
+        max_bytes: Approximate memory budget for all cached results
+    """
+
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """Store a result; values larger than the whole budget are not cached"""
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached result for key, computing it at most once.
+
+        Concurrent callers asking for the same missing key wait for the first
+        caller's computation instead of repeating it.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+            try:
+                value = compute()
+                self.put(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    def invalidate(self, keep_version=None):
+        """
+        Drop cached results.
+
+        Args:
+            keep_version: Keep entries computed for this corpus version and
+                drop all others; None drops everything
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if keep_version is None or key[0] != keep_version:
+                    self.total_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions
+            }
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self.total_bytes > self.max_bytes):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
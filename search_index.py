@@ -0,0 +1,358 @@
+"""
+In-memory inverted index with BM25 ranking over the regulation corpus.
+
+Documents are tokenized with the analyzer's preprocessing pipeline (the same
+token stream theme analysis uses), and every term keeps its postings in two
+typed arrays -- document ids and term frequencies -- instead of lists of
+Python objects, about 6 bytes per posting.
+
+The index follows the document repository incrementally: sync() diffs the new
+corpus against the indexed one, appends new documents and tombstones removed
+ones; postings are only rebuilt when tombstones make up half of the index.
+A corpus store (see corpus_store.py) is indexed as a whole from its stored
+tokens, and its documents are referenced instead of copied.
+
+Scoring is vectorized with NumPy when it is installed (a gather per query
+term, a bincount to merge terms and a partial sort for the top results) and
+falls back to a pure Python loop otherwise.
+"""
+
+import heapq
+import importlib.util
+import math
+import threading
+from array import array
+
+from text_preprocessing import content_key
+
+# NumPy is optional and imported on the first query, to keep startup fast
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+
+# Term frequencies are stored as unsigned 16-bit integers
+MAX_TERM_FREQUENCY = 0xFFFF
+
+# Attributes swapped in at once when the index is rebuilt
+STATE_ATTRIBUTES = ('_documents', '_keys', '_ids_by_key', '_positions', '_lengths', '_alive',
+                    '_postings', '_df', '_live', '_total_length')
+
+
+def document_text(document):
+    """Text of a plain string document or of a chunk"""
+    return document if isinstance(document, str) else document.text
+
+
+def search_hit(score, document):
+    """JSON-ready search result; chunks also report their source location"""
+    hit = {'score': round(score, 4), 'text': document_text(document)}
+    if not isinstance(document, str):
+        hit['file_id'] = document.file_id
+        hit.update(document.location())
+    return hit
+
+
+def document_keys(documents):
+    """
+    Stable identity of each document, used to diff two versions of a corpus.
+
+    Chunks are identified by file id, position and content; plain texts by
+    content and occurrence number (so duplicated texts stay distinct).
+    Views of a corpus store read their stored digests.
+    """
+    stored = getattr(documents, 'document_keys', None)
+    if stored is not None:
+        return stored()
+    keys = []
+    occurrences = {}
+    for document in documents:
+        if isinstance(document, str):
+            digest = content_key(document)
+            n = occurrences.get(digest, 0)
+            occurrences[digest] = n + 1
+            keys.append((digest, n))
+        else:
+            keys.append((document.file_id, document.index, content_key(document.text)))
+    return keys
+
+
+class InvertedIndex:
+    """
+    BM25-ranked inverted index, updated incrementally.
+
+    Args:
+        tokenize_many: Callable(list of texts) -> iterable of token sequences
+        tokenize: Callable(text) -> token sequence, used for queries
+        k1: BM25 term frequency saturation
+        b: BM25 length normalization
+    """
+
+    def __init__(self, tokenize_many, tokenize, k1=1.5, b=0.75):
+        self.tokenize_many = tokenize_many
+        self.tokenize = tokenize
+        self.k1 = k1
+        self.b = b
+        self.version = None
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._documents = []           # doc id -> document (None once removed)
+        self._keys = []                # doc id -> key
+        self._ids_by_key = {}
+        self._positions = None         # doc id -> corpus position (None: the same)
+        self._lengths = array('I')     # doc id -> number of tokens
+        self._alive = bytearray()      # doc id -> 1 while the document is indexed
+        self._postings = {}            # term -> (array('I') doc ids, array('H') frequencies)
+        self._df = {}                  # term -> live document frequency
+        self._live = 0
+        self._total_length = 0
+
+    def __len__(self):
+        return self._live
+
+    def sync(self, documents, version=None):
+        """
+        Bring the index in line with a corpus.
+
+        Tokenizing happens outside the search lock, so queries keep being
+        answered from the previous state while a new corpus is indexed.
+
+        Args:
+            documents: Document texts or chunks, in corpus order
+            version: Corpus version; nothing is done when it is already indexed
+
+        Returns:
+            (added, removed) document counts
+        """
+        with self._sync_lock:
+            if version is not None and version == self.version:
+                return 0, 0
+
+            if getattr(documents, 'store', None) is not None:
+                # Reindexed from its stored tokens rather than diffed, so no
+                # per-document keys are kept
+                fresh = InvertedIndex(self.tokenize_many, self.tokenize, self.k1, self.b)
+                fresh._add_stored(documents)
+                removed = self._live
+                self._install(fresh, version)
+                return len(documents), removed
+
+            documents = list(documents)
+            keys = document_keys(documents)
+            wanted = set(keys)
+            # Only syncs mutate the index and they are serialized, so reading
+            # it here without the search lock is safe
+            removed = [doc_id for key, doc_id in self._ids_by_key.items() if key not in wanted]
+            added = [(key, document) for key, document in zip(keys, documents)
+                     if key not in self._ids_by_key]
+
+            if (self._keys is None or len(removed) * 2 > self._live
+                    or self._tombstones() + len(removed) > self._live):
+                # Cheaper (and more compact) to start over; an index of a
+                # stored corpus keeps no keys and is always replaced
+                removed = self._live if self._keys is None else len(removed)
+                fresh = InvertedIndex(self.tokenize_many, self.tokenize, self.k1, self.b)
+                fresh._add(zip(keys, documents), self._tokens(documents))
+                self._install(fresh, version)
+                return len(documents), removed
+
+            removed_tokens = self._tokens(self._documents[doc_id] for doc_id in removed)
+            added_tokens = self._tokens(document for _, document in added)
+            with self._lock:
+                self._remove(removed, removed_tokens)
+                self._add(added, added_tokens)
+                positions = array('I', bytes(len(self._documents) * 4))
+                for position, key in enumerate(keys):
+                    positions[self._ids_by_key[key]] = position
+                self._positions = positions
+                self.version = version
+            return len(added), len(removed)
+
+    def _install(self, fresh, version):
+        with self._lock:
+            for name in STATE_ATTRIBUTES:
+                setattr(self, name, getattr(fresh, name))
+            self.version = version
+
+    def _tokens(self, documents):
+        return list(self.tokenize_many([document_text(document) for document in documents]))
+
+    def _tombstones(self):
+        return len(self._documents) - self._live
+
+    def _add(self, keyed_documents, token_lists):
+        for (key, document), tokens in zip(keyed_documents, token_lists):
+            doc_id = len(self._documents)
+            self._documents.append(document)
+            self._keys.append(key)
+            self._ids_by_key[key] = doc_id
+            self._post(doc_id, tokens)
+
+    def _add_stored(self, documents):
+        """Index a view of a corpus store: doc ids are its positions, and no keys are kept"""
+        self._documents = documents
+        self._keys = None
+        for doc_id, tokens in enumerate(self.tokenize_many(documents)):
+            self._post(doc_id, tokens)
+
+    def _post(self, doc_id, tokens):
+        self._lengths.append(len(tokens))
+        self._alive.append(1)
+        self._live += 1
+        self._total_length += len(tokens)
+
+        postings = self._postings
+        df = self._df
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, frequency in frequencies.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = (array('I'), array('H'))
+            entry[0].append(doc_id)
+            entry[1].append(min(frequency, MAX_TERM_FREQUENCY))
+            df[term] = df.get(term, 0) + 1
+
+    def _remove(self, doc_ids, token_lists):
+        for doc_id, tokens in zip(doc_ids, token_lists):
+            for term in set(tokens):
+                self._df[term] -= 1
+            del self._ids_by_key[self._keys[doc_id]]
+            self._documents[doc_id] = None
+            self._alive[doc_id] = 0
+            self._live -= 1
+            self._total_length -= self._lengths[doc_id]
+
+    def doc_ids(self, texts):
+        """
+        Ids of the indexed documents whose text is in texts.
+
+        Used to restrict a search to e.g. the members of one theme; the ids
+        stay valid until the index is rebuilt (see version).
+        """
+        texts = texts if isinstance(texts, (set, frozenset)) else set(texts)
+        with self._lock:
+            return array('I', (
+                doc_id for doc_id, document in enumerate(self._documents)
+                if document is not None and document_text(document) in texts
+            ))
+
+    def search(self, query, limit=10, within=None):
+        """
+        Rank documents against a free-text query.
+
+        Args:
+            query: Query text, tokenized like the documents
+            limit: Maximum number of results
+            within: Optional doc ids (see doc_ids) the results are restricted to
+
+        Returns:
+            (results, total): up to limit (score, document) pairs, best first,
+            and the number of documents matching any query term
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        with self._lock:
+            ranked, total = self._rank(terms, limit, within)
+            return [(score, self._documents[doc_id]) for score, doc_id in ranked], total
+
+    def match(self, query, limit):
+        """
+        The best-ranked documents of a query, for analysing that subset of
+        the corpus (see query_themes.py).
+
+        Returns:
+            (version, documents, positions, total): the indexed corpus
+            version, up to limit documents in corpus order, their positions
+            in that corpus and the number of documents matching any term
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        with self._lock:
+            ranked, total = self._rank(terms, limit, None)
+            positions = self._positions
+            matched = sorted((doc_id if positions is None else positions[doc_id], doc_id)
+                             for _, doc_id in ranked)
+            return (self.version, [self._documents[doc_id] for _, doc_id in matched],
+                    [position for position, _ in matched], total)
+
+    def _rank(self, terms, limit, within):
+        """(score, doc id) of the best documents and the match count (called with the lock held)"""
+        if not terms or not self._live:
+            return [], 0
+        n_docs = self._live
+        avg_length = self._total_length / n_docs
+        weighted = []
+        for term in terms:
+            entry = self._postings.get(term)
+            df = self._df.get(term, 0)
+            if entry is not None and df > 0:
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                weighted.append((idf, entry))
+        if not weighted:
+            return [], 0
+
+        if NUMPY_AVAILABLE:
+            return self._rank_numpy(weighted, avg_length, limit, within)
+        return self._rank_python(weighted, avg_length, limit, within)
+
+    def _rank_numpy(self, weighted, avg_length, limit, within):
+        import numpy as np
+
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        norms = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+        all_ids = []
+        all_scores = []
+        for idf, (ids, frequencies) in weighted:
+            ids = np.frombuffer(ids, dtype=np.uint32)
+            tf = np.frombuffer(frequencies, dtype=np.uint16).astype(np.float64)
+            all_ids.append(ids)
+            all_scores.append(idf * tf * (self.k1 + 1) / (tf + norms[ids]))
+
+        if len(all_ids) == 1:
+            doc_ids, scores = all_ids[0], all_scores[0]
+        else:
+            doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        keep = np.frombuffer(self._alive, dtype=bool) if self._tombstones() else None
+        if within is not None:
+            allowed = np.zeros(len(self._documents), dtype=bool)
+            allowed[np.frombuffer(within, dtype=np.uint32)] = True
+            keep = allowed if keep is None else keep & allowed
+        if keep is not None:
+            mask = keep[doc_ids]
+            doc_ids, scores = doc_ids[mask], scores[mask]
+
+        total = len(doc_ids)
+        if total > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(total)
+        # Best score first, lower doc id first among equal scores
+        top = top[np.lexsort((doc_ids[top], -scores[top]))]
+        return [(float(scores[i]), int(doc_ids[i])) for i in top], total
+
+    def _rank_python(self, weighted, avg_length, limit, within):
+        k1, b = self.k1, self.b
+        lengths = self._lengths
+        scores = {}
+        for idf, (ids, frequencies) in weighted:
+            for doc_id, tf in zip(ids, frequencies):
+                norm = k1 * (1 - b + b * lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        allowed = set(within) if within is not None else None
+        candidates = [(score, doc_id) for doc_id, score in scores.items()
+                      if self._alive[doc_id] and (allowed is None or doc_id in allowed)]
+        top = heapq.nsmallest(limit, candidates, key=lambda x: (-x[0], x[1]))
+        return top, len(candidates)
+
+    def stats(self):
+        with self._lock:
+            n_postings = sum(len(ids) for ids, _ in self._postings.values())
+            return {
+                'documents': self._live,
+                'tombstones': self._tombstones(),
+                'terms': len(self._postings),
+                'postings': n_postings,
+                'postings_bytes': n_postings * 6,
+                'version': self.version
+            }
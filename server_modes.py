@@ -0,0 +1,224 @@
+"""
+Serving modes for the Theme Navigator HTTP server.
+
+Three modes are available, all built on the standard library:
+
+- single: one request at a time (the original behaviour)
+- threaded: a fixed pool of worker threads fed by a bounded connection queue;
+  when the queue is full new connections get an immediate 503 instead of
+  piling up
+- prefork: the listening socket and the loaded corpus are created once in the
+  parent, then N worker processes are forked and each serves connections from
+  the shared socket with its own thread pool. The corpus pages are shared
+  copy-on-write, so it is effectively read-only shared memory.
+
+All modes shut down gracefully on SIGINT/SIGTERM: the listener stops
+accepting, in-flight and queued requests are finished, then the process exits.
+"""
+
+import http.server
+import os
+import queue
+import signal
+import threading
+
+
+SERVING_MODES = ('single', 'threaded', 'prefork')
+
+OVERLOADED_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: text/plain; charset=utf-8\r\n'
+    b'Content-Length: 19\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+    b'Server overloaded\r\n'
+)
+
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """
+    HTTP server handing connections to a bounded pool of worker threads.
+
+    Args:
+        server_address: (host, port) to bind
+        handler_class: Request handler class
+        workers: Number of worker threads
+        queue_size: Maximum number of accepted connections waiting for a worker
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64,
+                 bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self.rejected_connections = 0
+
+    def start_workers(self):
+        """Start the worker threads (done lazily so forked children own theirs)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'http-worker-{i}',
+                                      daemon=self.daemon_threads)
+            thread.start()
+            self._threads.append(thread)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.start_workers()
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected_connections += 1
+            try:
+                request.sendall(OVERLOADED_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        """Stop listening, then let the workers drain the queue and exit"""
+        super().server_close()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def create_server(mode, host, port, handler_class, workers=16, queue_size=64):
+    """
+    Create (and bind) the HTTP server for the given serving mode.
+
+    In prefork mode the returned server is the shared listener; call
+    serve_prefork() to fork the worker processes.
+    """
+    if mode not in SERVING_MODES:
+        raise ValueError(f"Unknown serving mode: {mode}")
+
+    if mode == 'single':
+        return http.server.HTTPServer((host, port), handler_class)
+
+    # Each forked process gets its own pool; size it per process
+    return ThreadPoolHTTPServer((host, port), handler_class,
+                                workers=workers, queue_size=queue_size)
+
+
+def install_shutdown_handlers(server):
+    """Shut the server down gracefully on SIGINT/SIGTERM"""
+    def handle_signal(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it must not run
+        # on the thread that is inside serve_forever()
+        threading.Thread(target=server.shutdown, name='http-shutdown', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+
+def serve(server):
+    """Serve until a shutdown signal arrives, then drain and close"""
+    install_shutdown_handlers(server)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def serve_prefork(server, processes, after_fork=None, in_parent=None):
+    """
+    Fork worker processes that all accept connections on the shared socket.
+
+    Everything loaded before this call (notably the document corpus) is shared
+    copy-on-write with the children. The parent does not serve requests; it
+    forwards SIGINT/SIGTERM to the children and waits for them to exit.
+
+    Args:
+        server: Bound server returned by create_server()
+        processes: Number of worker processes
+        after_fork: Optional callable run in each child before serving
+        in_parent: Optional callable run in the parent once every child is
+            forked (e.g. to start work only the parent does)
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("prefork mode requires os.fork (not available on this platform)")
+
+    children = []
+    for _ in range(max(1, processes)):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                if after_fork is not None:
+                    after_fork()
+                serve(server)
+            except Exception as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        children.append(pid)
+
+    # The parent does not accept connections itself
+    server.socket.close()
+    if in_parent is not None:
+        in_parent()
+
+    def forward_signal(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+
+
+def enable_keepalive(handler_class, timeout):
+    """
+    Turn on HTTP/1.1 persistent connections for a handler class.
+
+    Idle connections are closed after `timeout` seconds so they do not hold a
+    worker forever. Every response must carry a Content-Length.
+
+    Headers and body are written separately, so Nagle's algorithm is turned
+    off: on a reused connection the body would otherwise wait for the
+    client's delayed ACK of the headers (about 40 ms per response).
+    """
+    handler_class.protocol_version = 'HTTP/1.1'
+    handler_class.timeout = timeout
+    handler_class.disable_nagle_algorithm = True
+
+
+def display_host(host):
+    """Host name to show in log messages"""
+    return 'localhost' if host in ('', '0.0.0.0', '::') else host
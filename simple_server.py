@@ -5,23 +5,63 @@ This provides a basic theme analysis and visualization tool for Brazilian electr
 Now integrated with OpenAI Vector Store for dynamic document retrieval.
 """
 
+import sys
+
+# Created before the other imports so --profile-startup can time them
+from profiling import StartupProfiler
+startup_profiler = StartupProfiler(enabled='--profile-startup' in sys.argv[1:])
+
+import argparse
 import http.server
-import socketserver
 import json
-import re
 import os
+import signal
+import threading
+import time
 import urllib.parse
 from collections import Counter
 import random
 import math
 
-# OpenAI integration imports (optional - falls back to sample data if not available)
+from api_format import (
+    accepted_encodings, choose_encoding, document_page, encode_body, is_document_list, parse_ids,
+    parse_n_clusters, parse_page, theme_list, wants_full
+)
+from chunking import add_source_documents, chunk_document
+from corpus_store import CorpusStore, open_corpus_store, select_documents
+from dedup import Deduplicator, add_duplicate_counts, collapse_duplicates
+from document_cache import DocumentCache
+from document_repository import DocumentRepository, corpus_fingerprint
+from http_cache import TemplateCache, corpus_etag, is_cacheable_api_path, not_modified
+from jobs import JOB_OPTIONS, JobQueue, QueueFull, wants_async
+from keyword_matcher import ThemeKeywordMatcher
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, IN_FLIGHT, REGISTRY, cache_metrics, corpus_metrics,
+    job_metrics, observe_request, route_label
+)
+from profiling import stage, start_request_profile, stop_request_profile
+from query_themes import QUERY_OPTIONS, QueryThemes
+from result_cache import ResultCache
+from search_index import InvertedIndex, search_hit
+from text_preprocessing import PreprocessingPipeline, TextPreprocessor
+from theme_tree import TREE_OPTIONS, ThemeTreeBuilder
+from streaming_upload import (
+    NDJSON_CONTENT_TYPE, SSE_CONTENT_TYPE, UPLOAD_LIMITS, ThemeTally, UploadError, format_event,
+    is_streaming_upload, iter_batches, iter_documents, iter_lines, read_blocks, read_body,
+    wants_event_stream
+)
+from server_modes import (
+    SERVING_MODES, create_server, display_host, enable_keepalive, serve, serve_prefork
+)
+from vector_store_fetcher import OPENAI_AVAILABLE, VectorStoreFetcher, get_shared_client
+
+# OpenAI integration imports (optional - falls back to sample data if not available).
+# The SDK itself is imported lazily by vector_store_fetcher on first use.
 try:
     from dotenv import load_dotenv
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
+if not OPENAI_AVAILABLE:
     print("Warning: openai or python-dotenv not installed. Using sample data only.")
     print("Install with: pip install openai python-dotenv")
 
@@ -29,64 +69,86 @@ except ImportError:
 if OPENAI_AVAILABLE:
     load_dotenv()
 
-def fetch_documents_from_vector_store(query="energia elétrica", max_results=20):
+# Granularity of the chunks theme analysis runs on (see chunking.py)
+CHUNK_OPTIONS = {
+    'level': os.getenv('CHUNK_LEVEL', 'paragraph'),
+    'max_chars': int(os.getenv('CHUNK_MAX_CHARS', '4000'))
+}
+
+
+# Theme of documents that match no keyword
+GENERAL_THEME = ('Regulamentação Geral', ['energia', 'elétrica', 'regulamentação'])
+
+
+def chunk_file(file_id, content_text):
+    """Split one file into article/paragraph/inciso chunks"""
+    return list(chunk_document(file_id, content_text, **CHUNK_OPTIONS))
+
+
+def create_vector_store_fetcher():
     """
-    Fetch documents from OpenAI Vector Store based on a search query.
-    
-    Args:
-        query: Search query for finding relevant documents
-        max_results: Maximum number of documents to retrieve
-        
+    Build a VectorStoreFetcher for the configured vector store.
+
     Returns:
-        List of document texts, or None if API is not configured
+        VectorStoreFetcher, or None if the API is not configured
     """
     if not OPENAI_AVAILABLE:
         return None
-    
-    api_key = os.getenv('OPENAI_API_KEY')
+
     vector_store_id = os.getenv('VECTOR_STORE_ID')
-    
-    if not api_key or not vector_store_id:
+    client = get_shared_client()
+
+    if not client or not vector_store_id:
         print("Warning: OPENAI_API_KEY or VECTOR_STORE_ID not set in .env file")
         return None
+
+    return VectorStoreFetcher(
+        client,
+        vector_store_id,
+        max_workers=int(os.getenv('VECTOR_STORE_FETCH_WORKERS', '8'))
+    )
+
+
+def fetch_documents_from_vector_store(max_results=None):
+    """
+    Fetch the documents of the OpenAI Vector Store.
+    
+    Pages through the whole vector store, downloads file contents in
+    parallel (see vector_store_fetcher.VectorStoreFetcher) and splits each
+    file into structural chunks as soon as it arrives. Topics are narrowed
+    locally, through the search index (/api/themes?q=, see query_themes.py).
+    
+    Args:
+        max_results: Maximum number of files to retrieve (None for all)
+        
+    Returns:
+        List of chunks (chunking.Chunk), or None if API is not configured
+    """
+    fetcher = create_vector_store_fetcher()
+    if fetcher is None:
+        return None
     
     try:
-        client = OpenAI(api_key=api_key)
+        # Downloads start with the first page; the listing order is recorded so
+        # the corpus version stays stable across refreshes
+        file_ids = []
         
-        # Get files from the vector store
-        files_response = client.beta.vector_stores.files.list(
-            vector_store_id=vector_store_id,
-            limit=max_results
-        )
+        def listed_files():
+            for file_obj in fetcher.iter_files(max_files=max_results):
+                file_ids.append(file_obj.id)
+                yield file_obj
         
-        documents = []
-        for file_obj in files_response.data:
-            try:
-                # Retrieve file content
-                file_id = file_obj.id
-                file_content = client.files.content(file_id)
-                content_text = file_content.text
-                
-                # Extract meaningful text (limit to first few lines or summary)
-                lines = content_text.split('\n')
-                # Get first non-empty lines
-                relevant_lines = []
-                for line in lines:
-                    line = line.strip()
-                    if line and len(line) > 20:  # Skip very short lines
-                        relevant_lines.append(line)
-                        if len(relevant_lines) >= 3:  # Get up to 3 lines per document
-                            break
-                
-                if relevant_lines:
-                    documents.append(' '.join(relevant_lines))
-                    
-            except Exception as e:
-                print(f"Error retrieving file {file_obj.id}: {e}")
+        chunks_by_file = {}
+        for file_id, content_text, error in fetcher.iter_contents(listed_files()):
+            if error is not None:
+                print(f"Error retrieving file {file_id}: {error}")
                 continue
+            chunks_by_file[file_id] = chunk_file(file_id, content_text)
         
+        documents = [chunk for file_id in file_ids for chunk in chunks_by_file.get(file_id, ())]
         if documents:
-            print(f"Successfully fetched {len(documents)} documents from Vector Store")
+            print(f"Successfully fetched {len(chunks_by_file)} documents from Vector Store "
+                  f"({len(documents)} chunks)")
             return documents
         else:
             print("No documents found in Vector Store")
@@ -97,6 +159,52 @@ def fetch_documents_from_vector_store(query="energia elétrica", max_results=20)
         return None
 
 
+def load_documents_from_cache(cache):
+    """
+    Delta-sync the local document cache with the Vector Store and return its documents.
+    
+    When the Vector Store is not configured or cannot be reached, the documents
+    already in the cache are returned unchanged.
+    
+    Args:
+        cache: DocumentCache holding the raw file contents
+        
+    Returns:
+        List of chunks (chunking.Chunk), or None if the cache is empty
+    """
+    fetcher = create_vector_store_fetcher()
+    if fetcher is not None:
+        try:
+            result = cache.sync(fetcher)
+            print(f"Document cache synced in {result.duration:.1f}s: {result.added} added, "
+                  f"{result.updated} updated, {result.deleted} deleted, "
+                  f"{result.unchanged} unchanged, {result.failed} failed")
+        except Exception as e:
+            print(f"Error syncing document cache, serving cached documents: {e}")
+    
+    return read_cached_documents(cache)
+
+
+def read_cached_documents(cache):
+    """
+    Chunks of the documents already in the local cache, without contacting
+    the Vector Store. Files are read and chunked one at a time.
+    
+    Returns:
+        List of chunks (chunking.Chunk), or None if the cache is empty
+    """
+    documents = []
+    n_files = 0
+    for file_id, content_text in cache.iter_documents():
+        documents.extend(chunk_file(file_id, content_text))
+        n_files += 1
+    
+    if documents:
+        print(f"Loaded {n_files} documents from local cache ({len(documents)} chunks)")
+        return documents
+    return None
+
+
 class RegulationThemeAnalyzer:
     def __init__(self):
         # Portuguese stopwords (basic set)
@@ -123,46 +231,90 @@ class RegulationThemeAnalyzer:
             'eólica': ['Energia Eólica', ['eólica', 'vento', 'aerogerador']],
             'fiscalização': ['Fiscalização', ['fiscalização', 'multa', 'penalidade', 'infração']]
         }
+        
+        # Keyword table compiled once; classification is one pass over the tokens
+        self.keyword_matcher = ThemeKeywordMatcher(self.theme_keywords)
+        
+        # Shared tokenizer with a per-document cache and a process pool for big batches
+        self.pipeline = PreprocessingPipeline(TextPreprocessor(self.stopwords))
+        
+        # Near-duplicate detection run before theme extraction (0 disables it)
+        threshold = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+        self.deduplicator = Deduplicator(threshold=threshold) if threshold > 0 else None
+    
+    def deduplicate(self, documents, chunks=None):
+        """
+        Collapse near-identical documents (republished or amended versions)
+        
+        Returns:
+            (documents, chunks, duplicates, positions): canonical documents and
+            chunks, how many duplicates each absorbed (None when deduplication
+            is off) and their positions in the given documents
+        """
+        if self.deduplicator is None:
+            return documents, chunks, None, list(range(len(documents)))
+        if getattr(documents, 'store', None) is not None:
+            # Stored tokens are read as they are grouped, never held as a list
+            tokens = self.pipeline.iter_tokens(documents)
+        else:
+            with stage('preprocess'):
+                tokens = self.pipeline.tokenize_many(documents)
+        unique, unique_chunks, result = collapse_duplicates(self.deduplicator, documents, tokens, chunks)
+        return unique, unique_chunks, result.duplicates, result.canonical
     
     def preprocess_text(self, text):
         """Basic text preprocessing"""
         if not text:
             return ""
         
-        # Convert to lowercase and remove special characters
-        text = re.sub(r'[^a-záàâãéêíóôõúçñ\s]', '', text.lower())
-        
-        # Split into words and filter
-        words = [word for word in text.split() 
-                if word not in self.stopwords and len(word) > 2]
+        # Lowercase, keep letters, split and drop stopwords/short words (cached)
+        return list(self.pipeline.tokenize(text))
+    
+    def classify(self, documents):
+        """
+        Themes matched by each document, for streamed uploads
         
-        return words
+        Yields:
+            List of (theme name, keywords) per document; documents matching no
+            keyword fall in the general theme
+        """
+        for words in self.pipeline.iter_tokens(documents):
+            keys = self.keyword_matcher.match(words)
+            yield [tuple(self.theme_keywords[key]) for key in keys] or [GENERAL_THEME]
     
-    def extract_themes_simple(self, documents, n_clusters=8):
-        """Simple theme extraction using keyword matching"""
+    def extract_themes_simple(self, documents, n_clusters=8, chunks=None, duplicates=None, ids=None):
+        """
+        Simple theme extraction using keyword matching
+        
+        Args:
+            documents: Document (or chunk) texts
+            n_clusters: Maximum number of themes returned
+            chunks: Chunks the texts came from (chunking.Chunk, aligned with
+                documents); each theme then also lists its source documents
+            duplicates: Near-duplicates collapsed into each document (see
+                dedup.py); each theme then reports 'duplicates_collapsed'
+            ids: Corpus id of each document, listed in 'document_ids'
+                (default: its position in documents)
+        """
         if not documents:
             return []
+        if ids is None:
+            ids = range(len(documents))
         
         # Count keywords across all documents
         theme_counts = {theme: 0 for theme in self.theme_keywords}
-        theme_docs = {theme: [] for theme in self.theme_keywords}
-        unclassified_docs = []
+        theme_positions = {theme: [] for theme in self.theme_keywords}
+        unclassified_positions = []
         
-        for doc in documents:
-            words = self.preprocess_text(doc)
-            doc_themes = []
-            
+        for position, words in enumerate(self.pipeline.iter_tokens(documents)):
             # Check for theme keywords
-            for theme_key, (theme_name, keywords) in self.theme_keywords.items():
-                for keyword in keywords:
-                    if keyword in ' '.join(words):
-                        theme_counts[theme_key] += 1
-                        theme_docs[theme_key].append(doc)
-                        doc_themes.append(theme_key)
-                        break
+            doc_themes = self.keyword_matcher.match(words)
+            for theme_key in doc_themes:
+                theme_counts[theme_key] += 1
+                theme_positions[theme_key].append(position)
             
             if not doc_themes:
-                unclassified_docs.append(doc)
+                unclassified_positions.append(position)
         
         # Build themes
         themes = []
@@ -172,206 +324,1022 @@ class RegulationThemeAnalyzer:
                 themes.append({
                     'theme': theme_name,
                     'keywords': keywords,
-                    'documents': theme_docs[theme_key],
+                    'documents': select_documents(documents, theme_positions[theme_key]),
+                    'document_ids': [ids[p] for p in theme_positions[theme_key]],
                     'size': count
                 })
+                if chunks is not None:
+                    add_source_documents(themes[-1], chunks, theme_positions[theme_key])
+                if duplicates is not None:
+                    add_duplicate_counts(themes[-1], duplicates, theme_positions[theme_key])
         
         # Add general theme for unclassified documents
-        if unclassified_docs:
+        if unclassified_positions:
+            theme_name, keywords = GENERAL_THEME
             themes.append({
-                'theme': 'Regulamentação Geral',
-                'keywords': ['energia', 'elétrica', 'regulamentação'],
-                'documents': unclassified_docs,
-                'size': len(unclassified_docs)
+                'theme': theme_name,
+                'keywords': keywords,
+                'documents': select_documents(documents, unclassified_positions),
+                'document_ids': [ids[p] for p in unclassified_positions],
+                'size': len(unclassified_positions)
             })
+            if chunks is not None:
+                add_source_documents(themes[-1], chunks, unclassified_positions)
+            if duplicates is not None:
+                add_duplicate_counts(themes[-1], duplicates, unclassified_positions)
         
         # Sort by size and limit to n_clusters
         themes.sort(key=lambda x: x['size'], reverse=True)
         return themes[:n_clusters]
-
-class ThemeNavigatorHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        # Sample regulations data (fallback when Vector Store is not available)
-        self.sample_regulations = [
-            "Resolução ANEEL sobre tarifas de energia elétrica e reajuste de preços para consumidores residenciais e comerciais",
-            "Normativo sobre qualidade do fornecimento de energia elétrica e indicadores de continuidade do serviço",
-            "Regulamentação sobre geração distribuída fotovoltaica e compensação de energia elétrica solar",
-            "Instrução sobre segurança em instalações elétricas e proteção de trabalhadores do setor",
-            "Decreto sobre concessões de transmissão de energia elétrica e leilões públicos de linhas",
-            "Portaria sobre fiscalização de distribuidoras de energia elétrica e aplicação de penalidades",
-            "Resolução sobre direitos e deveres dos consumidores de energia elétrica residencial",
-            "Normativo sobre energia renovável eólica e incentivos para geração limpa sustentável",
-            "Regulamentação sobre medição inteligente e modernização do sistema elétrico nacional",
-            "Instrução sobre aspectos ambientais da geração de energia elétrica e impactos ao meio ambiente"
-        ]
+    
+    def analyze(self, documents, chunks=None, ids=None, n_clusters=8):
+        """
+        Deduplicate, then extract themes
         
-        # Try to fetch documents from Vector Store, fallback to sample data
-        vector_store_docs = fetch_documents_from_vector_store(query="energia elétrica")
-        if vector_store_docs:
-            self.regulations = vector_store_docs
-            self.using_vector_store = True
-            print(f"Using {len(self.regulations)} documents from OpenAI Vector Store")
-        else:
-            self.regulations = self.sample_regulations
-            self.using_vector_store = False
-            print(f"Using {len(self.regulations)} sample documents (Vector Store not available)")
+        Args:
+            ids: Corpus id of each document (default: its position)
         
-        self.analyzer = RegulationThemeAnalyzer()
-        super().__init__(*args, **kwargs)
+        Returns:
+            Dict with the sorted 'themes' list, a 'by_name' lookup table and
+            the number of 'unique_documents'
+        """
+        with stage('dedup'):
+            unique, unique_chunks, duplicates, positions = self.deduplicate(documents, chunks)
+        if ids is not None:
+            positions = [ids[p] for p in positions]
+        with stage('classify'):
+            themes = self.extract_themes_simple(
+                unique, n_clusters=n_clusters, chunks=unique_chunks, duplicates=duplicates,
+                ids=positions
+            )
+        # reversed() so the first theme wins when two share a name
+        return {
+            'themes': themes,
+            'by_name': {t['theme']: t for t in reversed(themes)},
+            'unique_documents': len(unique)
+        }
+
+# Sample regulations data (fallback when Vector Store is not available)
+SAMPLE_REGULATIONS = [
+    "Resolução ANEEL sobre tarifas de energia elétrica e reajuste de preços para consumidores residenciais e comerciais",
+    "Normativo sobre qualidade do fornecimento de energia elétrica e indicadores de continuidade do serviço",
+    "Regulamentação sobre geração distribuída fotovoltaica e compensação de energia elétrica solar",
+    "Instrução sobre segurança em instalações elétricas e proteção de trabalhadores do setor",
+    "Decreto sobre concessões de transmissão de energia elétrica e leilões públicos de linhas",
+    "Portaria sobre fiscalização de distribuidoras de energia elétrica e aplicação de penalidades",
+    "Resolução sobre direitos e deveres dos consumidores de energia elétrica residencial",
+    "Normativo sobre energia renovável eólica e incentivos para geração limpa sustentável",
+    "Regulamentação sobre medição inteligente e modernização do sistema elétrico nacional",
+    "Instrução sobre aspectos ambientais da geração de energia elétrica e impactos ao meio ambiente"
+]
+
+
+def compact_documents(documents, path, pipeline):
+    """
+    Loaded documents as a corpus store, saved to path and mapped back (see
+    corpus_store.py), so the corpus is held once in shared read-only pages.
+    
+    The store already at path is reused when it holds the same corpus and
+    tokens; when the store cannot be written the documents are returned as
+    they are.
+    
+    Args:
+        documents: Texts or chunks, as returned by the loaders
+        pipeline: PreprocessingPipeline whose tokens are stored
+    """
+    if not documents:
+        return documents
+    texts = [document if isinstance(document, str) else document.text for document in documents]
+    version = corpus_fingerprint(texts)
+    tokenizer = pipeline.preprocessor.signature()
+    store = open_corpus_store(path, tokenizer)
+    if store is not None and store.version == version:
+        return store
     
+    try:
+        started = time.time()
+        with stage('compact'):
+            store = CorpusStore.build(documents, lambda batch: pipeline.iter_tokens(batch, cache=False),
+                                      version, tokenizer)
+            store.save(path)
+            store = CorpusStore.open(path)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not write corpus store {path}: {e}")
+        return documents
+    print(f"Corpus store written in {time.time() - started:.1f}s: {len(store)} documents, "
+          f"{store.nbytes / 1024 / 1024:.1f} MB")
+    return store
+
+
+def create_corpus_store_path():
+    """Path of the corpus store, unless CORPUS_STORE_PATH is set to empty"""
+    return os.getenv('CORPUS_STORE_PATH', '.cache/corpus.store') or None
+
+
+def create_document_repository(refresh_interval=None, cache=None, store_path=None, pipeline=None):
+    """
+    Build the process-wide document repository.
+
+    Documents come from the OpenAI Vector Store when it is configured (through
+    the local document cache when one is given); the sample regulations are
+    served until (and unless) a load succeeds. With a store path and the
+    analyzer's pipeline, loaded corpora are served from a corpus store.
+    """
+    if refresh_interval is None:
+        refresh_interval = float(os.getenv('DOCUMENT_REFRESH_INTERVAL', '3600'))
+
+    if cache is not None:
+        load = lambda: load_documents_from_cache(cache)
+    else:
+        load = lambda: fetch_documents_from_vector_store()
+    if store_path and pipeline is not None:
+        loader = lambda: compact_documents(load(), store_path, pipeline)
+    else:
+        loader = load
+
+    return DocumentRepository(
+        loader=loader,
+        fallback_documents=SAMPLE_REGULATIONS,
+        refresh_interval=refresh_interval
+    )
+
+
+def create_document_cache():
+    """Open the local document cache unless DOCUMENT_CACHE_PATH is set to empty"""
+    cache_path = os.getenv('DOCUMENT_CACHE_PATH', '.cache/documents.db')
+    if not cache_path:
+        return None
+    try:
+        return DocumentCache(cache_path)
+    except Exception as e:
+        print(f"Warning: could not open document cache at {cache_path}: {e}")
+        return None
+
+
+class ThemeNavigatorHandler(http.server.SimpleHTTPRequestHandler):
+    # Shared by every handler instance; set up once in main()
+    repository = None
+    document_cache = None
+    analyzer = RegulationThemeAnalyzer()
+    search_index = InvertedIndex(analyzer.pipeline.iter_tokens, analyzer.pipeline.tokenize)
+    # Sub-themes of every theme, built once per corpus version
+    theme_tree = ThemeTreeBuilder(analyzer.pipeline.tokenize_many, **TREE_OPTIONS)
+    result_cache = ResultCache(
+        max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '128')),
+        max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024)
+    )
+    # /api/themes?q=: themes of the best matches of a query, cached per query
+    query_themes = QueryThemes(search_index, analyzer.analyze, result_cache, analyzer.pipeline.tokenize,
+                               **QUERY_OPTIONS)
+
+    # HTML templates held in memory, reloaded when the files change
+    templates = TemplateCache('templates')
+    # Industrial location engine, created on first use (needs NumPy)
+    location_scorer = None
+    # Background analyses (POST /api/jobs, /api/upload?async=1), run in threads
+    job_queue = JobQueue(**JOB_OPTIONS)
+
+    # Paths reported as the route label of the request metrics
+    ROUTES = ('/', '/industrial-location', '/api/themes', '/api/theme/', '/api/documents',
+              '/api/search', '/api/admin/status', '/api/upload', '/api/admin/refresh',
+              '/api/industrial-location/score', '/api/jobs', '/api/jobs/', '/metrics', '/health')
+
+    # Per request: indent JSON responses (?pretty=1), ETag of a cacheable API
+    # response, stage profile (?profile=1) and response status
+    pretty = False
+    etag = None
+    profile = None
+    status_code = None
+
+    def load_snapshot(self):
+        """Pin the current corpus snapshot for the duration of this request"""
+        self.snapshot = self.repository.snapshot()
+        # The snapshot is immutable, so its documents are used as they are
+        self.regulations = self.snapshot.documents
+
+    def get_theme_analysis(self, documents=None, version=None, n_clusters=8, chunks=None):
+        """
+        Themes for a corpus, memoized by corpus version and parameters.
+
+        Returns:
+            Dict with the sorted 'themes' list and a 'by_name' lookup table
+        """
+        if documents is None:
+            documents = self.regulations
+            version = self.snapshot.version
+            chunks = self.snapshot.chunks
+        elif version is None:
+            version = corpus_fingerprint(documents)
+
+        key = (version, 'keywords', n_clusters, chunks is not None)
+        return self.result_cache.get_or_compute(
+            key, lambda: self.analyzer.analyze(documents, chunks, n_clusters=n_clusters)
+        )
+
+    def get_theme_tree(self):
+        """Theme tree of the pinned snapshot (updated from the previous version's tree)"""
+        analysis = self.get_theme_analysis()
+        return self.theme_tree.sync(self.snapshot.documents, analysis['themes'], self.snapshot.version)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
     def do_GET(self):
-        """Handle GET requests"""
+        self.handle_measured(self.route_get)
+
+    def do_POST(self):
+        self.handle_measured(self.route_post)
+
+    def handle_measured(self, route):
+        """
+        Run a request handler, recording its latency and status, and profile
+        its stages when the query string has profile=1
+        """
+        started = time.perf_counter()
         parsed_path = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed_path.query))
+        self.status_code = None
+        self.profile = start_request_profile() if params.get('profile') in ('1', 'true') else None
+        IN_FLIGHT.inc()
+        try:
+            route(parsed_path, params)
+        finally:
+            IN_FLIGHT.dec()
+            stop_request_profile()
+            self.profile = None
+            observe_request(self.command, route_label(parsed_path.path, self.ROUTES),
+                            self.status_code or 0, time.perf_counter() - started)
+
+    def route_get(self, parsed_path, params):
+        """Handle GET requests"""
+        self.load_snapshot()
+        self.pretty = params.get('pretty') in ('1', 'true')
+        self.etag = None
+        # Profiled responses carry their own timings and are never revalidated
+        if is_cacheable_api_path(parsed_path.path) and self.profile is None:
+            # Same corpus version and URL, same response: revalidate for free
+            self.etag = corpus_etag(self.snapshot.version, self.path)
+            if not_modified(self.headers, self.etag):
+                self.send_not_modified(self.etag)
+                return
 
         if parsed_path.path == '/':
             self.serve_index()
         elif parsed_path.path == '/industrial-location':
             self.serve_industrial_location()
         elif parsed_path.path == '/api/themes':
-            self.serve_themes()
+            self.serve_themes(params)
         elif parsed_path.path.startswith('/api/theme/'):
             theme_name = urllib.parse.unquote(parsed_path.path.split('/')[-1])
-            self.serve_theme_details(theme_name)
+            self.serve_theme_details(theme_name, params)
+        elif parsed_path.path == '/api/documents':
+            self.serve_documents(params)
+        elif parsed_path.path == '/api/search':
+            self.serve_search(urllib.parse.parse_qs(parsed_path.query))
+        elif parsed_path.path == '/api/admin/status':
+            self.serve_admin_status()
+        elif parsed_path.path.startswith('/api/jobs/'):
+            self.serve_job(parsed_path.path[len('/api/jobs/'):])
+        elif parsed_path.path == '/metrics':
+            self.serve_metrics()
+        elif parsed_path.path == '/health':
+            self.serve_health()
         else:
             self.send_error(404)
     
-    def do_POST(self):
+    def route_post(self, parsed_path, params):
         """Handle POST requests"""
-        if self.path == '/api/upload':
-            self.handle_upload()
+        self.load_snapshot()
+        self.pretty = False
+        self.etag = None
+
+        if parsed_path.path == '/api/upload':
+            self.handle_upload(params)
+        elif parsed_path.path == '/api/jobs':
+            self.handle_job_submission()
+        elif parsed_path.path == '/api/admin/refresh':
+            self.handle_admin_refresh()
+        elif parsed_path.path == '/api/industrial-location/score':
+            self.handle_location_score()
         else:
+            # The request body was not read, so the connection cannot be reused
+            self.close_connection = True
             self.send_error(404)
     
     def serve_index(self):
         """Serve the main HTML page"""
         try:
-            # Try to serve the local version first (no external dependencies)
-            try:
-                with open('templates/index_local.html', 'r', encoding='utf-8') as f:
-                    content = f.read()
-            except FileNotFoundError:
-                # Fallback to original version
-                with open('templates/index.html', 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            # Serve the local version first (no external dependencies), then
+            # fall back to the original version
+            self.send_template(self.templates.first('index_local.html', 'index.html'))
         except FileNotFoundError:
             self.send_error(404, "Template not found")
 
     def serve_industrial_location(self):
         """Serve the industrial location analysis page"""
         try:
-            with open('templates/industrial_location.html', 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_template(self.templates.get('industrial_location.html'))
         except FileNotFoundError:
             self.send_error(404, "Industrial location template not found")
     
-    def serve_themes(self):
-        """Serve themes API"""
+    def serve_themes(self, params):
+        """Serve themes API (document ids, or texts with ?format=full); ?q= narrows it to a query"""
+        query = params.get('q', '').strip()
+        if query:
+            self.serve_query_themes(query, params)
+            return
         try:
-            themes = self.analyzer.extract_themes_simple(self.regulations)
-            response = {
-                'success': True,
-                'themes': themes,
-                'total_documents': len(self.regulations),
-                'source': 'vector_store' if self.using_vector_store else 'sample_data'
-            }
-            self.send_json_response(response)
+            full = wants_full(params)
+            snapshot = self.snapshot
+            analysis = self.get_theme_analysis()
+            
+            def build():
+                return {
+                    'success': True,
+                    'themes': theme_list(analysis['themes'], full),
+                    'total_documents': len(self.regulations),
+                    'unique_documents': analysis['unique_documents'],
+                    'source': snapshot.source,
+                    'corpus_version': snapshot.version,
+                    'snapshot_loaded_at': snapshot.loaded_at
+                }
+            
+            self.send_cached_json_response((snapshot.version, 'body', 'themes', full), build)
         except Exception as e:
             self.send_error(500, str(e))
     
-    def serve_theme_details(self, theme_name):
-        """Serve theme details API"""
+    def serve_query_themes(self, query, params):
+        """Serve the themes of the documents best matching a query (see query_themes.py)"""
+        full = wants_full(params)
+        snapshot = self.snapshot
+        try:
+            self.sync_search_index()
+            analysis = self.query_themes.analysis(query)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        
+        def build():
+            return {
+                'success': True,
+                'query': analysis['query'],
+                'themes': theme_list(analysis['themes'], full),
+                'total_documents': len(snapshot),
+                'matched_documents': analysis['matched_documents'],
+                'analysed_documents': analysis['analysed_documents'],
+                'unique_documents': analysis['unique_documents'],
+                'source': snapshot.source,
+                'corpus_version': analysis['corpus_version'],
+                'snapshot_loaded_at': snapshot.loaded_at
+            }
+        
+        self.send_cached_json_response(
+            (analysis['corpus_version'], 'body', 'themes', full, 'query', analysis['query']), build
+        )
+    
+    def serve_theme_details(self, theme_name, params):
+        """Serve theme details API, with one page of the theme's documents"""
+        try:
+            page, per_page = parse_page(params)
+        except ValueError:
+            self.send_error(400, "Invalid page or per_page")
+            return
         try:
-            themes = self.analyzer.extract_themes_simple(self.regulations)
-            theme = next((t for t in themes if t['theme'] == theme_name), None)
+            # Top-level themes and sub-themes at any depth are looked up by name
+            node = self.get_theme_tree().node(theme_name)
             
-            if not theme:
+            if not node:
                 self.send_error(404, "Theme not found")
                 return
             
-            # Create sub-themes by further dividing the documents
-            sub_themes = []
-            if len(theme['documents']) > 1:
-                # Simple subdivision: split documents into smaller groups
-                docs = theme['documents']
-                chunk_size = max(1, len(docs) // 3)
-                
-                for i in range(0, len(docs), chunk_size):
-                    chunk = docs[i:i + chunk_size]
-                    sub_themes.append({
-                        'theme': f"{theme['theme']} - Parte {i//chunk_size + 1}",
-                        'keywords': theme['keywords'][:3],
-                        'documents': chunk,
-                        'size': len(chunk)
-                    })
-            else:
-                sub_themes = [theme]
-            
+            theme = node.theme
+            full = wants_full(params)
             response = {
                 'success': True,
-                'theme': theme,
-                'sub_themes': sub_themes
+                'theme': theme_list([theme], full)[0],
+                'path': node.path(),
+                'sub_themes': theme_list(node.sub_themes, full),
+                'documents': document_page(theme['document_ids'], self.snapshot.documents,
+                                           page, per_page),
+                'corpus_version': self.snapshot.version
             }
             self.send_json_response(response)
         except Exception as e:
             self.send_error(500, str(e))
     
-    def handle_upload(self):
-        """Handle document upload"""
+    def serve_documents(self, params):
+        """Serve documents by id (?ids=1,2,3) or page by page (?page=)"""
+        snapshot = self.snapshot
+        corpus = snapshot.chunks or snapshot.documents
+        try:
+            page, per_page = parse_page(params)
+            if params.get('ids'):
+                ids = parse_ids(params['ids'], len(corpus))
+                page, per_page = 1, max(1, len(ids))
+            else:
+                ids = range(len(corpus))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        
+        response = {'success': True, 'corpus_version': snapshot.version}
+        response.update(document_page(ids, corpus, page, per_page))
+        self.send_json_response(response)
+    
+    def sync_search_index(self):
+        """Index the pinned snapshot if the repository listener has not yet"""
+        snapshot = self.snapshot
+        self.search_index.sync(snapshot.chunks or snapshot.documents, snapshot.version)
+
+    def serve_search(self, params):
+        """Serve BM25-ranked search results, optionally within one theme"""
+        query = params.get('q', [''])[0].strip()
+        if not query:
+            self.send_error(400, "Missing query parameter q")
+            return
+        try:
+            limit = max(1, min(int(params.get('limit', ['10'])[0]), 100))
+        except ValueError:
+            self.send_error(400, "Invalid limit")
+            return
+        theme_name = params.get('theme', [None])[0]
+
+        try:
+            started = time.perf_counter()
+            self.sync_search_index()
+            within = None
+            if theme_name:
+                analysis = self.get_theme_analysis()
+                theme = analysis['by_name'].get(theme_name)
+                if not theme:
+                    self.send_error(404, "Theme not found")
+                    return
+                # Theme members as index doc ids, computed once per theme and index version
+                within = self.result_cache.get_or_compute(
+                    (self.snapshot.version, 'search_scope', theme_name, self.search_index.version),
+                    lambda: self.search_index.doc_ids(theme['documents'])
+                )
+
+            results, total = self.search_index.search(query, limit=limit, within=within)
+            self.send_json_response({
+                'success': True,
+                'query': query,
+                'theme': theme_name,
+                'total': total,
+                'results': [search_hit(score, document) for score, document in results],
+                'took_ms': round((time.perf_counter() - started) * 1000, 3)
+            })
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    def request_blocks(self, body_optional=False):
+        """
+        The request body in bounded blocks (Content-Length or chunked).
+
+        Without either header the request has no body; that is only accepted
+        when body_optional is set (a 411 otherwise).
+        """
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        content_length = self.headers.get('Content-Length')
+        if not chunked and content_length is None:
+            if body_optional:
+                return iter(())
+            raise UploadError("Content-Length or chunked transfer encoding required", status=411)
+        return read_blocks(self.rfile, None if chunked else int(content_length), chunked=chunked,
+                           max_bytes=UPLOAD_LIMITS['max_bytes'])
+
+    def handle_upload(self, params):
+        """Handle document upload (as a job with ?async=1 or Prefer: respond-async)"""
+        if is_streaming_upload(self.headers.get('Content-Type')):
+            self.handle_streaming_upload()
+            return
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(post_data)
+            try:
+                data = json.loads(read_body(self.request_blocks()).decode('utf-8'))
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                self.send_error(400, "Request body must be a JSON object")
+                return
             
             documents = data.get('documents', [])
             if not documents:
                 self.send_error(400, "No documents provided")
                 return
+            if not is_document_list(documents):
+                self.send_error(400, "documents must be a list of strings")
+                return
+            try:
+                n_clusters = parse_n_clusters(data.get('n_clusters'))
+            except (TypeError, ValueError):
+                self.send_error(400, "Invalid n_clusters")
+                return
             
-            themes = self.analyzer.extract_themes_simple(documents)
-            response = {
-                'success': True,
-                'themes': themes,
-                'total_documents': len(documents)
-            }
-            self.send_json_response(response)
+            chunk = bool(data.get('chunk'))
+            full = wants_full(data)
+            if wants_async(params, self.headers.get('Prefer')):
+                self.submit_job(('upload', corpus_fingerprint(documents), n_clusters, chunk, full),
+                                self.analyze_upload, documents, n_clusters, chunk, full)
+                return
+            self.send_json_response(self.analyze_upload(documents, n_clusters, chunk, full))
+        except UploadError as e:
+            # The rest of the body was not read, so the connection cannot be reused
+            self.close_connection = True
+            self.send_error(e.status, str(e))
         except Exception as e:
             self.send_error(500, str(e))
+
+    def analyze_upload(self, documents, n_clusters=8, chunk=False, full=False):
+        """Themes of uploaded documents: the /api/upload response (also run as a job)"""
+        chunks = None
+        if chunk:
+            # Analyse article/paragraph chunks of full regulation texts
+            chunks = [chunk for i, doc in enumerate(documents)
+                      for chunk in chunk_file(f"upload-{i}", doc)]
+        
+        if chunks:
+            analysis = self.get_theme_analysis([c.text for c in chunks], n_clusters=n_clusters, chunks=chunks)
+        else:
+            analysis = self.get_theme_analysis(documents, n_clusters=n_clusters)
+        response = {
+            'success': True,
+            'themes': theme_list(analysis['themes'], full),
+            'total_documents': len(documents),
+            'unique_documents': analysis['unique_documents']
+        }
+        if chunks:
+            response['total_chunks'] = len(chunks)
+        return response
+
+    def analyze_snapshot(self, snapshot, n_clusters=8, full=False):
+        """Themes of a corpus snapshot: the /api/themes response for any n_clusters (run as a job)"""
+        analysis = self.get_theme_analysis(snapshot.documents, snapshot.version, n_clusters, snapshot.chunks)
+        return {
+            'success': True,
+            'themes': theme_list(analysis['themes'], full),
+            'total_documents': len(snapshot.documents),
+            'unique_documents': analysis['unique_documents'],
+            'source': snapshot.source,
+            'corpus_version': snapshot.version,
+            'snapshot_loaded_at': snapshot.loaded_at
+        }
+
+    def handle_job_submission(self):
+        """Analyse uploaded documents, or without documents the current corpus, as a job"""
+        try:
+            # No body at all means no documents: analyse the current corpus
+            body = read_body(self.request_blocks(body_optional=True))
+            data = json.loads(body.decode('utf-8')) if body.strip() else {}
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+            n_clusters = parse_n_clusters(data.get('n_clusters'))
+        except UploadError as e:
+            self.close_connection = True
+            self.send_error(e.status, str(e))
+            return
+        except (TypeError, ValueError) as e:
+            self.send_error(400, f"Invalid job: {e}")
+            return
+        
+        documents = data.get('documents')
+        full = wants_full(data)
+        if not documents:
+            self.submit_job(('corpus', self.snapshot.version, n_clusters, full),
+                            self.analyze_snapshot, self.snapshot, n_clusters, full)
+        elif not is_document_list(documents):
+            self.send_error(400, "documents must be a list of strings")
+        else:
+            chunk = bool(data.get('chunk'))
+            self.submit_job(('upload', corpus_fingerprint(documents), n_clusters, chunk, full),
+                            self.analyze_upload, documents, n_clusters, chunk, full)
+
+    def submit_job(self, key, function, *args):
+        """Answer 202 with the new (or merged identical) job, or 503 when the queue is full"""
+        try:
+            job, merged = self.job_queue.submit(key, function, *args)
+        except QueueFull as e:
+            self.send_json_response({'success': False, 'error': str(e)}, status=503,
+                                    headers={'Retry-After': '5'})
+            return
+        self.send_json_response({'success': True, 'merged': merged, 'job': job}, status=202,
+                                headers={'Location': f"/api/jobs/{job['id']}"})
+
+    def serve_job(self, job_id):
+        """Progress of a job, and its result once done"""
+        job = self.job_queue.get(job_id)
+        if job is None:
+            self.send_error(404, "Job not found or expired")
+            return
+        self.send_json_response({'success': True, 'job': job})
+
+    def handle_streaming_upload(self):
+        """
+        Classify an NDJSON upload batch by batch (see streaming_upload.py),
+        writing each batch's theme counts back as soon as it is classified
+        """
+        event_stream = wants_event_stream(self.headers.get('Accept'))
+        try:
+            blocks = self.request_blocks()
+        except UploadError as e:
+            self.close_connection = True
+            self.send_error(e.status, str(e))
+            return
+
+        started = time.perf_counter()
+        documents = iter_documents(iter_lines(blocks, UPLOAD_LIMITS['max_document_bytes']))
+        tally = ThemeTally()
+        # HTTP/1.1 responses of unknown length are chunked; HTTP/1.0 ones end
+        # when the connection closes
+        chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+        headers_sent = False
+
+        def write(event):
+            nonlocal headers_sent
+            if not headers_sent:
+                # Headers go out with the first result, so an upload rejected
+                # before that still gets a proper error status
+                headers_sent = True
+                self.send_response(200)
+                self.send_header('Content-type', (SSE_CONTENT_TYPE if event_stream
+                                                  else NDJSON_CONTENT_TYPE) + '; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                if chunked:
+                    self.send_header('Transfer-Encoding', 'chunked')
+                else:
+                    self.close_connection = True
+                self.end_headers()
+            body = format_event(event, event_stream)
+            if chunked:
+                body = b'%x\r\n%s\r\n' % (len(body), body)
+            self.wfile.write(body)
+            self.wfile.flush()
+
+        try:
+            for batch in iter_batches(documents, UPLOAD_LIMITS['batch_size']):
+                doc_ids = [doc_id for doc_id, _ in batch]
+                themes = self.analyzer.classify([text for _, text in batch])
+                write(tally.add_batch(list(zip(doc_ids, themes))))
+            if not tally.documents:
+                raise UploadError("No documents provided")
+            write(tally.summary(took_ms=round((time.perf_counter() - started) * 1000, 3)))
+        except Exception as e:
+            # Unread body may be left on the socket: drop the connection
+            self.close_connection = True
+            status = e.status if isinstance(e, UploadError) else 500
+            if not headers_sent:
+                self.send_error(status, str(e))
+                return
+            write({'success': False, 'error': str(e), 'status': status,
+                   'processed': tally.documents})
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
     
-    def send_json_response(self, data):
-        """Send JSON response"""
-        json_data = json.dumps(data, ensure_ascii=False, indent=2)
+    def handle_location_score(self):
+        """Score batches of industrial location scenarios (see industrial_location.py)"""
+        try:
+            request = json.loads(read_body(self.request_blocks()).decode('utf-8'))
+        except UploadError as e:
+            self.close_connection = True
+            self.send_error(e.status, str(e))
+            return
+        except ValueError:
+            self.send_error(400, "Invalid JSON")
+            return
+        if not isinstance(request, dict):
+            self.send_error(400, "Expected a JSON object")
+            return
+        
+        try:
+            # NumPy is optional here and only needed by this endpoint
+            from industrial_location import LocationScorer, ScenarioError
+        except ImportError:
+            self.send_error(503, "NumPy is required for industrial location scoring")
+            return
+        if ThemeNavigatorHandler.location_scorer is None:
+            ThemeNavigatorHandler.location_scorer = LocationScorer()
+        
+        try:
+            started = time.perf_counter()
+            response = self.location_scorer.score(request)
+            response['success'] = True
+            response['took_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self.send_json_response(response)
+        except ScenarioError as e:
+            self.send_error(400, str(e))
+        except Exception as e:
+            self.send_error(500, str(e))
+
+    def is_admin_authorized(self):
+        """
+        Check the admin token when ADMIN_TOKEN is configured, sent as
+        X-Admin-Token or as a bearer token (as Prometheus scrapers do)
+        """
+        admin_token = os.getenv('ADMIN_TOKEN')
+        if not admin_token:
+            return True
+        return (self.headers.get('X-Admin-Token') == admin_token
+                or self.headers.get('Authorization') == f'Bearer {admin_token}')
+
+    def serve_health(self):
+        """Liveness check with the served corpus version"""
+        status = self.repository.status()
+        self.send_json_response({
+            'status': 'ok',
+            'corpus_version': status['version'],
+            'total_documents': status['total_documents'],
+            'source': status['source'],
+            'snapshot_age_seconds': status['snapshot_age_seconds'],
+            'refreshing': status['refreshing']
+        })
+
+    def serve_metrics(self):
+        """Request, stage, cache, corpus and memory metrics in the Prometheus text format"""
+        if not self.is_admin_authorized():
+            self.send_error(403, "Invalid admin token")
+            return
+        body = REGISTRY.render().encode('utf-8')
         self.send_response(200)
+        self.send_header('Content-type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_admin_status(self):
+        """Report the document repository state, including snapshot age"""
+        if not self.is_admin_authorized():
+            self.send_error(403, "Invalid admin token")
+            return
+        response = {
+            'success': True,
+            'repository': self.repository.status(),
+            'result_cache': self.result_cache.stats()
+        }
+        response['search_index'] = self.search_index.stats()
+        response['theme_tree'] = self.theme_tree.stats()
+        response['jobs'] = self.job_queue.stats()
+        response['query_themes'] = self.query_themes.stats()
+        if self.document_cache is not None:
+            response['cache'] = self.document_cache.status()
+        self.send_json_response(response)
+
+    def handle_admin_refresh(self):
+        """Trigger a background refresh of the document repository"""
+        if not self.is_admin_authorized():
+            self.send_error(403, "Invalid admin token")
+            return
+        self.repository.request_refresh()
+        self.send_json_response({
+            'success': True,
+            'message': 'Refresh scheduled',
+            'repository': self.repository.status()
+        }, status=202)
+
+    def send_json_response(self, data, status=200, headers=None):
+        """Send JSON response, compressed when the client accepts it"""
+        if self.profile is not None and isinstance(data, dict):
+            data = dict(data, profile=self.profile.as_dict())
+        body, encoding = encode_body(data, self.headers.get('Accept-Encoding'), self.pretty)
+        self.send_json_body(body, encoding, status, headers)
+
+    def send_cached_json_response(self, key, build):
+        """
+        Send a JSON response serialized and compressed once per cache key.
+
+        Args:
+            key: Result cache key starting with the corpus version
+            build: Callable returning the response data
+        """
+        if self.profile is not None:
+            # Serialized afresh, so the profile shows what a cache miss costs
+            self.send_json_response(build())
+            return
+        accept_encoding = self.headers.get('Accept-Encoding')
+        key = key + (self.pretty, choose_encoding(accept_encoding))
+        body, encoding = self.result_cache.get_or_compute(
+            key, lambda: encode_body(build(), accept_encoding, self.pretty)
+        )
+        self.send_json_body(body, encoding)
+
+    def send_json_body(self, body, encoding=None, status=200, headers=None):
+        """Send an already serialized JSON body"""
+        self.send_response(status)
         self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if self.etag and status == 200:
+            self.send_header('ETag', self.etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if self.profile is not None:
+            self.send_header('Server-Timing', self.profile.server_timing())
+        self.send_header('Vary', 'Accept-Encoding')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json_data.encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_template(self, template):
+        """Send a cached HTML template, or 304 when the client's copy is current"""
+        if not_modified(self.headers, template.etag, template.mtime):
+            self.send_not_modified(template.etag, template.last_modified)
+            return
+        compressed = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        body = template.gzip_body if compressed else template.body
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', template.etag)
+        self.send_header('Last-Modified', template.last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(body)
 
-def main():
+    def send_not_modified(self, etag, last_modified=None):
+        """Answer a conditional GET whose cached copy is still valid"""
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        if last_modified:
+            self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+
+def server_metrics():
+    """Collector of the shared handler state for /metrics"""
+    handler = ThemeNavigatorHandler
+    snapshot = handler.repository.snapshot()
+    families = corpus_metrics(snapshot.documents, snapshot.version, snapshot.source, snapshot.age_seconds)
+    families.append(('corpus_refreshes_total', 'counter', 'Successful corpus refreshes',
+                     [({}, handler.repository.refresh_count)]))
+    if snapshot.store is not None:
+        families.append(('corpus_store_bytes', 'gauge', 'Size of the corpus store buffers (mapped or in memory)',
+                         [({'mapped': str(snapshot.store.mapped).lower()}, snapshot.store.nbytes)]))
+    families += cache_metrics('result_cache', handler.result_cache.stats())
+    families += cache_metrics('token_cache', handler.analyzer.pipeline.stats())
+    index = handler.search_index.stats()
+    families.append(('search_index_documents', 'gauge', 'Documents in the search index',
+                     [({}, index['documents'])]))
+    families.append(('search_index_postings_bytes', 'gauge', 'Approximate size of the search index postings',
+                     [({}, index['postings_bytes'])]))
+    queries = handler.query_themes.stats()
+    families.append(('query_themes_precomputed_total', 'counter',
+                     'Query-scoped theme analyses precomputed for a new corpus version',
+                     [({}, queries['precomputed'])]))
+    families += job_metrics(handler.job_queue.stats())
+    return families
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Theme Navigator HTTP server")
+    parser.add_argument('--host', default=os.getenv('HOST', ''),
+                        help="Address to bind (default: all interfaces)")
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8000')),
+                        help="Port to listen on (default: 8000)")
+    parser.add_argument('--mode', choices=SERVING_MODES, default=os.getenv('SERVER_MODE', 'threaded'),
+                        help="single: one request at a time; threaded: bounded thread pool; "
+                             "prefork: forked worker processes sharing the loaded corpus")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SERVER_WORKERS', '16')),
+                        help="Worker threads per process (threaded and prefork modes)")
+    parser.add_argument('--processes', type=int, default=int(os.getenv('SERVER_PROCESSES', str(os.cpu_count() or 1))),
+                        help="Worker processes in prefork mode (default: number of CPUs)")
+    parser.add_argument('--queue-size', type=int, default=int(os.getenv('SERVER_QUEUE_SIZE', '64')),
+                        help="Connections waiting for a worker before new ones get a 503")
+    parser.add_argument('--keepalive-timeout', type=float, default=float(os.getenv('KEEPALIVE_TIMEOUT', '15')),
+                        help="Seconds an idle keep-alive connection is kept open (0 disables keep-alive)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Print import and startup phase timings once the port is bound")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Start the server"""
-    PORT = 8000
+    args = parse_args(argv)
     
     print(f"Starting Theme Navigator Server...")
-    print(f"Server will be available at: http://localhost:{PORT}")
-    print(f"Press Ctrl+C to stop the server")
-    
+    startup_profiler.mark('imports')
+
+    # Load the corpus once; every handler shares this repository
+    document_cache = create_document_cache()
+    store_path = create_corpus_store_path()
+    repository = create_document_repository(cache=document_cache, store_path=store_path,
+                                            pipeline=ThemeNavigatorHandler.analyzer.pipeline)
+    ThemeNavigatorHandler.repository = repository
+    ThemeNavigatorHandler.document_cache = document_cache
+    # Drop results computed for older corpus versions as soon as a refresh lands
+    repository.add_listener(
+        lambda snapshot: ThemeNavigatorHandler.result_cache.invalidate(keep_version=snapshot.version)
+    )
+    REGISTRY.add_collector(server_metrics)
+
+    def follow_corpus():
+        # Keep the search index in step with the corpus (incrementally)
+        repository.add_listener(
+            lambda snapshot: ThemeNavigatorHandler.search_index.sync(
+                snapshot.chunks or snapshot.documents, snapshot.version
+            )
+        )
+
+    def precompute_queries():
+        # Then analyse the popular queries again for the new version. Only in
+        # serving processes: a precompute thread running at os.fork() would
+        # leave its lock held in the children
+        repository.add_listener(lambda snapshot: ThemeNavigatorHandler.query_themes.precompute())
+
+    def index_current_snapshot():
+        # A refresh may install a newer snapshot while an older one is being
+        # indexed; go again until the index matches the served corpus
+        snapshot = repository.snapshot()
+        while ThemeNavigatorHandler.search_index.version != snapshot.version:
+            ThemeNavigatorHandler.search_index.sync(snapshot.chunks or snapshot.documents,
+                                                    snapshot.version)
+            snapshot = repository.snapshot()
+
+    if args.mode == 'prefork':
+        # Children inherit whatever is loaded before the fork (a corpus store
+        # as shared pages of its file, and the search index built from it)
+        follow_corpus()
+        repository.start(block=True)
+    else:
+        # The corpus store of the last run is mapped, not parsed, so serving
+        # starts at once; otherwise serve the local cache right away. The
+        # search index is built and the Vector Store synced after the port is
+        # bound (searches arriving earlier index the snapshot themselves)
+        store = open_corpus_store(store_path, ThemeNavigatorHandler.analyzer.pipeline.preprocessor.signature())
+        if store is not None:
+            repository.seed(store, source='corpus_store')
+        elif document_cache is not None:
+            repository.seed(read_cached_documents(document_cache), source='cache')
+    status = repository.status()
+    print(f"Using {status['total_documents']} documents from {status['source']}")
+    startup_profiler.mark('load documents')
+
+    if args.keepalive_timeout > 0:
+        enable_keepalive(ThemeNavigatorHandler, args.keepalive_timeout)
+
+    parent_pid = os.getpid()
+    signature = ThemeNavigatorHandler.analyzer.pipeline.preprocessor.signature()
+
+    def after_fork():
+        # Threads and SQLite connections do not survive os.fork()
+        if document_cache is not None:
+            document_cache.reopen()
+        precompute_queries()
+        # Only the parent refreshes; workers remap the corpus store it rewrites
+        if store_path is not None:
+            repository.refresh_requester = lambda: os.kill(parent_pid, signal.SIGUSR1)
+            repository.follow(store_path, lambda path: open_corpus_store(path, signature))
+        else:
+            repository.refresh_requester = lambda: None
+
+    def refresh_in_parent():
+        # The parent no longer serves, so nothing is derived from its snapshots
+        repository.clear_listeners()
+        if store_path is None:
+            print("Warning: without a corpus store (CORPUS_STORE_PATH) prefork workers "
+                  "keep the corpus loaded at startup")
+            return
+        signal.signal(signal.SIGUSR1, lambda signum, frame: repository.request_refresh())
+        repository.start_refresh_thread()
+
     try:
-        with socketserver.TCPServer(("", PORT), ThemeNavigatorHandler) as httpd:
-            print(f"Server started successfully on port {PORT}")
-            httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nServer stopped by user")
+        httpd = create_server(args.mode, args.host, args.port, ThemeNavigatorHandler,
+                              workers=args.workers, queue_size=args.queue_size)
+        print(f"Server started successfully on port {args.port} ({args.mode} mode)")
+        print(f"Server will be available at: http://{display_host(args.host)}:{args.port}")
+        print(f"Press Ctrl+C to stop the server")
+        startup_profiler.mark('bind port')
+
+        if args.mode == 'prefork':
+            startup_profiler.report()
+            # Stop the refresh thread so children start from a quiescent state
+            repository.stop()
+            serve_prefork(httpd, args.processes, after_fork=after_fork, in_parent=refresh_in_parent)
+        else:
+            follow_corpus()
+            precompute_queries()
+            threading.Thread(target=index_current_snapshot, name='search-index', daemon=True).start()
+            repository.start(block=False)
+            startup_profiler.report()
+            serve(httpd)
+        print("\nServer stopped")
     except Exception as e:
         print(f"Error starting server: {e}")
+    finally:
+        repository.stop()
+        ThemeNavigatorHandler.job_queue.shutdown()
+        if document_cache is not None:
+            document_cache.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
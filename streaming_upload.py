@@ -0,0 +1,232 @@
+"""
+Streaming document uploads.
+
+POST /api/upload with Content-Type application/x-ndjson takes one document per
+line -- a JSON string, or an object with a "text" (or "content") field and an
+optional "id" -- sent with a Content-Length or with chunked transfer encoding.
+The body is read in blocks and parsed line by line, so only the batch being
+classified is held in memory. The result of every batch is written back as
+soon as it is ready, as one NDJSON line (or a server-sent event when the
+client accepts text/event-stream), followed by a summary of the whole upload.
+
+UPLOAD_MAX_BYTES caps the request body and UPLOAD_MAX_DOCUMENT_BYTES a single
+document line; both servers also apply UPLOAD_MAX_BYTES to plain JSON uploads.
+"""
+
+import json
+import os
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+SSE_CONTENT_TYPE = 'text/event-stream'
+
+UPLOAD_LIMITS = {
+    'max_bytes': int(float(os.getenv('UPLOAD_MAX_MB', '256')) * 1024 * 1024),
+    'max_document_bytes': int(float(os.getenv('UPLOAD_MAX_DOCUMENT_MB', '8')) * 1024 * 1024),
+    'batch_size': int(os.getenv('UPLOAD_BATCH_SIZE', '500'))
+}
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Invalid or oversized upload; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_streaming_upload(content_type):
+    """Whether a request body is NDJSON (one document per line)"""
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return media_type in (NDJSON_CONTENT_TYPE, 'application/jsonl', 'application/ndjson')
+
+
+def wants_event_stream(accept):
+    """Whether the client asked for server-sent events instead of NDJSON"""
+    return SSE_CONTENT_TYPE in (accept or '')
+
+
+def read_blocks(stream, content_length=None, chunked=False, max_bytes=None, block_size=BLOCK_SIZE):
+    """
+    Read a request body in blocks.
+
+    Args:
+        stream: Binary file object positioned at the start of the body
+        content_length: Body length from the Content-Length header; None reads
+            until end of stream (e.g. a WSGI input that is already de-chunked)
+        chunked: Body uses HTTP/1.1 chunked transfer encoding
+        max_bytes: Maximum body size; UploadError (413) once it is exceeded
+
+    Yields:
+        Non-empty bytes blocks
+    """
+    if max_bytes is not None and content_length is not None and content_length > max_bytes:
+        raise UploadError(f"Upload larger than {max_bytes} bytes", status=413)
+
+    total = 0
+
+    def counted(block):
+        nonlocal total
+        total += len(block)
+        if max_bytes is not None and total > max_bytes:
+            raise UploadError(f"Upload larger than {max_bytes} bytes", status=413)
+        return block
+
+    if chunked:
+        while True:
+            size_line = stream.readline(1024)
+            try:
+                size = int(size_line.split(b';')[0].strip(), 16)
+            except ValueError:
+                raise UploadError("Malformed chunked body")
+            if size == 0:
+                # Skip trailers up to the blank line ending the body
+                while stream.readline(1024) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            while size > 0:
+                block = stream.read(min(size, block_size))
+                if not block:
+                    raise UploadError("Truncated chunked body")
+                size -= len(block)
+                yield counted(block)
+            stream.readline(1024)  # CRLF after the chunk data
+    else:
+        remaining = content_length
+        while remaining is None or remaining > 0:
+            block = stream.read(block_size if remaining is None else min(remaining, block_size))
+            if not block:
+                if remaining:
+                    raise UploadError("Truncated request body")
+                return
+            if remaining is not None:
+                remaining -= len(block)
+            yield counted(block)
+
+
+def read_body(blocks):
+    """Whole body of a (bounded) block iterator, for plain JSON uploads"""
+    return b''.join(blocks)
+
+
+def iter_lines(blocks, max_line_bytes=None):
+    """
+    Split a block iterator into lines without holding more than one line.
+
+    Yields:
+        Non-blank lines as bytes, without the line terminator
+    """
+    # Pieces of the unfinished line, joined once it ends: appending to one
+    # bytes buffer would copy it for every block of a long line
+    pending = []
+    pending_bytes = 0
+    for block in blocks:
+        *lines, rest = block.split(b'\n')
+        if lines:
+            lines[0] = b''.join(pending + [lines[0]])
+            pending, pending_bytes = [], 0
+            for line in lines:
+                if max_line_bytes is not None and len(line) > max_line_bytes:
+                    raise UploadError(f"Document larger than {max_line_bytes} bytes", status=413)
+                if line.strip():
+                    yield line
+        if rest:
+            pending.append(rest)
+            pending_bytes += len(rest)
+        if max_line_bytes is not None and pending_bytes > max_line_bytes:
+            raise UploadError(f"Document larger than {max_line_bytes} bytes", status=413)
+    line = b''.join(pending)
+    if line.strip():
+        yield line
+
+
+def iter_documents(lines):
+    """
+    Parse NDJSON document lines.
+
+    Yields:
+        (document id, text) pairs; documents without an "id" are numbered
+        upload-0, upload-1, ... in upload order
+    """
+    for number, line in enumerate(lines):
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise UploadError(f"Line {number + 1} is not valid JSON: {e}")
+
+        if isinstance(item, str):
+            doc_id, text = None, item
+        elif isinstance(item, dict):
+            doc_id = item.get('id')
+            text = item.get('text', item.get('content'))
+        else:
+            doc_id = text = None
+        if not isinstance(text, str):
+            raise UploadError(f"Line {number + 1} has no document text")
+        yield (str(doc_id) if doc_id is not None else f"upload-{number}"), text
+
+
+def iter_batches(items, size):
+    """Lists of up to size consecutive items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def format_event(data, event_stream=False):
+    """One progressive result, as an NDJSON line or a server-sent event"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    if event_stream:
+        name = 'summary' if data.get('done') else ('error' if 'error' in data else 'batch')
+        return f"event: {name}\ndata: {payload}\n\n".encode('utf-8')
+    return (payload + '\n').encode('utf-8')
+
+
+class ThemeTally:
+    """
+    Running per-theme totals of a streamed upload.
+
+    Only theme counts and document ids are kept, never document texts.
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.batches = 0
+        self._themes = {}
+
+    def add_batch(self, assignments):
+        """
+        Record the themes of one batch.
+
+        Args:
+            assignments: (document id, list of (theme name, keywords)) pairs
+
+        Returns:
+            Progress event for the batch
+        """
+        batch_counts = {}
+        for doc_id, themes in assignments:
+            for name, keywords in themes:
+                entry = self._themes.get(name)
+                if entry is None:
+                    entry = self._themes[name] = {'theme': name, 'keywords': keywords,
+                                                  'size': 0, 'document_ids': []}
+                entry['size'] += 1
+                entry['document_ids'].append(doc_id)
+                batch_counts[name] = batch_counts.get(name, 0) + 1
+        self.documents += len(assignments)
+        self.batches += 1
+        return {'batch': self.batches, 'documents': len(assignments),
+                'processed': self.documents, 'themes': batch_counts}
+
+    def summary(self, **extra):
+        """Final event: every theme with its size and document ids, largest first"""
+        themes = sorted(self._themes.values(), key=lambda x: x['size'], reverse=True)
+        return dict({'done': True, 'success': True, 'total_documents': self.documents,
+                     'themes': themes}, **extra)
@@ -0,0 +1,92 @@
+"""
+In-memory fake of the two vector store calls VectorStoreFetcher relies on:
+
+    client.vector_stores.files.list(vector_store_id=..., limit=..., after=...)
+    client.files.content(file_id)
+
+Pages follow the API's cursor semantics (`after` is the id of the last file
+of the previous page, `has_more` tells whether another page exists). Failures
+are scripted per call: a list of HTTP status codes is consumed one per
+attempt, so [429, 503] fails twice and then succeeds. The fake also records
+every call and the peak number of concurrent content downloads.
+"""
+
+import threading
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+
+class FakeAPIError(Exception):
+    """Error carrying an HTTP status code, like the SDK's APIStatusError"""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeVectorStore:
+    """
+    Fake OpenAI client serving a fixed set of files.
+
+    Args:
+        contents: Mapping of file id to text, in listing order
+        content_failures: Mapping of file id to the status codes its
+            downloads fail with, in order
+        list_failures: Mapping of list cursor (None for the first page) to
+            the status codes that page's requests fail with, in order
+        latency: Seconds each content download takes
+    """
+
+    def __init__(self, contents, content_failures=None, list_failures=None, latency=0.0):
+        self.contents = dict(contents)
+        self.file_ids = list(self.contents)
+        self.content_failures = defaultdict(list, {
+            key: list(statuses) for key, statuses in (content_failures or {}).items()
+        })
+        self.list_failures = defaultdict(list, {
+            key: list(statuses) for key, statuses in (list_failures or {}).items()
+        })
+        self.latency = latency
+
+        self.list_calls = []
+        self.content_calls = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        self.vector_stores = SimpleNamespace(files=SimpleNamespace(list=self.list_files))
+        self.files = SimpleNamespace(content=self.file_content)
+
+    def list_files(self, vector_store_id, limit=20, after=None):
+        with self._lock:
+            self.list_calls.append(after)
+            failures = self.list_failures[after]
+            if failures:
+                raise FakeAPIError(failures.pop(0))
+
+        start = self.file_ids.index(after) + 1 if after is not None else 0
+        ids = self.file_ids[start:start + limit]
+        return SimpleNamespace(
+            data=[SimpleNamespace(id=file_id) for file_id in ids],
+            has_more=start + limit < len(self.file_ids)
+        )
+
+    def file_content(self, file_id):
+        with self._lock:
+            self.content_calls[file_id] += 1
+            failures = self.content_failures[file_id]
+            status_code = failures.pop(0) if failures else None
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if status_code is not None:
+                raise FakeAPIError(status_code)
+            if file_id not in self.contents:
+                raise FakeAPIError(404)
+            return SimpleNamespace(text=self.contents[file_id])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
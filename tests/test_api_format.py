@@ -0,0 +1,25 @@
+"""Request parameter parsing in api_format"""
+
+import pytest
+
+from api_format import DEFAULT_CLUSTERS, MAX_CLUSTERS, is_document_list, parse_n_clusters
+
+
+def test_n_clusters_defaults_and_cap():
+    assert parse_n_clusters(None) == DEFAULT_CLUSTERS
+    assert parse_n_clusters('') == DEFAULT_CLUSTERS
+    assert parse_n_clusters('12') == 12
+    assert parse_n_clusters(MAX_CLUSTERS + 1) == MAX_CLUSTERS
+
+
+@pytest.mark.parametrize('value', [0, '0', -1, 'abc'])
+def test_invalid_n_clusters_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_n_clusters(value)
+
+
+def test_document_lists_hold_only_strings():
+    assert is_document_list(['Art. 1º', 'Art. 2º'])
+    assert not is_document_list('abc')
+    assert not is_document_list([1, 2])
+    assert not is_document_list({'documents': ['a']})
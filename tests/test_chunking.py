@@ -0,0 +1,37 @@
+"""Structural headings recognised by chunking.chunk_document"""
+
+from chunking import chunk_document, heading_level
+
+
+def labels(content, level='article'):
+    return [chunk.label for chunk in chunk_document('f1', content, level=level, min_chars=0)]
+
+
+def test_inserted_article_keeps_its_letter():
+    content = ("Art. 3º As tarifas serão reajustadas anualmente.\n"
+               "Art. 3º-A As distribuidoras publicarão os valores.\n"
+               "Art. 4 - B. Revogam-se as disposições em contrário.")
+    assert labels(content) == ['Art. 3º', 'Art. 3º-A', 'Art. 4-B']
+
+
+def test_dash_before_the_article_text_is_not_a_suffix():
+    assert heading_level('Art. 2º - A distribuidora deverá') == (0, 'Art. 2º')
+    assert heading_level('Art. 1º - Estabelecer as condições') == (0, 'Art. 1º')
+
+
+def test_roman_numerals_open_incisos():
+    assert heading_level('IV - as tarifas de uso') == (2, 'IV')
+    assert heading_level('XLIX) os consumidores livres') == (2, 'XLIX')
+    content = ("Art. 5º São deveres da distribuidora:\n"
+               "I - atender os consumidores;\n"
+               "II – publicar as tarifas.")
+    assert labels(content, level='inciso') == ['Art. 5º', 'Art. 5º, I', 'Art. 5º, II']
+
+
+def test_acronyms_are_not_incisos():
+    for line in ('CDM - Mecanismo de Desenvolvimento Limpo', 'DC - corrente contínua',
+                 'MW) de potência instalada', 'IIII - quatro'):
+        assert heading_level(line) is None
+    # A numeral outside any article is not an inciso either
+    content = "I - Introdução ao regulamento\nArt. 1º Esta resolução estabelece as regras."
+    assert labels(content, level='inciso') == ['', 'Art. 1º']
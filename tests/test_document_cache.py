@@ -0,0 +1,63 @@
+"""Delta syncs of document_cache.DocumentCache"""
+
+from types import SimpleNamespace
+
+from document_cache import DocumentCache
+
+
+class Fetcher:
+    """Serves (file_id, created_at, usage_bytes, text) entries and counts downloads"""
+
+    def __init__(self, files):
+        self.files = files
+        self.downloads = []
+
+    def iter_files(self):
+        for file_id, created_at, usage_bytes, _ in self.files:
+            yield SimpleNamespace(id=file_id, created_at=created_at, usage_bytes=usage_bytes)
+
+    def iter_contents(self, file_objs):
+        texts = {file_id: text for file_id, _, _, text in self.files}
+        for file_obj in file_objs:
+            self.downloads.append(file_obj.id)
+            yield file_obj.id, texts[file_obj.id], None
+
+
+def test_usage_bytes_alone_does_not_trigger_a_download(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'documents.db'))
+    cache.sync(Fetcher([('a', 1, 10, 'texto a'), ('b', 2, 10, 'texto b')]))
+
+    fetcher = Fetcher([('a', 1, 99, 'texto a'), ('b', 2, 10, 'texto b')])
+    result = cache.sync(fetcher)
+
+    assert fetcher.downloads == []
+    assert result.unchanged == 2 and not result.changed
+
+
+def test_new_upload_with_same_content_is_not_rewritten(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'documents.db'))
+    cache.sync(Fetcher([('a', 1, 10, 'texto a'), ('b', 2, 10, 'texto b')]))
+
+    fetcher = Fetcher([('a', 5, 10, 'texto a'), ('b', 6, 10, 'texto novo')])
+    result = cache.sync(fetcher)
+
+    assert sorted(fetcher.downloads) == ['a', 'b']
+    assert (result.unchanged, result.updated) == (1, 1)
+    assert dict(cache.iter_documents()) == {'a': 'texto a', 'b': 'texto novo'}
+    # Both markers are current: the next sync downloads nothing
+    again = Fetcher(fetcher.files)
+    cache.sync(again)
+    assert again.downloads == []
+
+
+def test_markers_of_older_caches_are_read_by_creation_time(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'documents.db'))
+    cache.sync(Fetcher([('a', 1, 10, 'texto a')]))
+    with cache._lock:
+        cache._conn.execute("UPDATE documents SET remote_version = '1:10'")
+        cache._conn.commit()
+
+    fetcher = Fetcher([('a', 1, 10, 'texto a')])
+    cache.sync(fetcher)
+
+    assert fetcher.downloads == []
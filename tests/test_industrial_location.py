@@ -0,0 +1,36 @@
+"""Request validation of industrial_location.LocationScorer"""
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from industrial_location import MAX_CASES, WEIGHT_KEYS, LocationScorer, ScenarioError
+
+BASE = {'avgLoad': 10, 'peakLoad': 15, 'loadFactor': 0.7}
+
+
+def test_oversized_sweep_is_rejected_before_building_the_grid():
+    values = [i / 10 for i in range(200)]
+    request = {'scenarios': [BASE], 'sweep': {'weights': {key: values for key in WEIGHT_KEYS[:4]}}}
+    with pytest.raises(ScenarioError, match=str(MAX_CASES)):
+        LocationScorer().score(request)
+
+
+def test_sweep_and_monte_carlo_count_their_evaluations():
+    request = {'scenarios': [BASE, BASE],
+               'sweep': {'weights': {WEIGHT_KEYS[0]: [0.1, 0.2, 0.3], WEIGHT_KEYS[1]: [0.4, 0.5]}},
+               'monte_carlo': {'samples': 10, 'seed': 7}}
+    result = LocationScorer().score(request)
+    assert result['evaluations'] == 2 * (1 + 6 + 10)
+
+
+@pytest.mark.parametrize('request_update', [
+    {'monte_carlo': {'samples': 10, 'seed': 'abc'}},
+    {'monte_carlo': {'samples': 10, 'seed': 1.5}},
+    {'scenarios': [dict(BASE, avgLoad='nan')]},
+    {'scenarios': [dict(BASE, energyPriceMultiplier='inf')]},
+    {'sweep': {'weights': {WEIGHT_KEYS[0]: [1, 'inf']}}},
+])
+def test_invalid_values_raise_scenario_errors(request_update):
+    with pytest.raises(ScenarioError):
+        LocationScorer().score(dict({'scenarios': [BASE]}, **request_update))
@@ -0,0 +1,162 @@
+"""Job queue of jobs.py and the /api/jobs routes of app.py"""
+
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, JobQueue, QueueFull
+
+
+def wait_for(queue, job_id, timeout=60):
+    """State of a job once it is finished"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job['status'] in (DONE, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish in {timeout}s")
+
+
+def add(a, b):
+    return a + b
+
+
+def fail():
+    raise ValueError("bad input")
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=2, max_pending=2)
+    yield queue
+    queue.shutdown()
+
+
+def test_identical_jobs_are_merged(queue):
+    release = threading.Event()
+    first, merged = queue.submit('key', release.wait, 10)
+    assert not merged
+    second, merged = queue.submit('key', release.wait, 10)
+    assert merged
+    assert second['id'] == first['id']
+    assert second['submissions'] == 2
+
+    release.set()
+    assert wait_for(queue, first['id'])['status'] == DONE
+    # A finished job is still merged into until it expires
+    third, merged = queue.submit('key', release.wait, 10)
+    assert merged and third['id'] == first['id']
+    assert queue.stats()['submitted'] == 1
+    assert queue.stats()['merged'] == 2
+
+
+def test_queue_limit(queue):
+    release = threading.Event()
+    queue.submit('a', release.wait, 10)
+    queue.submit('b', release.wait, 10)
+    with pytest.raises(QueueFull):
+        queue.submit('c', release.wait, 10)
+    # Merging does not take a slot
+    assert queue.submit('a', release.wait, 10)[1]
+    assert queue.stats()['rejected'] == 1
+
+    release.set()
+    job, _ = queue.submit('a', release.wait, 10)
+    wait_for(queue, job['id'])
+    job, merged = queue.submit('c', add, 1, 2)
+    assert not merged
+    assert wait_for(queue, job['id'])['result'] == 3
+
+
+def test_failed_jobs_are_not_merged(queue):
+    job, _ = queue.submit('key', fail)
+    failed = wait_for(queue, job['id'])
+    assert failed['status'] == FAILED
+    assert failed['error'] == 'bad input'
+
+    retry, merged = queue.submit('key', add, 1, 2)
+    assert not merged
+    assert retry['id'] != job['id']
+    assert queue.stats()['failed'] == 1
+
+
+def test_finished_jobs_expire():
+    queue = JobQueue(result_ttl=0.2)
+    try:
+        job, _ = queue.submit('key', add, 1, 2)
+        assert wait_for(queue, job['id'])['result'] == 3
+        time.sleep(0.3)
+        assert queue.get(job['id']) is None
+        assert queue.stats()['kept'] == 0
+
+        again, merged = queue.submit('key', add, 1, 2)
+        assert not merged
+        assert again['id'] != job['id']
+    finally:
+        queue.shutdown()
+
+
+def test_jobs_are_read_from_the_directory(tmp_path):
+    writer = JobQueue(directory=str(tmp_path))
+    reader = JobQueue(directory=str(tmp_path))
+    try:
+        job, _ = writer.submit('key', add, 1, 2)
+        wait_for(writer, job['id'])
+        loaded = reader.get(job['id'])
+        assert loaded['status'] == DONE
+        assert loaded['result'] == 3
+        assert reader.get('0' * 32) is None
+        assert reader.get('../secrets') is None
+    finally:
+        writer.shutdown()
+        reader.shutdown()
+
+
+def test_jobs_run_in_worker_processes(tmp_path):
+    queue = JobQueue(workers=1, processes=True, directory=str(tmp_path))
+    try:
+        job, _ = queue.submit('key', add, 1, 2)
+        finished = wait_for(queue, job['id'])
+        assert finished['status'] == DONE
+        assert finished['result'] == 3
+    finally:
+        queue.shutdown()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    pytest.importorskip('flask')
+    pytest.importorskip('sklearn')
+    import app
+    queue = JobQueue(workers=1, processes=True, directory=str(tmp_path))
+    monkeypatch.setattr(app, 'job_queue', queue)
+    yield app.app.test_client()
+    queue.shutdown()
+
+
+def test_corpus_job_runs_in_a_worker_process(client):
+    response = client.post('/api/jobs', json={'n_clusters': 3})
+    assert response.status_code == 202
+    job = response.get_json()['job']
+    assert response.headers['Location'] == f"/api/jobs/{job['id']}"
+    assert client.post('/api/jobs', json={'n_clusters': 3}).get_json()['merged']
+
+    deadline = time.time() + 120
+    while job['status'] not in (DONE, FAILED) and time.time() < deadline:
+        time.sleep(0.1)
+        job = client.get(f"/api/jobs/{job['id']}").get_json()['job']
+    assert job['status'] == DONE
+    assert job['result']['success']
+    assert job['result']['themes']
+    assert job['progress']['stages_started'] > 0
+
+
+def test_full_queue_answers_503(client, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'job_queue', JobQueue(max_pending=0))
+    response = client.post('/api/jobs', json={'documents': ['um texto']})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert client.get(f"/api/jobs/{'0' * 32}").status_code == 404
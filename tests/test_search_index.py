@@ -0,0 +1,100 @@
+"""BM25 ranking and incremental sync of search_index.InvertedIndex"""
+
+import pytest
+
+import search_index
+from search_index import InvertedIndex
+
+
+def tokenize(text):
+    return text.lower().split()
+
+
+def tokenize_many(texts):
+    return [tokenize(text) for text in texts]
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def index(request, monkeypatch):
+    if request.param:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(search_index, 'NUMPY_AVAILABLE', request.param)
+    return InvertedIndex(tokenize_many, tokenize)
+
+
+CORPUS = [
+    'tarifa de energia',
+    'tarifa de energia e tarifa social',
+    'geração distribuída',
+    'bandeira tarifária',
+]
+
+
+def texts(results):
+    return [document for _, document in results]
+
+
+def test_documents_matching_more_terms_rank_first(index):
+    index.sync(CORPUS, 'v1')
+    results, total = index.search('tarifa social')
+    assert total == 2
+    assert texts(results) == ['tarifa de energia e tarifa social', 'tarifa de energia']
+    assert results[0][0] > results[1][0] > 0
+
+    assert index.search('inexistente') == ([], 0)
+    assert index.search('') == ([], 0)
+
+
+def test_rarer_terms_weigh_more(index):
+    index.sync(['a comum', 'b comum', 'c comum rara'], 'v1')
+    results, _ = index.search('comum rara')
+    assert texts(results)[0] == 'c comum rara'
+
+
+def test_limit_and_within(index):
+    index.sync(CORPUS, 'v1')
+    results, total = index.search('tarifa energia', limit=1)
+    assert total == 2
+    assert texts(results) == ['tarifa de energia']
+
+    within = index.doc_ids({'tarifa de energia e tarifa social', 'geração distribuída'})
+    results, total = index.search('tarifa', within=within)
+    assert total == 1
+    assert texts(results) == ['tarifa de energia e tarifa social']
+
+
+def test_sync_adds_and_removes_incrementally(index):
+    assert index.sync(CORPUS, 'v1') == (4, 0)
+    assert index.sync(CORPUS, 'v1') == (0, 0)
+
+    updated = CORPUS[:3] + ['tarifa branca']
+    assert index.sync(updated, 'v2') == (1, 1)
+    assert len(index) == 4
+    assert index.stats()['tombstones'] == 1
+    assert index.version == 'v2'
+
+    results, total = index.search('tarifa')
+    assert total == 3
+    assert 'bandeira tarifária' not in texts(results)
+    assert 'tarifa branca' in texts(results)
+    assert texts(index.search('bandeira')[0]) == []
+
+    version, documents, positions, total = index.match('tarifa', 10)
+    assert version == 'v2'
+    assert documents == ['tarifa de energia', 'tarifa de energia e tarifa social', 'tarifa branca']
+    assert positions == [0, 1, 3]
+
+
+def test_duplicated_texts_are_distinct_documents(index):
+    index.sync(['tarifa', 'tarifa'], 'v1')
+    assert len(index) == 2
+    assert index.sync(['tarifa'], 'v2') == (0, 1)
+    assert index.search('tarifa')[1] == 1
+
+
+def test_sync_rebuilds_when_most_documents_go(index):
+    index.sync(CORPUS, 'v1')
+    assert index.sync(['tarifa nova', 'geração distribuída'], 'v2') == (2, 3)
+    assert len(index) == 2
+    assert index.stats()['tombstones'] == 0
+    assert texts(index.search('tarifa')[0]) == ['tarifa nova']
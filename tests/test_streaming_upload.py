@@ -0,0 +1,33 @@
+"""NDJSON line splitting of streaming_upload.iter_lines"""
+
+import pytest
+
+from streaming_upload import UploadError, iter_lines
+
+
+def test_lines_split_across_blocks():
+    data = b'{"a": 1}\n\n{"b": 2}\r\n  \n{"c": 3}'
+    expected = [b'{"a": 1}', b'{"b": 2}\r', b'{"c": 3}']
+    for size in range(1, len(data) + 1):
+        blocks = [data[i:i + size] for i in range(0, len(data), size)]
+        assert list(iter_lines(blocks)) == expected
+
+
+def test_long_line_is_joined_once_complete():
+    blocks = [b'x' * 1000] * 100 + [b'\ny']
+    assert list(iter_lines(blocks)) == [b'x' * 100000, b'y']
+
+
+def test_line_over_the_limit_is_rejected():
+    with pytest.raises(UploadError) as error:
+        list(iter_lines([b'x' * 10] * 5, max_line_bytes=30))
+    assert error.value.status == 413
+    assert list(iter_lines([b'ab\ncd', b'\n', b'ef'], max_line_bytes=3)) == [b'ab', b'cd', b'ef']
+
+
+def test_line_completed_within_a_block_is_checked():
+    with pytest.raises(UploadError) as error:
+        list(iter_lines([b'ok\n' + b'x' * 50 + b'\nok'], max_line_bytes=30))
+    assert error.value.status == 413
+    with pytest.raises(UploadError):
+        list(iter_lines([b'x' * 20, b'x' * 20 + b'\n'], max_line_bytes=30))
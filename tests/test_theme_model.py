@@ -0,0 +1,64 @@
+"""Drift tracking of theme_model.ThemeModelManager"""
+
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('sklearn')
+
+from theme_model import ThemeModelManager
+
+
+class FakeModel:
+    """Assigns every document to theme 0 with a fixed similarity"""
+
+    def __init__(self, similarity):
+        self.similarity = similarity
+        self.corpus_version = None
+        self.stats = {'similarity_mean': 1.0}
+        self.themes = [{'theme': 'Tarifas', 'keywords': ['tarifa']}]
+        self.terms = ['tarifa']
+
+    def assign(self, processed_docs):
+        n = len(processed_docs)
+        return np.zeros(n, dtype=np.int64), np.full(n, self.similarity)
+
+
+def make_manager(similarity, fitted=None, **kwargs):
+    def fit_model(documents):
+        if fitted is not None:
+            fitted.append(list(documents))
+        return FakeModel(similarity)
+    manager = ThemeModelManager(None, fit_model, lambda text: text, **kwargs)
+    manager.ensure_model(['base 1', 'base 2'], 'v1')
+    return manager
+
+
+def test_assigned_documents_are_not_all_kept():
+    manager = make_manager(0.9, max_refit_documents=50)
+    for batch in range(100):
+        manager.assign_labels([f'doc {batch}-{i}' for i in range(100)])
+
+    status = manager.status()
+    assert status['assigned_since_fit'] == 10000
+    assert status['refit_sample'] == 50
+    assert status['drift'] == pytest.approx(0.1)
+    assert status['refit_count'] == 0
+
+
+def test_refit_uses_corpus_and_bounded_sample():
+    fitted = []
+    manager = make_manager(0.2, fitted, max_refit_documents=30, min_drift_samples=10)
+    done = threading.Event()
+    original = manager._refit
+    manager._refit = lambda documents, version: (original(documents, version), done.set())
+
+    manager.assign_labels([f'doc {i}' for i in range(100)])
+    assert done.wait(5)
+
+    refit_documents = fitted[-1]
+    assert refit_documents[:2] == ['base 1', 'base 2']
+    assert len(refit_documents) == 2 + 30
+    assert manager.status()['refit_count'] == 1
+    assert manager.status()['assigned_since_fit'] == 0
@@ -0,0 +1,124 @@
+"""VectorStoreFetcher driven through the in-memory fake of the files API"""
+
+from unittest import mock
+
+import vector_store_fetcher
+from vector_store_fetcher import VectorStoreFetcher
+
+from fake_vector_store import FakeVectorStore
+
+
+def make_store(n_files, **kwargs):
+    return FakeVectorStore({f'file-{i:03d}': f'text {i}' for i in range(n_files)}, **kwargs)
+
+
+def make_fetcher(client, **kwargs):
+    kwargs.setdefault('backoff_base', 0.01)
+    kwargs.setdefault('backoff_max', 0.05)
+    return VectorStoreFetcher(client, 'vs_test', **kwargs)
+
+
+def collect(fetcher, max_files=None):
+    return {file_id: (text, error) for file_id, text, error in fetcher.iter_documents(max_files)}
+
+
+def test_listing_follows_cursor_across_pages():
+    client = make_store(25)
+    fetcher = make_fetcher(client, page_size=10)
+
+    ids = [file_obj.id for file_obj in fetcher.iter_files()]
+
+    assert ids == client.file_ids
+    assert client.list_calls == [None, 'file-009', 'file-019']
+
+
+def test_listing_stops_at_max_files():
+    client = make_store(25)
+    fetcher = make_fetcher(client, page_size=10)
+
+    ids = [file_obj.id for file_obj in fetcher.iter_files(max_files=12)]
+
+    assert ids == client.file_ids[:12]
+    assert client.list_calls == [None, 'file-009']
+
+
+def test_every_document_is_downloaded_once():
+    client = make_store(40)
+    results = collect(make_fetcher(client, page_size=7, max_workers=4))
+
+    assert results == {file_id: (text, None) for file_id, text in client.contents.items()}
+    assert set(client.content_calls.values()) == {1}
+
+
+def test_downloads_stay_within_worker_limit():
+    client = make_store(30, latency=0.02)
+    results = collect(make_fetcher(client, max_workers=3))
+
+    assert len(results) == 30
+    assert client.max_in_flight == 3
+
+
+def test_files_are_pulled_lazily():
+    client = make_store(50, latency=0.01)
+    fetcher = make_fetcher(client, max_workers=2)
+    pulled = []
+
+    def files():
+        for file_id in client.file_ids:
+            pulled.append(file_id)
+            yield file_id
+
+    results = fetcher.iter_contents(files())
+    next(results)
+    # At most 2 * max_workers downloads are queued ahead of the consumer
+    assert len(pulled) <= 2 * 2
+    assert len(list(results)) == 49
+    assert len(pulled) == 50
+
+
+def test_transient_errors_are_retried_with_backoff():
+    client = make_store(3, content_failures={'file-001': [429, 503, 500]},
+                        list_failures={None: [502]})
+    fetcher = make_fetcher(client, max_retries=4, backoff_base=0.1, backoff_max=0.3)
+
+    with mock.patch.object(vector_store_fetcher.time, 'sleep') as sleep:
+        results = collect(fetcher)
+
+    assert results['file-001'] == ('text 1', None)
+    assert client.content_calls['file-001'] == 4
+    assert client.list_calls == [None, None]
+
+    # Jittered exponential delays: 0.1, 0.2, 0.4 capped at 0.3 (content), 0.1 (list)
+    delays = sorted(call.args[0] for call in sleep.call_args_list)
+    assert len(delays) == 4
+    for delay, ceiling in zip(delays, sorted([0.1, 0.1, 0.2, 0.3])):
+        assert ceiling * 0.5 <= delay <= ceiling
+
+
+def test_permanent_failure_is_reported_without_stopping_the_rest():
+    client = make_store(5, content_failures={'file-002': [404]})
+    fetcher = make_fetcher(client)
+
+    with mock.patch.object(vector_store_fetcher.time, 'sleep') as sleep:
+        results = collect(fetcher)
+
+    text, error = results['file-002']
+    assert text is None and error.status_code == 404
+    # A 404 is not retried
+    assert client.content_calls['file-002'] == 1
+    assert not sleep.called
+    assert all(results[file_id] == (client.contents[file_id], None)
+               for file_id in client.file_ids if file_id != 'file-002')
+
+
+def test_retries_give_up_after_max_retries():
+    client = make_store(2, content_failures={'file-000': [503] * 10})
+    fetcher = make_fetcher(client, max_retries=3)
+
+    with mock.patch.object(vector_store_fetcher.time, 'sleep'):
+        results = collect(fetcher)
+
+    text, error = results['file-000']
+    assert text is None and error.status_code == 503
+    assert client.content_calls['file-000'] == 4
+    assert results['file-001'] == ('text 1', None)
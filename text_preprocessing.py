@@ -0,0 +1,270 @@
+"""
+Batch Portuguese text preprocessing shared by both theme analyzers.
+
+Both servers preprocess the same way: lowercase, drop everything but letters
+and whitespace, split into words, remove stopwords and words of two letters
+or less. (After the character filter only letters and spaces remain, so
+splitting on whitespace yields the same tokens NLTK's word_tokenize did.)
+
+PreprocessingPipeline adds to that:
+
+- a bounded cache of token tuples keyed by a hash of the document content, so
+  texts seen before (sub-theme drill-downs, repeated uploads, refreshes of an
+  unchanged corpus) are never tokenized twice
+- a process pool that tokenizes large batches of cache misses in chunks
+- streaming: iter_tokens() yields results in input order as soon as each
+  chunk is done, so consumers can start before the whole batch is tokenized
+
+Documents of a corpus store (see corpus_store.py) are not tokenized at all:
+their tokens were stored when the store was built.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+NON_LETTERS = re.compile(r'[^a-záàâãéêíóôõúçñ\s]')
+
+
+class TextPreprocessor:
+    """
+    Stateless tokenizer: lowercase, keep letters, split, filter.
+
+    Args:
+        stopwords: Words to drop
+        min_length: Minimum token length kept
+    """
+
+    def __init__(self, stopwords, min_length=3):
+        self.stopwords = frozenset(stopwords)
+        self.min_length = min_length
+
+    def tokens(self, text):
+        if not text or not isinstance(text, str):
+            return ()
+        stopwords = self.stopwords
+        min_length = self.min_length
+        return tuple(
+            word for word in NON_LETTERS.sub('', text.lower()).split()
+            if len(word) >= min_length and word not in stopwords
+        )
+
+    def signature(self):
+        """Digest of the settings; tokens stored by one tokenizer are valid for another with the same signature"""
+        settings = '\x00'.join([NON_LETTERS.pattern, str(self.min_length)] + sorted(self.stopwords))
+        return hashlib.blake2b(settings.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# Per-process tokenizer used by pool workers (set by _init_worker)
+_worker_preprocessor = None
+
+
+def _init_worker(stopwords, min_length):
+    global _worker_preprocessor
+    _worker_preprocessor = TextPreprocessor(stopwords, min_length)
+
+
+def _tokenize_chunk(texts):
+    return [_worker_preprocessor.tokens(text) for text in texts]
+
+
+def content_key(text):
+    """Cache key of a document: digest of its UTF-8 content"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class PreprocessingPipeline:
+    """
+    Cached, optionally parallel tokenization of document batches.
+
+    Args:
+        preprocessor: TextPreprocessor doing the actual work
+        workers: Pool processes (0 or 1 tokenizes in the calling thread)
+        chunk_size: Documents sent to a worker at a time
+        parallel_threshold: Minimum number of cache misses in a batch before
+            the process pool is used (pickling costs more than it saves on
+            small batches)
+        cache_size: Maximum number of cached token tuples
+    """
+
+    def __init__(self, preprocessor, workers=None, chunk_size=512,
+                 parallel_threshold=5000, cache_size=200000):
+        self.preprocessor = preprocessor
+        if workers is None:
+            workers = int(os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 1)))
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.parallel_threshold = parallel_threshold
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, text):
+        """Token tuple of one document (cached)"""
+        if not text or not isinstance(text, str):
+            return ()
+        key = content_key(text)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = self.preprocessor.tokens(text)
+        self._store(key, tokens)
+        return tokens
+
+    def iter_tokens(self, documents, cache=True):
+        """
+        Yield the token tuple of each document, in input order.
+
+        Cached documents are answered immediately; misses are tokenized inline
+        for small batches or in chunks on the process pool for large ones.
+
+        Args:
+            documents: Texts, or a view of a corpus store (whose stored tokens
+                are read instead)
+            cache: Use and fill the cache; False for one-off passes over a
+                whole corpus (e.g. building a corpus store), which would only
+                evict the entries worth keeping
+        """
+        stored = getattr(documents, 'iter_terms', None)
+        if stored is not None:
+            yield from stored()
+            return
+        documents = documents if isinstance(documents, (list, tuple)) else list(documents)
+        if not cache:
+            yield from self._iter_uncached(documents)
+            return
+        keys = []
+        miss_positions = []
+
+        with self._lock:
+            for position, text in enumerate(documents):
+                if not text or not isinstance(text, str):
+                    keys.append(None)
+                    continue
+                key = content_key(text)
+                keys.append(key)
+                if key not in self._cache:
+                    miss_positions.append(position)
+            self.misses += len(miss_positions)
+            self.hits += sum(1 for key in keys if key is not None) - len(miss_positions)
+
+        use_pool = self.workers > 1 and len(miss_positions) >= self.parallel_threshold
+        if use_pool:
+            computed = self._iter_pool_results(documents, miss_positions)
+        else:
+            computed = ((position, self.preprocessor.tokens(documents[position]))
+                        for position in miss_positions)
+
+        fresh = {}
+        computed = iter(computed)
+        for position, key in enumerate(keys):
+            if key is None:
+                yield ()
+                continue
+            tokens = fresh.pop(position, None)
+            if tokens is None:
+                tokens = self._lookup(key)
+            while tokens is None:
+                # Pull computed results until this document's arrives
+                try:
+                    done_position, done_tokens = next(computed)
+                except StopIteration:
+                    # It was a cache hit that got evicted in the meantime
+                    tokens = self.preprocessor.tokens(documents[position])
+                    self._store(key, tokens)
+                    break
+                self._store(keys[done_position], done_tokens)
+                if done_position == position:
+                    tokens = done_tokens
+                else:
+                    fresh[done_position] = done_tokens
+            yield tokens
+
+    def _iter_uncached(self, documents):
+        positions = [position for position, text in enumerate(documents) if text and isinstance(text, str)]
+        if self.workers > 1 and len(positions) >= self.parallel_threshold:
+            computed = self._iter_pool_results(documents, positions)
+        else:
+            computed = ((position, self.preprocessor.tokens(documents[position])) for position in positions)
+        computed = iter(computed)
+        for position, text in enumerate(documents):
+            if not text or not isinstance(text, str):
+                yield ()
+            else:
+                # Results come back in input order
+                yield next(computed)[1]
+
+    def tokenize_many(self, documents):
+        """Token tuples of all documents, as a list"""
+        return list(self.iter_tokens(documents))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached_documents': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+    def _lookup(self, key):
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+            return tokens
+
+    def _store(self, key, tokens):
+        with self._lock:
+            self._cache[key] = tokens
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _get_pool(self):
+        if self._pool is None:
+            # forkserver/spawn: forking a process that runs server threads is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.preprocessor.stopwords, self.preprocessor.min_length)
+            )
+        return self._pool
+
+    def _iter_pool_results(self, documents, positions):
+        """Yield (position, tokens) chunk by chunk, in submission order"""
+        pool = self._get_pool()
+        max_pending = self.workers * 2
+        chunks = [positions[i:i + self.chunk_size] for i in range(0, len(positions), self.chunk_size)]
+        pending = []
+        next_chunk = 0
+
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < max_pending:
+                chunk = chunks[next_chunk]
+                pending.append((chunk, pool.submit(_tokenize_chunk, [documents[p] for p in chunk])))
+                next_chunk += 1
+            chunk, future = pending.pop(0)
+            for position, tokens in zip(chunk, future.result()):
+                yield position, tokens
@@ -0,0 +1,380 @@
+"""
+Fit-once, transform-many theme model for the Flask analyzer.
+
+A ThemeModel freezes what a clustering run learned -- the vocabulary, the IDF
+weights and the theme centroids in term space -- so new documents can be
+assigned to the existing themes with one sparse transform and a
+nearest-centroid step instead of refitting TF-IDF and KMeans.
+
+Models are saved to a generation subdirectory named in a CURRENT file:
+
+    model.json      vocabulary, n-gram range, theme names/keywords, statistics
+    idf.npy         float32 IDF weights
+    centroids.npy   float32 centroids (n_themes x n_features)
+
+and the arrays are memory-mapped when loaded, so several worker processes
+share one copy in the page cache.
+
+ThemeModelManager owns the current model, tracks how well new documents fit
+it and refits in the background only when the drift passes a threshold.
+"""
+
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'CURRENT'
+MODEL_FILE = 'model.json'
+IDF_FILE = 'idf.npy'
+CENTROIDS_FILE = 'centroids.npy'
+
+
+def write_generation(directory, write):
+    """
+    Write a new generation subdirectory and point CURRENT at it.
+
+    Files of a generation are never rewritten, so processes that have the
+    previous arrays memory-mapped keep reading consistent data.
+
+    Args:
+        directory: Store directory
+        write: Callable(path) writing the generation's files into path
+    """
+    generation = f"{time.time_ns()}"
+    path = os.path.join(directory, generation)
+    os.makedirs(path, exist_ok=True)
+    write(path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(generation)
+    os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+
+    # Keep the previous generation for readers that have not reloaded yet
+    generations = sorted(name for name in os.listdir(directory) if name.isdigit())
+    for name in generations[:-2]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def current_generation(directory):
+    """Path of the generation CURRENT points at, or None if nothing was saved"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+class ThemeModel:
+    """
+    Frozen vocabulary, IDF weights and theme centroids.
+
+    Args:
+        terms: Vocabulary terms, ordered by feature index
+        idf: IDF weight of each term
+        centroids: Theme centroids in TF-IDF term space
+        themes: List of {'theme', 'keywords'} dicts, one per centroid
+        ngram_range: N-gram range the vocabulary was built with
+        corpus_version: Fingerprint of the corpus the model was fitted on
+        stats: Fit-time statistics (document count, similarity baseline)
+    """
+
+    def __init__(self, terms, idf, centroids, themes, ngram_range=(1, 1),
+                 corpus_version=None, stats=None):
+        self.terms = list(terms)
+        self.idf = idf
+        self.centroids = centroids
+        self.themes = themes
+        self.ngram_range = tuple(ngram_range)
+        self.corpus_version = corpus_version
+        self.stats = stats or {}
+
+        self._counter = CountVectorizer(
+            vocabulary={term: i for i, term in enumerate(self.terms)},
+            ngram_range=self.ngram_range,
+            dtype=np.float32
+        )
+        centroid_norms = np.linalg.norm(self.centroids, axis=1)
+        self._centroid_sq_norms = (centroid_norms ** 2).astype(np.float32)
+        self._centroid_norms = np.where(centroid_norms > 0, centroid_norms, 1.0).astype(np.float32)
+
+    @classmethod
+    def from_fit(cls, processed_docs, terms, idf, centroids, themes, ngram_range,
+                 corpus_version=None):
+        """Build a model from fitted artifacts and record its similarity baseline"""
+        model = cls(terms, np.asarray(idf, dtype=np.float32),
+                    np.asarray(centroids, dtype=np.float32), themes,
+                    ngram_range=ngram_range, corpus_version=corpus_version)
+        _, similarities = model.assign(processed_docs)
+        model.stats = {
+            'n_documents': len(processed_docs),
+            'similarity_mean': float(similarities.mean()) if len(similarities) else 0.0,
+            'fitted_at': time.time()
+        }
+        return model
+
+    def transform(self, processed_docs):
+        """L2-normalized float32 TF-IDF rows in the model's vocabulary"""
+        counts = self._counter.transform(processed_docs)
+        return normalize(counts.multiply(self.idf).tocsr(), norm='l2', copy=False)
+
+    def assign(self, processed_docs):
+        """
+        Assign documents to the nearest theme centroid.
+
+        Returns:
+            (labels, similarities): theme index and cosine similarity to that
+            theme's centroid for each document (0 when no term is known)
+        """
+        if not len(processed_docs):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        matrix = self.transform(processed_docs)
+        dots = np.asarray(matrix @ self.centroids.T, dtype=np.float32)
+        # Same choice as KMeans.predict: minimise ||x - c||^2 = ||c||^2 - 2 x.c + 1
+        labels = np.argmin(self._centroid_sq_norms - 2 * dots, axis=1).astype(np.int32)
+        rows = np.arange(len(labels))
+        similarities = dots[rows, labels] / self._centroid_norms[labels]
+        return labels, similarities
+
+    def save(self, directory):
+        """Write the model to a new generation subdirectory (see write_generation)"""
+        def write(path):
+            np.save(os.path.join(path, IDF_FILE), np.asarray(self.idf, dtype=np.float32))
+            np.save(os.path.join(path, CENTROIDS_FILE), np.asarray(self.centroids, dtype=np.float32))
+            meta = {
+                'terms': self.terms,
+                'themes': self.themes,
+                'ngram_range': list(self.ngram_range),
+                'corpus_version': self.corpus_version,
+                'stats': self.stats
+            }
+            with open(os.path.join(path, MODEL_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+        write_generation(directory, write)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load the current saved model.
+
+        Returns:
+            ThemeModel, or None if the directory holds no model
+        """
+        path = current_generation(directory)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, MODEL_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        mmap_mode = 'r' if mmap else None
+        idf = np.load(os.path.join(path, IDF_FILE), mmap_mode=mmap_mode)
+        centroids = np.load(os.path.join(path, CENTROIDS_FILE), mmap_mode=mmap_mode)
+        return cls(meta['terms'], idf, centroids, meta['themes'],
+                   ngram_range=meta['ngram_range'], corpus_version=meta['corpus_version'],
+                   stats=meta.get('stats'))
+
+
+class ThemeModelManager:
+    """
+    Keep the current ThemeModel, assign new documents and refit on drift.
+
+    Drift is 1 - (mean similarity of documents assigned since the last fit /
+    mean similarity of the training documents), so documents full of unknown
+    vocabulary or far from every centroid push it up. Only a running count
+    and similarity sum are kept for it; a refit uses the corpus plus a
+    uniform sample (reservoir) of the documents assigned since the corpus
+    was fitted, so memory stays bounded in a long-running server.
+
+    Args:
+        directory: Where the model is persisted (None keeps it in memory only)
+        fit_model: Callable(documents) -> ThemeModel or None
+        preprocess: Callable(text) -> preprocessed text, as used when fitting
+        drift_threshold: Drift above which a background refit is started
+        min_drift_samples: Documents to assign before drift is evaluated
+        max_refit_documents: Assigned documents sampled for refits at most
+    """
+
+    def __init__(self, directory, fit_model, preprocess, drift_threshold=0.3,
+                 min_drift_samples=20, max_refit_documents=5000):
+        self.directory = directory
+        self.fit_model = fit_model
+        self.preprocess = preprocess
+        self.drift_threshold = drift_threshold
+        self.min_drift_samples = min_drift_samples
+        self.max_refit_documents = max_refit_documents
+
+        self.model = None
+        self.base_documents = []
+        self.sampled_documents = []
+        self._offered = 0
+        self._assigned_count = 0
+        self._similarity_sum = 0.0
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._refit_thread = None
+        self.refit_count = 0
+
+    def ensure_model(self, documents, version):
+        """
+        Make sure a model for this corpus version is loaded.
+
+        The saved model is reused when its corpus version matches; otherwise
+        the corpus is fitted once and the model is saved.
+        """
+        with self._lock:
+            if self.model is not None and self.model.corpus_version == version:
+                return self.model
+
+            self.base_documents = list(documents)
+            self.sampled_documents = []
+            self._offered = 0
+            self._assigned_count = 0
+            self._similarity_sum = 0.0
+
+            model = ThemeModel.load(self.directory) if self.directory else None
+            if model is None or model.corpus_version != version:
+                model = self.fit_model(self.base_documents)
+                if model is None:
+                    return None
+                model.corpus_version = version
+                if self.directory:
+                    model.save(self.directory)
+                    # Reload so the arrays are memory-mapped like in other workers
+                    model = ThemeModel.load(self.directory)
+            self.model = model
+            return model
+
+    @property
+    def drift(self):
+        n_assigned = self._assigned_count
+        baseline = self.model.stats.get('similarity_mean') if self.model else None
+        if not n_assigned or not baseline:
+            return 0.0
+        return max(0.0, 1.0 - (self._similarity_sum / n_assigned) / baseline)
+
+    def assign(self, documents):
+        """
+        Assign documents to the current themes without refitting.
+
+        Returns:
+            List of theme dicts (same structure as extract_themes) holding the
+            given documents, sorted by size
+        """
+        model, labels = self.assign_labels(documents)
+
+        buckets = [[] for _ in model.themes]
+        for position, label in enumerate(labels):
+            buckets[label].append(position)
+
+        themes = [
+            {
+                'theme': meta['theme'],
+                'keywords': meta['keywords'],
+                'documents': [documents[p] for p in positions],
+                'document_ids': positions,
+                'size': len(positions)
+            }
+            for meta, positions in zip(model.themes, buckets) if positions
+        ]
+        return sorted(themes, key=lambda x: x['size'], reverse=True)
+
+    def assign_labels(self, documents):
+        """
+        Theme index of each document, recorded for drift tracking.
+
+        Returns:
+            (model, labels): the model used (labels index model.themes) and
+            one label per document
+        """
+        model = self.model
+        processed = [self.preprocess(doc) for doc in documents]
+        labels, similarities = model.assign(processed)
+
+        with self._lock:
+            self._assigned_count += len(documents)
+            self._similarity_sum += float(similarities.sum())
+            self._sample(documents)
+            self.maybe_refit()
+        return model, labels
+
+    def _sample(self, documents):
+        """Reservoir sampling: every assigned document is kept with equal probability (lock held)"""
+        for document in documents:
+            self._offered += 1
+            if len(self.sampled_documents) < self.max_refit_documents:
+                self.sampled_documents.append(document)
+            else:
+                slot = self._random.randrange(self._offered)
+                if slot < self.max_refit_documents:
+                    self.sampled_documents[slot] = document
+
+    def maybe_refit(self):
+        """Start a background refit when drift passes the threshold (lock held)"""
+        if self._assigned_count < self.min_drift_samples:
+            return
+        if self.drift <= self.drift_threshold:
+            return
+        if self._refit_thread is not None and self._refit_thread.is_alive():
+            return
+
+        documents = self.base_documents + self.sampled_documents
+        version = self.model.corpus_version
+        logger.info(f"Theme model drift {self.drift:.2f} > {self.drift_threshold}, refitting "
+                    f"on {len(documents)} documents")
+        self._refit_thread = threading.Thread(
+            target=self._refit, args=(documents, version), name='theme-model-refit', daemon=True
+        )
+        self._refit_thread.start()
+
+    def _refit(self, documents, version):
+        try:
+            model = self.fit_model(documents)
+        except Exception as e:
+            logger.error(f"Error refitting theme model: {e}")
+            return
+        if model is None:
+            return
+
+        # Keep the base corpus version so ensure_model() does not discard it
+        model.corpus_version = version
+        if self.directory:
+            model.save(self.directory)
+            model = ThemeModel.load(self.directory)
+
+        # The sample keeps growing towards max_refit_documents across refits;
+        # drift is measured against the new model from scratch
+        with self._lock:
+            self.model = model
+            self._assigned_count = 0
+            self._similarity_sum = 0.0
+            self.refit_count += 1
+
+    def status(self):
+        model = self.model
+        return {
+            'loaded': model is not None,
+            'corpus_version': model.corpus_version if model else None,
+            'themes': len(model.themes) if model else 0,
+            'features': len(model.terms) if model else 0,
+            'assigned_since_fit': self._assigned_count,
+            'refit_sample': len(self.sampled_documents),
+            'drift': round(self.drift, 4),
+            'drift_threshold': self.drift_threshold,
+            'refit_count': self.refit_count
+        }
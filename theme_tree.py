@@ -0,0 +1,458 @@
+"""
+Hierarchical sub-themes, computed once per corpus version.
+
+Below every top-level theme the builder grows a tree by divisive clustering:
+a node's members are split into up to `branching` sub-themes by repeatedly
+bisecting the largest group with spherical 2-means over sparse TF-IDF vectors
+(built from the analyzer's token stream), down to `max_depth` levels. Every
+node of the tree is indexed by name, so drilling into a theme at any depth is
+a dictionary lookup and the response only serializes the requested page.
+
+2-means is fitted on a sample of at most `sample_size` members and then
+applied to all of them in a single pass, so large themes cost one pass per
+bisection rather than one per iteration.
+
+When a new corpus version arrives the previous tree is updated instead of
+rebuilt where possible: a top-level theme keeps its subtree (and sub-theme
+names), documents that left it are dropped, new ones are routed down to the
+closest sub-theme, and leaves that grew large enough are split. A theme whose
+membership changed by more than `rebuild_fraction` of its size since it was
+clustered is rebuilt.
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from itertools import repeat
+from operator import mul
+
+from corpus_store import select_documents
+from profiling import stage
+from search_index import document_keys
+
+TREE_OPTIONS = {
+    'max_depth': int(os.getenv('THEME_TREE_MAX_DEPTH', '3')),
+    'branching': int(os.getenv('THEME_TREE_BRANCHING', '4')),
+    'min_size': int(os.getenv('THEME_TREE_MIN_SIZE', '4'))
+}
+
+# Sparse vectors keep only their heaviest terms
+MAX_TERMS = 32
+
+KEYWORDS = 10
+SEPARATOR = ' › '
+
+
+def _dot(vector, centroid):
+    """Dot product of a sparse vector with a (denser) centroid dict"""
+    return sum(map(mul, vector.values(), map(centroid.get, vector, repeat(0.0))))
+
+
+def _direction(left, right):
+    """right - left: a vector's dot with it is positive when it is closer to right"""
+    direction = dict(right)
+    for term, weight in left.items():
+        direction[term] = direction.get(term, 0.0) - weight
+    return direction
+
+
+def _accumulate(total, vector, sign=1.0):
+    """Add (or with sign=-1 subtract) a vector to a running sum in place"""
+    get = total.get
+    for term, weight in vector.items():
+        total[term] = get(term, 0.0) + sign * weight
+
+
+def _normalized(total):
+    norm = math.sqrt(sum(map(mul, total.values(), total.values()))) or 1.0
+    return {term: weight / norm for term, weight in total.items()}
+
+
+def _centroid(vectors):
+    """Normalized mean direction of some vectors"""
+    total = {}
+    for vector in vectors:
+        _accumulate(total, vector)
+    return _normalized(total)
+
+
+class TreeNode:
+    """
+    One theme of the tree.
+
+    Attributes:
+        name: Unique name (the parent's name plus this node's label)
+        level: 1 for top-level themes
+        ids: Corpus ids of the members
+        centroid: Normalized mean vector of the members
+        keywords: Terms most over-represented relative to the parent
+        children: Sub-themes, largest first
+        theme: The JSON-ready theme dict served by the API
+        built_size: Number of members when the subtree was last clustered
+        changed: Members added or removed since then (top-level themes)
+    """
+
+    __slots__ = ('name', 'level', 'ids', 'centroid', 'keywords', 'children', 'parent',
+                 'theme', 'built_size', 'changed')
+
+    def __init__(self, name, level, ids, centroid, keywords, parent=None):
+        self.name = name
+        self.level = level
+        self.ids = ids
+        self.centroid = centroid
+        self.keywords = keywords
+        self.parent = parent
+        self.children = []
+        self.theme = None
+        self.built_size = len(ids)
+        self.changed = 0
+
+    @property
+    def sub_themes(self):
+        return [child.theme for child in self.children]
+
+    def path(self):
+        """Names from the top-level theme down to this node"""
+        names = []
+        node = self
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        return names[::-1]
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class ThemeTree:
+    """
+    Theme tree of one corpus version; read-only once built.
+
+    Attributes:
+        roots: One node per top-level theme, in theme order
+        nodes: Every node by name
+        stats: How the tree was obtained (rebuilt and reused subtrees, time)
+    """
+
+    __slots__ = ('version', 'keys', 'roots', 'nodes', 'df', 'n_documents', 'stats')
+
+    def __init__(self, version, keys, roots, df, n_documents, stats):
+        self.version = version
+        self.keys = keys
+        self.roots = roots
+        self.nodes = {node.name: node for root in roots for node in root.walk()}
+        self.df = df
+        self.n_documents = n_documents
+        self.stats = stats
+
+    def node(self, name):
+        """The node called name, or None"""
+        return self.nodes.get(name)
+
+    def depth(self):
+        return max((node.level for node in self.nodes.values()), default=0)
+
+
+class ThemeTreeBuilder:
+    """
+    Builds and incrementally updates the theme tree of the current corpus.
+
+    Args:
+        tokenize_many: Callable(list of texts) -> iterable of token sequences
+        max_depth: Levels of sub-themes below each top-level theme
+        branching: Maximum sub-themes per node
+        min_size: Nodes with fewer members are not split
+        sample_size: Members 2-means is fitted on
+        iterations: Maximum 2-means iterations
+        rebuild_fraction: Fraction of a theme's members added or removed after
+            which its subtree is reclustered
+    """
+
+    def __init__(self, tokenize_many, max_depth=3, branching=4, min_size=4, sample_size=500,
+                 iterations=8, rebuild_fraction=0.5):
+        self.tokenize_many = tokenize_many
+        self.max_depth = max_depth
+        self.branching = branching
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.iterations = iterations
+        self.rebuild_fraction = rebuild_fraction
+        self.tree = None
+        self._lock = threading.Lock()
+
+    def sync(self, documents, themes, version):
+        """
+        The tree of a corpus version, built (or updated) on the first call.
+
+        Args:
+            documents: Document texts (a sequence or a view of a corpus
+                store), indexed by corpus id
+            themes: Top-level theme dicts with unique 'theme' names and their
+                members' corpus ids in 'document_ids'
+            version: Corpus version
+        """
+        tree = self.tree
+        if tree is not None and tree.version == version:
+            return tree
+        with self._lock:
+            tree = self.tree
+            if tree is not None and tree.version == version:
+                return tree
+            with stage('theme_tree'):
+                self.tree = self._build(documents, themes, version, tree)
+            return self.tree
+
+    def stats(self):
+        tree = self.tree
+        if tree is None:
+            return {'built': False}
+        return dict(tree.stats, built=True, version=tree.version, nodes=len(tree.nodes),
+                    depth=tree.depth())
+
+    def _build(self, documents, themes, version, previous):
+        started = time.perf_counter()
+        keys = document_keys(documents)
+        # The first theme wins when two share a name (as in the analysis' by_name)
+        unique = {}
+        for theme in themes:
+            unique.setdefault(theme['theme'], theme)
+        themes = list(unique.values())
+        members = [theme['document_ids'] for theme in themes]
+
+        # Old corpus ids -> new ones, for documents still in the corpus
+        remap = None
+        if previous is not None:
+            position = {key: i for i, key in enumerate(keys)}
+            remap = [position.get(key) for key in previous.keys]
+
+        # Reuse the subtree of a theme unless too many members came or went
+        # since it was clustered
+        plans = []
+        for theme, ids in zip(themes, members):
+            old = previous.node(theme['theme']) if previous is not None else None
+            kept = changed = None
+            if old is not None and old.level == 1:
+                current = set(ids)
+                kept = [j for j in (remap[i] for i in old.ids) if j is not None and j in current]
+                changed = old.changed + (len(old.ids) - len(kept)) + (len(ids) - len(kept))
+                if changed > old.built_size * self.rebuild_fraction:
+                    kept = None
+            plans.append((theme, ids, old if kept is not None else None, kept, changed))
+
+        # Tokens of the documents that are (re)clustered or routed
+        needed = set()
+        for _, ids, old, kept, _ in plans:
+            needed.update(ids if old is None else set(ids) - set(kept))
+        needed = sorted(needed)
+        tokens_by_id = dict(zip(needed, self._tokens(documents, needed)))
+
+        # Document frequencies over the tree's members, updated incrementally
+        if previous is None:
+            df, n_documents, new = {}, 0, needed
+        else:
+            df, n_documents = dict(previous.df), previous.n_documents
+            known = {remap[i] for root in previous.roots for i in root.ids}
+            new = [i for i in needed if i not in known]
+        for i in new:
+            for term in set(tokens_by_id[i]):
+                df[term] = df.get(term, 0) + 1
+        n_documents += len(new)
+
+        vectors = {i: self._vector(tokens, df, n_documents) for i, tokens in tokens_by_id.items()}
+
+        def load_vectors(ids):
+            missing = [i for i in ids if i not in vectors]
+            for i, tokens in zip(missing, self._tokens(documents, missing)):
+                vectors[i] = self._vector(tokens, df, n_documents)
+
+        roots = []
+        rebuilt = reused = routed = 0
+        for theme, ids, old, kept, changed in plans:
+            if old is None:
+                root = TreeNode(theme['theme'], 1, list(ids),
+                                _centroid(vectors[i] for i in ids), theme['keywords'])
+                self._split(root, vectors)
+                rebuilt += 1
+            else:
+                root = self._copy(old, remap, set(kept), None)
+                root.changed = changed
+                added = sorted(set(ids) - set(kept))
+                for i in added:
+                    self._route(root, i, vectors)
+                root.ids = list(ids)  # theme order
+                grown = [node for node in root.walk()
+                         if not node.children and len(node.ids) > node.built_size
+                         and len(node.ids) >= self.min_size]
+                for node in grown:
+                    load_vectors(node.ids)
+                    self._split(node, vectors)
+                reused += 1
+                routed += len(added)
+            root.theme = theme
+            for node in root.walk():
+                if node is not root:
+                    node.theme = self._theme(node, documents)
+            roots.append(root)
+
+        stats = {'rebuilt': rebuilt, 'reused': reused, 'routed': routed,
+                 'took_ms': round((time.perf_counter() - started) * 1000, 3)}
+        return ThemeTree(version, keys, roots, df, n_documents, stats)
+
+    def _tokens(self, documents, ids):
+        return list(self.tokenize_many(select_documents(documents, ids)))
+
+    def _vector(self, tokens, df, n_documents):
+        """Sublinear TF-IDF vector of a token list, L2-normalized"""
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        weights = {
+            term: (1.0 + math.log(count)) * (math.log((1 + n_documents) / (1 + df.get(term, 0))) + 1.0)
+            for term, count in counts.items()
+        }
+        if len(weights) > MAX_TERMS:
+            weights = dict(sorted(weights.items(), key=lambda item: item[1], reverse=True)[:MAX_TERMS])
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        return {term: weight / norm for term, weight in weights.items()}
+
+    def _bisect(self, ids, vectors):
+        """
+        Split ids in two with spherical 2-means.
+
+        Returns:
+            Two non-empty id lists, or None when the members cannot be told apart
+        """
+        sample = ids
+        if len(ids) > self.sample_size:
+            sample = random.Random(len(ids)).sample(ids, self.sample_size)
+
+        # Seeds: the member farthest from the mean, then the one farthest from it
+        mean = _centroid(vectors[i] for i in sample)
+        first = min(sample, key=lambda i: _dot(vectors[i], mean))
+        second = min(sample, key=lambda i: _dot(vectors[i], vectors[first]))
+        if first == second:
+            return None
+        centroids = (vectors[first], vectors[second])
+
+        # One dot product per member and iteration, against the centroids'
+        # difference; the sums behind the centroids are only updated with the
+        # members that changed sides
+        direction = _direction(*centroids)
+        assignment = None
+        sums = None
+        converged = False
+        for _ in range(self.iterations):
+            sides = [_dot(vectors[i], direction) > 0 for i in sample]
+            if sides == assignment:
+                converged = True
+                break
+            counts = (sides.count(False), sides.count(True))
+            if not counts[0] or not counts[1]:
+                return None
+            if sums is None:
+                sums = ({}, {})
+                for i, side in zip(sample, sides):
+                    _accumulate(sums[side], vectors[i])
+            else:
+                for i, old, new in zip(sample, assignment, sides):
+                    if old != new:
+                        _accumulate(sums[old], vectors[i], -1.0)
+                        _accumulate(sums[new], vectors[i])
+            assignment = sides
+            direction = _direction(_normalized(sums[0]), _normalized(sums[1]))
+
+        if sample is ids and converged:
+            return ([i for i, side in zip(sample, sides) if not side],
+                    [i for i, side in zip(sample, sides) if side])
+        groups = ([], [])
+        for i in ids:
+            groups[_dot(vectors[i], direction) > 0].append(i)
+        if not groups[0] or not groups[1]:
+            return None
+        return groups
+
+    def _split(self, node, vectors):
+        """Grow the subtree below a node (replacing any children)"""
+        node.children = []
+        node.built_size = len(node.ids)
+        if node.level > self.max_depth or len(node.ids) < self.min_size:
+            return
+
+        groups = [node.ids]
+        settled = []
+        while len(groups) + len(settled) < self.branching and groups:
+            groups.sort(key=len)
+            largest = groups.pop()
+            halves = self._bisect(largest, vectors) if len(largest) >= self.min_size else None
+            if halves is None:
+                settled.append(largest)
+            else:
+                groups.extend(halves)
+        groups += settled
+        if len(groups) < 2:
+            return
+
+        groups.sort(key=len, reverse=True)
+        children = []
+        for ids in groups:
+            children.append(TreeNode(None, node.level + 1, sorted(ids),
+                                     _centroid(vectors[i] for i in ids), None, parent=node))
+        self._label(node, children)
+        node.children = children
+        for child in children:
+            self._split(child, vectors)
+
+    def _label(self, parent, children):
+        """Keywords and unique names of a node's new children"""
+        used = set(parent.keywords[:3])
+        ancestor = parent
+        while ancestor is not None:
+            used.add(ancestor.name.rsplit(SEPARATOR, 1)[-1])
+            ancestor = ancestor.parent
+
+        for number, child in enumerate(children, 1):
+            distinct = {term: weight - parent.centroid.get(term, 0.0)
+                        for term, weight in child.centroid.items()}
+            ranked = sorted(distinct, key=distinct.get, reverse=True)
+            child.keywords = [term for term in ranked if distinct[term] > 0][:KEYWORDS] or ranked[:KEYWORDS]
+            label = next((term for term in child.keywords if term not in used), f"grupo {number}")
+            used.add(label)
+            child.name = f"{parent.name}{SEPARATOR}{label}"
+
+    def _copy(self, node, remap, kept, parent):
+        """
+        A node and its subtree with corpus ids mapped to the new version,
+        keeping only the members in kept and the sub-themes left with any
+        """
+        ids = [j for j in (remap[i] for i in node.ids) if j in kept]
+        copy = TreeNode(node.name, node.level, ids, node.centroid, node.keywords, parent=parent)
+        copy.built_size = node.built_size
+        children = [self._copy(child, remap, kept, copy) for child in node.children]
+        children = [child for child in children if child.ids]
+        copy.children = children if len(children) > 1 else []
+        return copy
+
+    def _route(self, root, doc_id, vectors):
+        """Add a new member to the closest sub-theme at every level"""
+        vector = vectors[doc_id]
+        node = root
+        while node.children:
+            node = max(node.children, key=lambda child: _dot(vector, child.centroid))
+            node.ids.append(doc_id)
+
+    def _theme(self, node, documents):
+        ids = sorted(node.ids)
+        node.ids = ids
+        return {
+            'theme': node.name,
+            'keywords': node.keywords,
+            'documents': select_documents(documents, ids),
+            'document_ids': ids,
+            'size': len(ids),
+            'level': node.level,
+            'sub_themes': len(node.children)
+        }
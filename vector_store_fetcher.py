@@ -0,0 +1,198 @@
+"""
+Concurrent document fetcher for the OpenAI Vector Store.
+
+Pages through every file in a vector store and downloads the file contents
+in parallel over one shared client (and therefore one HTTP connection pool),
+retrying transient failures with exponential backoff. Documents are yielded
+as soon as they arrive, so callers can start working before the whole store
+has been downloaded.
+
+The fetcher only relies on two client calls:
+
+    client.vector_stores.files.list(vector_store_id=..., limit=..., after=...)
+    client.files.content(file_id)
+
+(older SDK releases expose the first one under client.beta), so it can be
+exercised against any object exposing them; tests/fake_vector_store.py is an
+in-memory fake with paginated listing and scripted failures, used by
+tests/test_vector_store_fetcher.py.
+"""
+
+import importlib.util
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# The SDK takes over half a second to import, so it is only imported when the
+# first client is created
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
+
+# HTTP status codes worth retrying; any other 4xx is a permanent failure
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_shared_client():
+    """
+    Return the process-wide OpenAI client, creating it on first use.
+
+    All fetches share this client so they reuse its HTTP connection pool.
+    Retries are disabled in the SDK because the fetcher does its own backoff.
+
+    Returns:
+        OpenAI client, or None if the SDK or the API key is not available
+    """
+    global _client
+
+    if not OPENAI_AVAILABLE:
+        return None
+
+    with _client_lock:
+        if _client is None:
+            api_key = os.getenv('OPENAI_API_KEY')
+            if not api_key:
+                return None
+            from openai import OpenAI
+            _client = OpenAI(
+                api_key=api_key,
+                base_url=os.getenv('OPENAI_BASE_URL') or None,
+                max_retries=0
+            )
+        return _client
+
+
+def is_retryable(error):
+    """Decide whether an API error is transient"""
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        # Connection errors, timeouts and other failures without a response
+        return True
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+class VectorStoreFetcher:
+    """
+    Page through a vector store and download file contents concurrently.
+
+    Args:
+        client: OpenAI-compatible client (shared across threads)
+        vector_store_id: Vector store to read
+        max_workers: Maximum number of concurrent content downloads
+        page_size: Number of files requested per list page (API maximum is 100)
+        max_retries: Retries per call after the first attempt
+        backoff_base: Initial backoff delay in seconds
+        backoff_max: Upper bound for a single backoff delay in seconds
+    """
+
+    def __init__(self, client, vector_store_id, max_workers=8, page_size=100,
+                 max_retries=4, backoff_base=0.5, backoff_max=8.0):
+        self.client = client
+        self.vector_store_id = vector_store_id
+        self.max_workers = max(1, max_workers)
+        self.page_size = max(1, min(page_size, 100))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def vector_store_files(self):
+        """The vector store files resource (moved out of client.beta in newer SDKs)"""
+        vector_stores = getattr(self.client, 'vector_stores', None)
+        if vector_stores is None:
+            vector_stores = self.client.beta.vector_stores
+        return vector_stores.files
+
+    def call_with_retry(self, func, *args, **kwargs):
+        """Call func, retrying transient errors with jittered exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                attempt += 1
+
+    def iter_files(self, max_files=None):
+        """
+        Yield every file object in the vector store, following the list cursor.
+
+        Args:
+            max_files: Stop after this many files (None for the whole store)
+        """
+        after = None
+        yielded = 0
+
+        while True:
+            params = {'vector_store_id': self.vector_store_id, 'limit': self.page_size}
+            if after is not None:
+                params['after'] = after
+
+            page = self.call_with_retry(self.vector_store_files().list, **params)
+            data = list(page.data)
+
+            for file_obj in data:
+                yield file_obj
+                yielded += 1
+                if max_files is not None and yielded >= max_files:
+                    return
+
+            if not data or not getattr(page, 'has_more', False):
+                return
+            after = data[-1].id
+
+    def fetch_content(self, file_id):
+        """Download the text content of a single file"""
+        response = self.call_with_retry(self.client.files.content, file_id)
+        return response.text
+
+    def iter_contents(self, files):
+        """
+        Download the given files concurrently, yielding results as they arrive.
+
+        At most 2 * max_workers downloads are queued at any time, so memory use
+        does not grow with the size of the store.
+
+        Args:
+            files: Iterable of file objects (or file ids)
+
+        Yields:
+            (file_id, text, error) tuples in completion order; text is None and
+            error holds the exception when a download failed for good
+        """
+        files = iter(files)
+        max_pending = self.max_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix='vector-store-fetch') as executor:
+            pending = {}
+
+            def submit_next():
+                for file_obj in files:
+                    file_id = getattr(file_obj, 'id', file_obj)
+                    pending[executor.submit(self.fetch_content, file_id)] = file_id
+                    return True
+                return False
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_id = pending.pop(future)
+                    try:
+                        yield file_id, future.result(), None
+                    except Exception as e:
+                        yield file_id, None, e
+                while len(pending) < max_pending and submit_next():
+                    pass
+
+    def iter_documents(self, max_files=None):
+        """Stream (file_id, text, error) for every file in the vector store"""
+        return self.iter_contents(self.iter_files(max_files=max_files))